@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from protocol import *
+
+CLIENTS = (10, 100, 300)
+ITERATIONS = 200
+
+
+class Recipient:
+    # Only what a broadcast reads from a Node, half the clients use the binary codec
+    def __init__(self, index: int):
+        self.features = SUPPORTED_FEATURES if index % 2 else set()
+
+
+def message() -> Protocol:
+    return Protocol(
+        protocol_type=ProtocolType.BROADCAST,
+        method=ProtocolMethod.DEMO,
+        content=json.dumps({"TAG": "T1", "VALUE": 42.0}),
+    )
+
+
+def per_client_validate(broadcast: Protocol, clients: list):
+    # Every recipient validated and serialized its own copy of the message
+    for client in clients:
+        data = {field.name: broadcast[field] for field in Field if field is not Field.SEQ}
+        data[Field.ID.name] = "Server"
+        DEFAULT_VALIDATOR.validator().validate(data)
+        Protocol.frame(json.dumps(data).encode("ascii"))
+
+
+def per_client_send(broadcast: Protocol, clients: list):
+    # __send_data per recipient, the single frame cache swaps between codecs
+    for client in clients:
+        broadcast["ID"] = "Server"
+        Protocol.pipeline([broadcast], features=client.features)
+        str(broadcast)
+
+
+def encode_once(broadcast: Protocol, clients: list):
+    broadcast.id = "Server"
+    frames = {}
+    for client in clients:
+        key = Protocol._frame_key("ascii", client.features)
+        if key not in frames:
+            frames[key] = broadcast.to_network(features=client.features)
+    str(broadcast)
+
+
+def run(name, func, count):
+    clients = [Recipient(index) for index in range(count)]
+
+    # A new message per broadcast, nothing is cached from the previous one
+    def broadcast():
+        func(message(), clients)
+
+    seconds = timeit.timeit(broadcast, number=ITERATIONS)
+    return [name, count, f"{seconds / ITERATIONS * 1e6:.1f}"]
+
+
+if __name__ == "__main__":
+    results = []
+    for count in CLIENTS:
+        rows = [
+            run("per client: validate and dump", per_client_validate, count),
+            run("per client: __send_data", per_client_send, count),
+            run("encode once", encode_once, count),
+        ]
+        baseline = float(rows[0][2])
+        for row in rows:
+            row.append(f"{baseline / float(row[2]):.1f}x")
+        results.extend(rows)
+
+    CLI.message(f"Broadcast Fan-out ({ITERATIONS} broadcasts)", width_fraction=60)
+    CLI.table(results, headers=["Path", "Clients", "us / broadcast", "Speedup"])
@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import jsonschema
+import lib_cli as CLI
+from protocol import *
+
+CONNECTIONS = 5000
+
+# Control messages sent for one client connecting and later disconnecting
+STORM = [
+    Protocols.INIT_SUCCESS,
+    FrozenProtocol(id="NodeA", method=ProtocolMethod.INIT, state=ProtocolState.AWK),
+    FrozenProtocol(id="NodeA", method=ProtocolMethod.EXIT, state=ProtocolState.REQ_AWK),
+    Protocols.EXIT_AWK,
+]
+FIELDS = [
+    (message.protocol_type, message.method, message.state, message.content, message.id)
+    for message in STORM
+]
+
+
+def rebuild_validate():
+    # Send path prior to the cached validator: built, validated and dumped per send
+    for protocol_type, method, state, content, id in FIELDS:
+        data = {
+            Field.TYPE.name: protocol_type.value,
+            Field.ID.name: id,
+            Field.METHOD.name: method.value,
+            Field.BODY.name: content,
+            Field.STATE.name: state.value,
+        }
+        jsonschema.validate(instance=data, schema=DEFAULT_SCHEMA)
+        text = json.dumps(data)
+        Protocol.frame(text.encode("ascii"))
+
+
+def rebuild_trusted():
+    # Send path prior to the templates: a new message per send, then logged
+    for protocol_type, method, state, content, id in FIELDS:
+        message = Protocol(
+            protocol_type=protocol_type,
+            method=method,
+            state=state,
+            content=content,
+            id=id,
+        )
+        message.to_network()
+        str(message)
+
+
+def template():
+    for message in STORM:
+        message.to_network()
+        str(message)
+
+
+def run(name, func):
+    seconds = timeit.timeit(func, number=CONNECTIONS)
+    per_connection = seconds / CONNECTIONS * 1e6
+    return [
+        name,
+        f"{per_connection / len(STORM):.2f}",
+        f"{per_connection:.2f}",
+        f"{CONNECTIONS / seconds:,.0f}",
+    ]
+
+
+if __name__ == "__main__":
+    results = [
+        run("rebuilt: jsonschema.validate", rebuild_validate),
+        run("rebuilt: trusted", rebuild_trusted),
+        run("frozen template", template),
+    ]
+    baseline = float(results[0][1])
+    for row in results:
+        row.append(f"{baseline / float(row[1]):.1f}x")
+
+    CLI.message(f"Control Messages ({CONNECTIONS} connections)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=[
+            "Path",
+            "us / message",
+            "us / connection",
+            "connections / s",
+            "Speedup",
+        ],
+    )
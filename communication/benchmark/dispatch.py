@@ -0,0 +1,89 @@
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+import server as SERVER
+from protocol import *
+
+ITERATIONS = 200_000
+
+
+def demo_hook(server, client, message):
+    return False
+
+
+def preamble(message: Protocol, is_receiving: bool) -> bool:
+    # The checks __process_message makes before its dispatch table, so that
+    # the rows only differ in how the method is looked up
+    if is_receiving and message.seq:
+        return True
+    if is_receiving and message.dest and message.protocol_type is ProtocolType.DIRECT:
+        return True
+    if message.protocol_type is ProtocolType.BATCH:
+        return True
+    return message.protocol_type is ProtocolType.STREAM and is_receiving
+
+
+def dispatch_chain(server, client, message: Protocol, is_receiving=True):
+    # Routing prior to the dispatch table: one Protocol.__eq__ per built-in method
+    if not message:
+        return False
+    if preamble(message, is_receiving):
+        return False
+    if message == ProtocolMethod.EXIT:
+        return True
+    if message == ProtocolMethod.INIT and is_receiving:
+        return False
+    if message == Protocols.SHOW:
+        return False
+    if message == ProtocolMethod.COMMAND:
+        return False
+    return demo_hook(server, client, message)
+
+
+def dispatch_chain_strings(server, client, message: Protocol, is_receiving=True):
+    # The same chain with the string comparison Protocol.__eq__ used to make
+    method = lambda: message[Field.METHOD]
+    if not message:
+        return False
+    if preamble(message, is_receiving):
+        return False
+    if method() == ProtocolMethod.EXIT.value:
+        return True
+    if method() == ProtocolMethod.INIT.value and is_receiving:
+        return False
+    if method() == Protocols.SHOW[Field.METHOD]:
+        return False
+    if method() == ProtocolMethod.COMMAND.value:
+        return False
+    return demo_hook(server, client, message)
+
+
+def run(name, func):
+    seconds = timeit.timeit(func, number=ITERATIONS)
+    return [name, f"{seconds / ITERATIONS * 1e9:.0f}", f"{ITERATIONS / seconds:,.0f}"]
+
+
+if __name__ == "__main__":
+    SERVER.LOG = False
+    server = SERVER.Server(host="127.0.0.1", port=0, receive_hook=demo_hook)
+    process_message = server._Server__process_message
+    message = Protocol(method=ProtocolMethod.DEMO, content="42")
+
+    results = [
+        run("if chain, string __eq__", lambda: dispatch_chain_strings(server, None, message)),
+        run("if chain", lambda: dispatch_chain(server, None, message)),
+    ]
+    results.append(
+        run("dispatch table, hook", lambda: process_message(None, message, True))
+    )
+    server.register_handler(ProtocolMethod.DEMO, demo_hook)
+    results.append(
+        run("dispatch table, handler", lambda: process_message(None, message, True))
+    )
+    server.sock.close()
+
+    CLI.message(f"Dispatch Benchmark ({ITERATIONS:,} messages)", width_fraction=60)
+    CLI.table(results, headers=["Routing", "ns / message", "messages / s"])
@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import jsonschema
+import lib_cli as CLI
+from protocol import *
+
+ITERATIONS = 20000
+
+
+def encode_before(message: Protocol) -> bytes:
+    # Encode path prior to the cached validator: a new validator per message
+    data = {field.name: message[field] for field in Field}
+    jsonschema.validate(instance=data, schema=DEFAULT_SCHEMA)
+    return Protocol.frame(json.dumps(data).encode("ascii"))
+
+
+def encode_validator(message: Protocol) -> bytes:
+    data = {field.name: message[field] for field in Field}
+    DEFAULT_VALIDATOR.validator().validate(data)
+    return Protocol.frame(json.dumps(data).encode("ascii"))
+
+
+# Setting a field drops the cached frame, so these measure a full encode
+def encode_trusted(message: Protocol) -> bytes:
+    message.content = "42"
+    return message.to_network()
+
+
+def encode_binary(message: Protocol) -> bytes:
+    message.content = "42"
+    return message.to_network(features=SUPPORTED_FEATURES)
+
+
+def encode_cached(message: Protocol) -> bytes:
+    return message.to_network()
+
+
+def decode(payload: bytes) -> Protocol:
+    return Protocol.from_network(payload)
+
+
+def decode_binary(payload: bytes) -> Protocol:
+    return Protocol.from_network(payload, FrameFlag.BINARY)
+
+
+def run(name, func, arg, size):
+    seconds = timeit.timeit(lambda: func(arg), number=ITERATIONS)
+    return [
+        name,
+        size,
+        f"{seconds / ITERATIONS * 1e6:.2f}",
+        f"{ITERATIONS / seconds:,.0f}",
+    ]
+
+
+if __name__ == "__main__":
+    message = Protocol(method=ProtocolMethod.DEMO, content="42", id="NodeA")
+    frame = encode_trusted(message)
+    binary_frame = encode_binary(message)
+    payload = frame[FRAME_HEADER.size :]
+    binary_payload = binary_frame[FRAME_HEADER.size :]
+
+    results = [
+        run("encode: jsonschema.validate", encode_before, message, len(frame)),
+        run("encode: cached validator", encode_validator, message, len(frame)),
+        run("encode: trusted", encode_trusted, message, len(frame)),
+        run("encode: binary", encode_binary, message, len(binary_frame)),
+        run("encode: cached frame", encode_cached, message, len(frame)),
+        run("decode: field checks", decode, payload, len(frame)),
+        run("decode: binary", decode_binary, binary_payload, len(binary_frame)),
+    ]
+    baseline = float(results[0][2])
+    for row in results:
+        row.append(f"{baseline / float(row[2]):.1f}x")
+
+    CLI.message(f"Protocol Encode Benchmark ({ITERATIONS} messages)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=["Path", "Frame bytes", "us / message", "messages / s", "Speedup"],
+    )
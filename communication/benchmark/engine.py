@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from protocol import *
+import server
+from server import AsyncServer, Server, ENGINES
+
+CLIENTS = (1, 100, 1000)
+MESSAGES = 20000
+PINGS = 200
+
+
+def write_config(count: int) -> str:
+    nodes = [
+        {"ID": f"Node{i}", "IP": "127.0.0.1", "SUBNET_MASK": "255.255.255.0", "TAGS": []}
+        for i in range(count)
+    ]
+    handle, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(handle, "w") as file:
+        json.dump({"Nodes": nodes}, file)
+    return path
+
+
+def start_server(engine: str, count: int, receive_hook):
+    """Starts a server on a free port, returns its address and a stop function."""
+    # The raw socket clients never answer PING, heartbeats would drop them
+    if engine == "asyncio":
+        server = AsyncServer(
+            host="127.0.0.1", port=0, receive_hook=receive_hook, heartbeat=None
+        )
+    else:
+        server = Server(
+            host="127.0.0.1",
+            port=0,
+            receive_hook=receive_hook,
+            engine=engine,
+            heartbeat=None,
+        )
+        # The client table is printed on every connection, it is not measured
+        server.show_clients = lambda: None
+    config_path = write_config(count)
+    server.config.load(config_path, server.config_schema_path)
+
+    if engine == "asyncio":
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_until_complete, args=(server.serve(),))
+        thread.start()
+        while server.server is None or not server.server.is_serving():
+            time.sleep(0.01)
+        address = server.server.sockets[0].getsockname()
+
+        def stop():
+            loop.call_soon_threadsafe(server.server.close)
+            thread.join()
+            loop.close()
+
+    else:
+        thread = threading.Thread(
+            target=server._Server__receive_selector
+            if engine == "selector"
+            else server._Server__receive
+        )
+        thread.start()
+        address = server.sock.getsockname()
+
+        def stop():
+            server._Server__exit_event.set()
+            thread.join()
+            server.sock.close()
+
+    def stop_and_clean():
+        stop()
+        os.remove(config_path)
+
+    return address, stop_and_clean
+
+
+def clients(address, count: int, rounds: int, pipe):
+    # Raw sockets stand in for clients, each one waits for its INIT SUCCESS.
+    # They live in their own process, like real nodes, so the server process
+    # only holds its own sockets.
+    socks = []
+    for _ in range(count):
+        sock = socket.create_connection(address)
+        FrameBuffer().receive(sock)
+        socks.append(sock)
+    frame = Protocol(method=ProtocolMethod.DEMO, content="42", id="Node").to_network()
+    pipe.send("ready")
+    while True:
+        command = pipe.recv()
+        if command is None:
+            break
+        if command == "burst":
+            for _ in range(rounds):
+                for sock in socks:
+                    sock.sendall(frame)
+        else:
+            socks[command % count].sendall(frame)
+    for sock in socks:
+        sock.close()
+
+
+def run(engine: str, count: int) -> list:
+    lock = threading.Lock()
+    received = [0, 0]
+    done = threading.Event()
+
+    def receive_hook(server, client, message):
+        with lock:
+            received[0] += 1
+            if received[0] >= received[1]:
+                done.set()
+        return False
+
+    def expect(messages: int):
+        with lock:
+            received[0], received[1] = 0, messages
+            done.clear()
+
+    address, stop = start_server(engine, count, receive_hook)
+    rounds = max(1, MESSAGES // count)
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(
+        target=clients, args=(address, count, rounds, child_pipe)
+    )
+    child.start()
+    try:
+        pipe.recv()
+        threads = threading.active_count()
+
+        # Throughput: every client sends in turn, `rounds` times
+        expect(rounds * count)
+        began = time.perf_counter()
+        pipe.send("burst")
+        done.wait(60)
+        throughput = rounds * count / (time.perf_counter() - began)
+
+        # Latency: one message at a time, the hook is the end of the trip
+        latencies = []
+        for i in range(PINGS):
+            expect(1)
+            began = time.perf_counter()
+            pipe.send(i)
+            done.wait(5)
+            latencies.append(time.perf_counter() - began)
+        latencies.sort()
+    finally:
+        pipe.send(None)
+        child.join()
+        stop()
+
+    return [
+        engine,
+        count,
+        threads,
+        f"{throughput:,.0f}",
+        f"{latencies[len(latencies) // 2] * 1e6:.0f}",
+        f"{latencies[int(len(latencies) * 0.99)] * 1e6:.0f}",
+    ]
+
+
+if __name__ == "__main__":
+    server.LOG = False
+    results = []
+    for count in CLIENTS:
+        for engine in ENGINES + ("asyncio",):
+            # Connection messages are not part of the measurement
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results.append(run(engine, count))
+
+    CLI.message(f"Server Engines ({MESSAGES} messages)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=[
+            "Engine",
+            "Clients",
+            "Server threads",
+            "messages / s",
+            "p50 latency us",
+            "p99 latency us",
+        ],
+    )
@@ -0,0 +1,62 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from timers import TimerWheel
+
+DEADLINES = (1000, 5000, 10000)
+TIMEOUT = 30.0
+
+
+def thread_timers(count: int):
+    # Request timeouts prior to the wheel: one threading.Timer each
+    timers = []
+    for _ in range(count):
+        timer = threading.Timer(TIMEOUT, lambda: None)
+        timer.daemon = True
+        timer.start()
+        timers.append(timer)
+    peak = threading.active_count()
+    for timer in timers:
+        timer.cancel()
+    for timer in timers:
+        timer.join()
+    return peak
+
+
+def wheel_timers(count: int):
+    wheel = TimerWheel()
+    timers = [wheel.schedule(TIMEOUT, lambda: None) for _ in range(count)]
+    peak = threading.active_count()
+    for timer in timers:
+        timer.cancel()
+    return peak
+
+
+def run(name, func, count) -> list:
+    began = time.perf_counter()
+    peak = func(count)
+    seconds = time.perf_counter() - began
+    return [name, count, f"{seconds / count * 1e6:.2f}", peak]
+
+
+if __name__ == "__main__":
+    results = []
+    for count in DEADLINES:
+        rows = [
+            run("threading.Timer", thread_timers, count),
+            run("timer wheel", wheel_timers, count),
+        ]
+        baseline = float(rows[0][2])
+        for row in rows:
+            row.append(f"{baseline / float(row[2]):.1f}x")
+        results.extend(rows)
+
+    CLI.message("Deadlines (schedule and cancel)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=["Timers", "Deadlines", "us / deadline", "Threads", "Speedup"],
+    )
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from logger import SUMMARY_INTERVAL, ConsoleSink, MessageLog
+from protocol import Protocol, ProtocolMethod
+
+MESSAGES = 20000
+PEER = "10.1.1.2:5000"
+# Seconds a write to the slow console blocks, like a terminal that scrolls
+SLOW_WRITE = 0.0002
+
+
+class SlowConsole:
+    def write(self, text: str):
+        time.sleep(SLOW_WRITE)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def inline(console, lock):
+    # Server.__log_send prior to the MessageLog: formats and prints on the I/O thread
+    def log(message):
+        output = f"[LOG - {time.strftime('%X')}] {CLI.color('steelblue', 'SENDING:')}\n"
+        output += f"{str(message)} --> {CLI.color('aquamarine', PEER)}\n"
+        with lock:
+            print(CLI.color("gray", output), file=console)
+
+    return log, lambda: None
+
+
+def queued(console, lock, summary=None):
+    def write(text):
+        with lock:
+            print(text, file=console)
+
+    message_log = MessageLog([ConsoleSink(write)])
+    message_log.summary = summary
+    return lambda message: message_log.send(message, PEER), message_log.close
+
+
+def summarized(console, lock):
+    return queued(console, lock, summary=SUMMARY_INTERVAL)
+
+
+def run(name: str, make_log, console, messages: int = MESSAGES) -> list:
+    log, close = make_log(console, threading.Lock()) if make_log else (None, None)
+    began = time.perf_counter()
+    for index in range(messages):
+        message = Protocol(
+            method=ProtocolMethod.DEMO, content=f"{index * 0.125}", id="Server"
+        )
+        message.to_network()
+        if log is not None:
+            log(message)
+    hot = time.perf_counter() - began
+    if close is not None:
+        close()
+    total = time.perf_counter() - began
+    return [name, f"{messages / hot:,.0f}", f"{hot / messages * 1e6:.2f}", f"{total:.2f}"]
+
+
+def compare(title: str, console, messages: int = MESSAGES):
+    results = [
+        run("LOG off", None, console, messages),
+        run("inline print", inline, console, messages),
+        run("MessageLog", queued, console, messages),
+        run("MessageLog summary", summarized, console, messages),
+    ]
+    baseline = float(results[1][1].replace(",", ""))
+    for row in results:
+        row.append(f"{float(row[1].replace(',', '')) / baseline:.1f}x")
+    CLI.message(f"{title} ({messages} messages)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=["Logging", "msgs / s", "us / message", "s until written", "Speedup"],
+    )
+
+
+if __name__ == "__main__":
+    # Writing is cheap on /dev/null, the queue then only moves the work to
+    # another thread, which shares the GIL with the sending one
+    with open(os.devnull, "w") as console:
+        compare("Send Path Logging to /dev/null", console)
+    # A console that blocks holds up the sending thread only when printing inline
+    compare("Send Path Logging to a Slow Console", SlowConsole(), MESSAGES // 10)
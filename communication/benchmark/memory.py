@@ -0,0 +1,72 @@
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from protocol import *
+
+MESSAGES = 100_000
+
+
+class LegacyProtocol:
+    """Field layout of Protocol before __slots__: attributes plus a `data` dict."""
+
+    def __init__(self, json_data: dict):
+        self.method = ProtocolMethod[json_data["METHOD"]]
+        self.protocol_type = ProtocolType[json_data["TYPE"]]
+        self.state = ProtocolState[json_data["STATE"]]
+        self.content = json_data["BODY"]
+        self.id = json_data["ID"]
+        self.node = None
+        self.data = {
+            Field.TYPE: self.protocol_type.value,
+            Field.ID: self.id,
+            Field.METHOD: self.method.value,
+            Field.BODY: self.content,
+            Field.STATE: self.state.value,
+        }
+
+
+def measure(name: str, build) -> list:
+    gc.collect()
+    tracemalloc.start()
+    messages = [build(i) for i in range(MESSAGES)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    return [
+        name,
+        f"{current / MESSAGES:.0f}",
+        f"{current / 2**20:.1f}",
+        f"{peak / 2**20:.1f}",
+    ]
+
+
+if __name__ == "__main__":
+    message = Protocol(method=ProtocolMethod.DEMO, content="x" * 64, id="NodeA")
+    text = message.to_network()[FRAME_HEADER.size :]
+    binary = message.to_network(features=SUPPORTED_FEATURES)[FRAME_HEADER.size :]
+    # Every received frame owns its payload, so copy it per message
+    copy = lambda payload: bytes(bytearray(payload))
+
+    results = [
+        measure("legacy layout (JSON)", lambda i: LegacyProtocol(json.loads(copy(text)))),
+        measure("slotted (JSON)", lambda i: Protocol.from_network(copy(text))),
+        measure(
+            "slotted (binary, lazy body)",
+            lambda i: Protocol.from_network(copy(binary), FrameFlag.BINARY),
+        ),
+        measure(
+            "slotted (constructed)",
+            lambda i: Protocol(method=ProtocolMethod.DEMO, content=i, id="NodeA"),
+        ),
+    ]
+
+    CLI.message(f"Protocol Memory ({MESSAGES:,} in-flight messages)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=["Layout", "Bytes / message", "Current MiB", "Peak MiB"],
+    )
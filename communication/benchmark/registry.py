@@ -0,0 +1,60 @@
+import os
+import random
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from node import ClientRegistry
+
+CLIENTS = (10, 100, 1000)
+LOOKUPS = 20000
+
+
+class Client:
+    # Only what the registry indexes from a Node
+    def __init__(self, index: int):
+        self.ID = f"Node{index}"
+        self.tags = [f"T{index}"]
+        self.IP = f"10.1.{index // 250}.{index % 250 + 1}"
+        self.address = (self.IP, 5000)
+
+
+def linear(clients: list, tags: list):
+    # get_client_by_tag prior to the registry
+    for tag in tags:
+        for client in clients:
+            if tag in client.tags:
+                break
+
+
+def indexed(registry: ClientRegistry, tags: list):
+    for tag in tags:
+        registry.get_by_tag(tag)
+
+
+def run(count: int) -> list:
+    clients = [Client(index) for index in range(count)]
+    registry = ClientRegistry()
+    for client in clients:
+        registry.add(client)
+    # Simulator updates are routed to any client, not the first few
+    tags = [f"T{random.randrange(count)}" for _ in range(LOOKUPS)]
+
+    scan = timeit.timeit(lambda: linear(clients, tags), number=1) / LOOKUPS
+    index = timeit.timeit(lambda: indexed(registry, tags), number=1) / LOOKUPS
+    return [
+        count,
+        f"{scan * 1e9:,.0f}",
+        f"{index * 1e9:,.0f}",
+        f"{scan / index:.1f}x",
+    ]
+
+
+if __name__ == "__main__":
+    results = [run(count) for count in CLIENTS]
+    CLI.message(f"Lookup by Tag ({LOOKUPS} lookups)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=["Clients", "linear ns / lookup", "indexed ns / lookup", "Speedup"],
+    )
@@ -0,0 +1,136 @@
+import json
+import os
+import socket
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+import server as S
+from node import Node
+from protocol import FrameBuffer, Protocol, ProtocolFeature, ProtocolMethod
+
+CLIENTS = 100
+MESSAGES = 20000
+REPEAT = 3
+VALUE = "0.98731" * 30
+CODECS = {"JSON": (), "binary": (ProtocolFeature.BINARY,)}
+
+
+def connect(server: S.Server, listener: socket.socket, index: int, features: tuple):
+    """A registered client, and the socket its peer would read from."""
+    peer = socket.create_connection(listener.getsockname())
+    sock, _ = listener.accept()
+    client = Node(
+        sock,
+        config_data={
+            "ID": f"Node{index}",
+            "IP": "127.0.0.1",
+            "SUBNET_MASK": "255.255.255.0",
+            "TAGS": [f"B{index}"],
+        },
+    )
+    client.features = set(features)
+    # Big enough that no frame is dropped while nobody reads
+    client.outbound.max_bytes = 64 * 1024 * 1024
+    server.registry.add(client)
+    return client, peer
+
+
+def hooked(server: S.Server, source: Node, frames: list):
+    # A receive_hook that reads the tag from the body and re-sends the value
+    buffer = FrameBuffer()
+    for frame in frames:
+        message = buffer.feed(frame)[0]
+        body = json.loads(message.content)
+        target = server.registry.get_by_tag(body["tag"])
+        server.send(target, Protocol(method=ProtocolMethod.DEMO, content=body["value"]))
+
+
+def routed(server: S.Server, source: Node, frames: list):
+    buffer = FrameBuffer()
+    for frame in frames:
+        server.route(buffer.feed(frame)[0], source)
+
+
+def timed(function, peers: list) -> float:
+    """Seconds per message. The peers are read empty after each run."""
+    seconds = timeit.timeit(function, number=1) / MESSAGES
+    for client, peer in peers:
+        peer.setblocking(False)
+        while True:
+            try:
+                while peer.recv(1024 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+            if not client.outbound.flush():
+                break
+    return seconds
+
+
+def run(codec: str, features: tuple) -> list:
+    server = S.Server(host="127.0.0.1", port=0, heartbeat=None)
+    listener = socket.create_server(("127.0.0.1", 0))
+    peers = [connect(server, listener, index, features) for index in range(CLIENTS)]
+    source = peers[0][0]
+    tags = [f"B{index % CLIENTS}" for index in range(MESSAGES)]
+    # Signed with an ID of the client's own choosing, such as by a client that
+    # predates INIT SUCCESS carrying the registry ID, so each one is stamped
+    hook_frames = [
+        Protocol(
+            method=ProtocolMethod.DEMO,
+            content=json.dumps({"tag": tag, "value": VALUE}),
+            id="417",
+        ).to_network(features=features)
+        for tag in tags
+    ]
+    dest_frames = {
+        ID: [
+            Protocol(method=ProtocolMethod.DEMO, content=VALUE, id=ID, dest=tag).to_network(
+                features=features
+            )
+            for tag in tags
+        ]
+        for ID in ("417", source.ID)
+    }
+
+    hook = stamped = dest = float("inf")
+    for _ in range(REPEAT):
+        hook = min(hook, timed(lambda: hooked(server, source, hook_frames), peers))
+        stamped = min(
+            stamped, timed(lambda: routed(server, source, dest_frames["417"]), peers)
+        )
+        dest = min(dest, timed(lambda: routed(server, source, dest_frames[source.ID]), peers))
+
+    for client, peer in peers:
+        client.close()
+        peer.close()
+    listener.close()
+    server.sock.close()
+    server.log.close()
+    return [
+        codec,
+        f"{hook * 1e6:.2f}",
+        f"{stamped * 1e6:.2f}",
+        f"{dest * 1e6:.2f}",
+        f"{hook / stamped:.1f}x",
+        f"{hook / dest:.1f}x",
+    ]
+
+
+if __name__ == "__main__":
+    S.LOG = False
+    results = [run(codec, features) for codec, features in CODECS.items()]
+    CLI.message(f"Client to Client ({MESSAGES} messages)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=[
+            "Codec",
+            "hook us / message",
+            "DEST, other ID us",
+            "DEST, registry ID us",
+            "Speedup, other ID",
+            "Speedup, registry ID",
+        ],
+    )
@@ -0,0 +1,122 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+from protocol import *
+import server
+from sharding import ShardedServer
+
+WORKERS = (1, 2, 4)
+CLIENTS = 64
+CLIENT_PROCESSES = 4
+MESSAGES = 40000
+
+
+def write_config(count: int) -> str:
+    nodes = [
+        {"ID": f"Node{i}", "IP": "127.0.0.1", "SUBNET_MASK": "255.255.255.0", "TAGS": []}
+        for i in range(count)
+    ]
+    handle, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(handle, "w") as file:
+        json.dump({"Nodes": nodes}, file)
+    return path
+
+
+def free_port() -> int:
+    # Every worker binds the same port, so it is picked before they start
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def clients(port: int, count: int, rounds: int, start):
+    # Raw sockets stand in for clients, each one waits for its INIT SUCCESS
+    socks = []
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        FrameBuffer().receive(sock)
+        socks.append(sock)
+    frame = Protocol(method=ProtocolMethod.DEMO, content="42", id="Node").to_network()
+    start.wait()
+    for _ in range(rounds):
+        for sock in socks:
+            sock.sendall(frame)
+    time.sleep(5)
+    for sock in socks:
+        sock.close()
+
+
+def run(workers: int) -> list:
+    # One counter per worker, only that worker writes to it
+    counts = multiprocessing.get_context("fork").RawArray("q", workers)
+
+    def receive_hook(server, client, message):
+        counts[server.shard.index] += 1
+        return False
+
+    port = free_port()
+    sharded = ShardedServer(
+        workers=workers,
+        host="127.0.0.1",
+        port=port,
+        engine="selector",
+        receive_hook=receive_hook,
+        # The raw socket clients never answer PING, heartbeats would drop them
+        heartbeat=None,
+    )
+    sharded.config_path = write_config(CLIENTS)
+    sharded.start()
+
+    per_process = CLIENTS // CLIENT_PROCESSES
+    rounds = MESSAGES // CLIENTS
+    start = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(target=clients, args=(port, per_process, rounds, start))
+        for _ in range(CLIENT_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    while len(sharded.clients()) < CLIENTS:
+        time.sleep(0.05)
+
+    began = time.perf_counter()
+    start.set()
+    total = rounds * per_process * CLIENT_PROCESSES
+    while sum(counts) < total:
+        time.sleep(0.001)
+    seconds = time.perf_counter() - began
+
+    shards = [row["Shard"] for row in sharded.clients()]
+    spread = "/".join(str(shards.count(index)) for index in range(workers))
+    for process in processes:
+        process.terminate()
+        process.join()
+    sharded.shutdown()
+    os.remove(sharded.config_path)
+    return [workers, spread, f"{total / seconds:,.0f}"]
+
+
+if __name__ == "__main__":
+    server.LOG = False
+    results = []
+    for workers in WORKERS:
+        # Connection messages are not part of the measurement
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results.append(run(workers))
+    baseline = float(results[0][2].replace(",", ""))
+    for row in results:
+        row.append(f"{float(row[2].replace(',', '')) / baseline:.1f}x")
+
+    CLI.message(f"Sharded Server ({os.cpu_count()} cores)", width_fraction=60)
+    CLI.table(
+        results,
+        headers=["Workers", "Clients per worker", "messages / s", "Scaling"],
+    )
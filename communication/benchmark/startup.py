@@ -0,0 +1,113 @@
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lib_cli as CLI
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNS = 15
+SLOWEST = 8
+
+# Target for `import client`, as -X importtime reports it, in milliseconds
+CLIENT_IMPORT_BUDGET = 75.0
+
+# The client's imports prior to lazy loading, jsonschema through protocol and
+# tabulate and colour through lib_cli
+EAGER = "import jsonschema, tabulate, colour; import client"
+
+CONNECT = """
+import time
+began = time.perf_counter()
+import client
+client.Client("startup", host="127.0.0.1", port={port}, headless=True).sock.close()
+print("CONNECTED", time.perf_counter() - began)
+"""
+
+
+def import_times(code: str) -> dict:
+    """Cumulative microseconds of each module imported by `code`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            times[match.group(3)] = (int(match.group(1)), len(match.group(2)))
+    return times
+
+
+def import_row(name: str, code: str, module: str) -> list:
+    runs = [import_times(code)[module][0] / 1000 for _ in range(RUNS)]
+    median = statistics.median(runs)
+    return [
+        name,
+        f"{median:.1f}",
+        f"{min(runs):.1f}",
+        f"{CLIENT_IMPORT_BUDGET:.0f}",
+        "OK" if median <= CLIENT_IMPORT_BUDGET else "OVER",
+    ]
+
+
+def eager_row() -> list:
+    runs = []
+    for _ in range(RUNS):
+        times = import_times(EAGER)
+        runs.append(
+            sum(times[module][0] for module in ("jsonschema", "tabulate", "colour", "client"))
+            / 1000
+        )
+    median = statistics.median(runs)
+    return ["import client, eager", f"{median:.1f}", f"{min(runs):.1f}", "-", "-"]
+
+
+def connect_seconds() -> float:
+    """Seconds from the start of a client process until it has connected."""
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    result = subprocess.run(
+        [sys.executable, "-c", CONNECT.format(port=port)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    listener.close()
+    return float(result.stdout.split("CONNECTED")[-1])
+
+
+if __name__ == "__main__":
+    results = [
+        import_row("import client", "import client", "client"),
+        eager_row(),
+    ]
+    CLI.message(f"Client Startup (median of {RUNS} processes)", width_fraction=60)
+    CLI.table(results, headers=["Imports", "ms", "fastest ms", "budget ms", ""])
+
+    times = import_times("import client")
+    slowest = sorted(
+        (
+            [module, f"{cumulative / 1000:.1f}"]
+            for module, (cumulative, depth) in times.items()
+            if depth == 3
+        ),
+        key=lambda row: float(row[1]),
+        reverse=True,
+    )[:SLOWEST]
+    CLI.message("Slowest Imports of client.py", width_fraction=60)
+    CLI.table(slowest, headers=["Module", "cumulative ms"])
+
+    connect = statistics.median(connect_seconds() for _ in range(5)) * 1000
+    CLI.message("Client Process Start Until Connected", width_fraction=60)
+    CLI.table(
+        [[f"{connect:.0f}", f"{connect + 1000:.0f}"]],
+        headers=["ms", "ms with the fixed 1 s delay"],
+    )
@@ -15,6 +15,30 @@ CLI_SERVER_COMMANDS = [
         "Function": Server.show_client,
         "Parameters": 1,
     },
+    {
+        "Commands": ["routes", "show_routes"],
+        "Description": "Displays the messages routed between clients, per route.",
+        "Function": Server.show_routes,
+        "Parameters": 0,
+    },
+    {
+        "Commands": ["summary"],
+        "Description": "Logs a traffic summary every N seconds (5 by default), or every message with 'off'.",
+        "Function": Server.summarize,
+        "Parameters": 1,
+    },
+    {
+        "Commands": ["follow"],
+        "Description": "Logs every message of the client with the given ID or tag in summary mode.",
+        "Function": Server.follow,
+        "Parameters": 1,
+    },
+    {
+        "Commands": ["unfollow"],
+        "Description": "Stops following the client with the given ID or tag.",
+        "Function": Server.unfollow,
+        "Parameters": 1,
+    },
 ]
 
 
@@ -43,6 +67,12 @@ CLI_CLIENT_COMMANDS = [
         "Function": "run_command",
         "Parameters": 1,
     },
+    {
+        "Commands": ["summary"],
+        "Description": "Logs a traffic summary every N seconds (5 by default), or every message with 'off'.",
+        "Function": "summarize",
+        "Parameters": 1,
+    },
 ]
 
 CLI_DEFAULT_COMMANDS = []
@@ -1,6 +1,10 @@
+import contextlib
+import io
 import random
+import socket
 import string
 import time
+import timeit
 from lib_cli import (
     print_array,
     color,
@@ -8,6 +12,7 @@ from lib_cli import (
     underline,
     print_dict,
     message,
+    message_error,
     table,
     MAX_WIDTH,
     get_user_input,
@@ -15,6 +20,8 @@ from lib_cli import (
     indent,
     timer,
     input_loop,
+    ANSI_CODES,
+    RENDER_CACHE,
 )
 from node import *
 
@@ -103,6 +110,15 @@ def user_input_test():
     print("\t", value)
 
 
+def connected_socket() -> socket.socket:
+    # A Node reads its address from a connected socket
+    listener = socket.create_server(("127.0.0.1", 0))
+    sock = socket.create_connection(listener.getsockname())
+    listener.accept()[0].close()
+    listener.close()
+    return sock
+
+
 def node_test():
     def random_char(y):
         return "".join(random.choice(string.ascii_letters) for x in range(y))
@@ -110,6 +126,7 @@ def node_test():
     def show_nodes(**kwargs):
         for i in range(2):
             node = Node(
+                connected_socket(),
                 ID=f"Node{i}",
                 tags=[random_char(random.randint(1, 5)) for x in range(5)],
                 IP=".".join(map(str, (random.randint(10, 255) for _ in range(4)))),
@@ -127,6 +144,54 @@ def node_test():
     show_nodes(basic=True)
 
 
+def render_benchmark(repeat: int = 2000):
+    node = Node(
+        connected_socket(), ID="Node0", tags=["B1", "B2"], IP="10.1.1.2", PORT=5000
+    )
+    cases = [
+        ["color", lambda: color("aquamarine", "10.1.1.2:5000")],
+        [
+            "message",
+            lambda: message("CLIENT CONNECTED: 10.1.1.2:5000", "lime", verbose=False),
+        ],
+        ["message_error", lambda: message_error("GOT EMPTY MESSAGE", verbose=False)],
+        ["table", lambda: table(data["days"], verbose=False)],
+        ["Node.show", lambda: node.show()],
+    ]
+
+    def run(func, cached: bool) -> float:
+        RENDER_CACHE.enabled = cached
+
+        def call():
+            if not cached:
+                ANSI_CODES.clear()
+            func()
+
+        # Node.show prints its title box
+        with contextlib.redirect_stdout(io.StringIO()):
+            call()
+            return timeit.timeit(call, number=repeat) / repeat
+
+    results = []
+    for name, func in cases:
+        uncached, cached = run(func, False), run(func, True)
+        results.append(
+            [
+                name,
+                f"{uncached * 1e6:.2f}",
+                f"{cached * 1e6:.2f}",
+                f"{uncached / cached:.1f}x",
+            ]
+        )
+    RENDER_CACHE.enabled = True
+
+    message(f"Render Benchmark ({repeat} calls)", width=MAX_WIDTH)
+    table(
+        results,
+        headers=["Render", "uncached us / call", "cached us / call", "Speedup"],
+    )
+
+
 def cli_test():
     """
     commands = [
@@ -226,6 +291,7 @@ def cli_test():
 # table_test()
 # message_test()
 # timer_test()
-node_test()
+# node_test()
 # user_input_test()
 # cli_test()
+render_benchmark()
@@ -11,19 +11,31 @@ from random import randrange
 import time
 import traceback
 from api import API
-import jsonschema
 from node import Node
 
 import lib_cli as CLI
+from daemon import CONTROL_PATH, ControlSocket
+from logger import SUMMARY_INTERVAL, ConsoleSink, JsonLinesSink, MessageLog
 
 from protocol import (
     Protocols,
     Protocol,
+    FrozenProtocol,
     ProtocolState,
     ProtocolMethod,
     ProtocolType,
     Field,
+    FrameBuffer,
+    FrameError,
+    ProtocolError,
+    ProtocolFeature,
+    SUPPORTED_FEATURES,
+    REQUEST_TIMEOUT,
+    Requests,
+    Transfer,
+    Transfers,
 )
+from concurrent.futures import Future
 
 
 LOG_PADDING = 0
@@ -32,6 +44,12 @@ LOG = True
 
 DEFAULT_GATEWAY = "10.1.1.1"
 
+# Seconds before retrying a refused connect, doubled after every failed
+# attempt up to CONNECT_RETRY_MAX, so a client started with its server
+# connects as soon as the server listens
+CONNECT_RETRY = 0.1
+CONNECT_RETRY_MAX = 5.0
+
 # TODO: Add thread for rely connections to neighbor nodes
 
 
@@ -44,6 +62,10 @@ class Client:
         receive_hook=None,
         send_hook=None,
         custom_commands=None,
+        batch_hook=None,
+        log_file=None,
+        headless=False,
+        control=None,
     ):
         self.id = client_id
         self.running = True
@@ -53,23 +75,45 @@ class Client:
         self.sock = None
         self.port = port
         self.host = host
+        # Headless clients print plain output and take commands on a control
+        # socket instead of the terminal
+        self.headless = headless
+        if headless:
+            CLI.set_plain()
+        self.control = (
+            ControlSocket(control or CONTROL_PATH.format(name="client"), self.execute)
+            if headless or control
+            else None
+        )
+        # Messages are logged by a writer thread, see logger.MessageLog
+        sinks = [ConsoleSink(self.__print_thread)]
+        if log_file is not None:
+            sinks.append(JsonLinesSink(log_file))
+        self.log = MessageLog(sinks)
 
         self.receive_hook = receive_hook
         self.send_hook = send_hook
+        self.batch_hook = batch_hook
+        self.__initialize_handlers()
         self.custom_commands = [] if custom_commands is None else custom_commands
         self.node: Node = None
 
         self.__selector_sock = selectors.DefaultSelector()
         self.__selector_input = selectors.DefaultSelector()
+        self.transfers = Transfers()
+        self.__frames = FrameBuffer(transfers=self.transfers)
+        self.__send_lock = threading.Lock()
+        self.features = set()
+        self.requests = Requests(first=1)
+        self.__freeze_controls()
 
 
         CLI.message_caution(
             f"Starting Client",
             print_func=self.__print_thread,
         )
-        time.sleep(1.0)
 
-        wait_time = 5
+        wait_time = CONNECT_RETRY
         connected = False
         while not connected:
             try:
@@ -78,41 +122,48 @@ class Client:
                 self.sock.connect((host, port))
                 connected = True
             except socket.error as err:
+                self.sock.close()
                 CLI.message_caution(
-                    f"Unable to resolve IP address, retrying in {wait_time} second(s)...",
+                    f"Unable to resolve IP address, retrying in {wait_time:g} second(s)...",
                     print_func=self.__print_thread,
                 )
                 time.sleep(wait_time)
+                wait_time = min(wait_time * 2, CONNECT_RETRY_MAX)
 
     def __process_message(self, message: Protocol, is_receiving=False):
         if not message:
             CLI.message_caution("GOT EMPTY MESSAGE", print_func=self.__print_thread)
             return False
 
-        if message == ProtocolMethod.INIT:
-            if message.state == ProtocolState.REQ_AWK:
-                self.node = Node(self.sock, config_data=json.loads(message.content))
-                message = Protocol(method=ProtocolMethod.INIT, state=ProtocolState.AWK)
-                self.__send_data(message)
-                return False
-            elif message.state == ProtocolState.SUCCESS:
-                CLI.message_ok("CONNECTED", print_func=self.__print_thread)
-                return False
-            else:
-                self.os_set_IP(ip=str(self.node.IP))
-                return False
-
-        if message == ProtocolMethod.COMMAND:
-            self.run_command(*message.content.split(" "))
+        # A routed message carries the sequence number of the client that sent it
+        if (
+            is_receiving
+            and message.seq
+            and not message.dest
+            and self.requests.resolve(message)
+        ):
             return False
 
-        if message == ProtocolMethod.SCRIPT:
-            self.run_script(*message.content.split(" "))
+        if message.protocol_type is ProtocolType.BATCH:
+            messages = message.unbatch()
+            if self.batch_hook is not None:
+                if self.batch_hook(self, self.sock, message, messages):
+                    return True
+            for sub_message in messages:
+                if self.__process_message(sub_message, is_receiving):
+                    return True
             return False
 
-        if message == ProtocolMethod.EXIT:
-            return self.disconnect(state=message.state)
+        if message.protocol_type is ProtocolType.STREAM and is_receiving:
+            if message.state == ProtocolState.REQ_AWK:
+                self.__send_data(self.transfers.accept(message))
+            else:
+                self.transfers.acknowledge(message)
+            return False
 
+        handler = self.__handlers[is_receiving].get(message.method)
+        if handler is not None:
+            return handler(message)
 
         if self.receive_hook is not None and is_receiving:
             return self.receive_hook(self, self.sock, message)
@@ -122,6 +173,98 @@ class Client:
 
         return False
 
+    def __initialize_handlers(self):
+        # Built-in handlers, keyed by whether the message is being received
+        handlers = {
+            ProtocolMethod.INIT: self.__handle_init,
+            ProtocolMethod.COMMAND: self.__handle_command,
+            ProtocolMethod.SCRIPT: self.__handle_script,
+            ProtocolMethod.EXIT: self.__handle_exit,
+        }
+        self.__handlers = {True: dict(handlers), False: dict(handlers)}
+        # The server pings a quiet client, which proves it is alive by answering
+        self.__handlers[True][ProtocolMethod.PING] = self.__handle_ping
+
+    def register_handler(
+        self, method: ProtocolMethod or str, function, is_receiving: bool = True
+    ):
+        """
+        Routes every message of `method` to `function(client, socket, message)`
+        instead of the send or receive hook. Returning True stops the client,
+        like a hook. Registering a built-in method replaces its handler.
+        """
+        if type(method) is not ProtocolMethod:
+            if str(method).upper() not in ProtocolMethod.__members__:
+                raise ValueError(f"Unknown METHOD '{method}'")
+            method = ProtocolMethod[str(method).upper()]
+        self.__handlers[is_receiving][method] = lambda message: function(
+            self, self.sock, message
+        )
+
+    def __freeze_controls(self):
+        # Fixed control messages, encoded once for this client's ID
+        self.__init_awk = FrozenProtocol(
+            id=self.id, method=ProtocolMethod.INIT, state=ProtocolState.AWK
+        )
+        self.__exit_awk = FrozenProtocol(
+            id=self.id, method=ProtocolMethod.EXIT, state=ProtocolState.AWK
+        )
+        self.__exit_request = FrozenProtocol(
+            id=self.id, method=ProtocolMethod.EXIT, state=ProtocolState.REQ_AWK
+        )
+        self.__pong = FrozenProtocol(id=self.id, method=ProtocolMethod.PONG)
+
+    def __handle_init(self, message: Protocol):
+        if message.state == ProtocolState.REQ_AWK:
+            self.node = Node(self.sock, config_data=json.loads(message.content))
+            self.__send_data(self.__init_awk)
+            return False
+        elif message.state == ProtocolState.SUCCESS:
+            CLI.message_ok("CONNECTED", print_func=self.__print_thread)
+            # The server routes by its registry ID, signing with it keeps
+            # routed frames as they were sent
+            if message.dest and message.dest != self.id:
+                self.id = message.dest
+                self.__freeze_controls()
+            # Servers without optional features send an empty body
+            features = ProtocolFeature.decode(message.content) & SUPPORTED_FEATURES
+            if features:
+                self.__send_data(
+                    Protocol(
+                        method=ProtocolMethod.INIT,
+                        state=ProtocolState.AWK,
+                        content=ProtocolFeature.encode(features),
+                    )
+                )
+                self.features = features
+            return False
+        else:
+            self.os_set_IP(ip=str(self.node.IP))
+            return False
+
+    def __handle_command(self, message: Protocol):
+        # A streamed COMMAND carries command lines too long for one frame
+        command = (
+            message.content
+            if message.payload is None
+            else bytes(message.payload).decode("utf-8", errors="replace")
+        )
+        self.run_command(*command.split(" "))
+        return False
+
+    def __handle_script(self, message: Protocol):
+        if message.payload is not None:
+            self.save_script(message.content.split(" ")[0], message.payload)
+        self.run_script(*message.content.split(" "))
+        return False
+
+    def __handle_ping(self, message: Protocol):
+        self.__send_raw(self.__pong.to_network(features=self.features))
+        return False
+
+    def __handle_exit(self, message: Protocol):
+        return self.disconnect(state=message.state)
+
     def __receive(self):
         self.__selector_sock.register(
             self.sock, selectors.EVENT_READ, self.__receive_data
@@ -149,24 +292,11 @@ class Client:
                 break
 
     def __command_line(self):
-        from cli_commands import CLI_CLIENT_COMMANDS
-
-        self.custom_commands = self.custom_commands + CLI_CLIENT_COMMANDS
         while not self.__exit_event.is_set():
             try:
                 if self.__is_active(sys.stdin):
-                    message = input()
-                    result = self.__commands(message)
-
-                    if result is False:
-                        continue
-                    if result == "VOID":
-                        print("Invalid METHOD:\t", f'"{message}"\n')
-                        continue
-                    if Protocol.has_key(message, ProtocolMethod):
-                        message = Protocol(method=message)
-                        if self.__process_message(message, is_receiving=False):
-                            break
+                    if self.execute(input()):
+                        break
             except KeyboardInterrupt:
                 break
             except ValueError:
@@ -180,6 +310,25 @@ class Client:
                 self.running = False
                 break
 
+    def execute(self, command: str) -> bool:
+        """Runs one line as if it were typed at the console, True if it stops the client."""
+        result = self.__commands(command)
+
+        if result is False:
+            return False
+        if result == "VOID":
+            print("Invalid METHOD:\t", f'"{command}"\n')
+            return False
+        if Protocol.has_key(command, ProtocolMethod):
+            message = Protocol(method=command)
+            return bool(self.__process_message(message, is_receiving=False))
+        return False
+
+    def __load_commands(self):
+        from cli_commands import CLI_CLIENT_COMMANDS
+
+        self.custom_commands = self.custom_commands + CLI_CLIENT_COMMANDS
+
     def __commands(self, user_input: str):
         from cli_commands import CLI_DEFAULT_COMMANDS
 
@@ -208,14 +357,21 @@ class Client:
         return "VOID"
 
     def run(self):
-        CLI.clear_terminal()
-        receive_thread = threading.Thread(target=self.__receive)
-        write_thread = threading.Thread(target=self.__command_line)
+        threads = [threading.Thread(target=self.__receive)]
+        if not self.headless:
+            CLI.clear_terminal()
+            threads.append(threading.Thread(target=self.__command_line))
+        self.__load_commands()
+        if self.control is not None:
+            self.control.start()
+            CLI.message_ok(
+                f"CONTROL SOCKET {self.control.path}", print_func=self.__print_thread
+            )
 
-        receive_thread.start()
-        write_thread.start()
+        for thread in threads:
+            thread.start()
 
-        for thread in [receive_thread, write_thread]:
+        for thread in threads:
             try:
                 thread.join()
             except KeyboardInterrupt:
@@ -223,10 +379,58 @@ class Client:
             except Exception as err:
                 print(err.with_traceback())
                 self.__exit_event.set()
+        if self.control is not None:
+            self.control.close()
+        self.log.close()
 
     def send(self, message: Protocol, sign: bool = True, encoding: str = "ascii"):
         self.__send_data(message, sign=sign)
 
+    def send_to(self, dest: str, message: Protocol, sign: bool = True):
+        """
+        Sends a DIRECT message that the server routes to the client with the ID,
+        or else the tag, `dest`. It arrives with this client's ID.
+        """
+        message.dest = dest
+        self.__send_data(message, sign=sign)
+
+    def send_many(self, messages: list, sign: bool = True, encoding: str = "ascii"):
+        """Pipelines several messages to the server in a single write."""
+        self.__send_data(messages, sign=sign, encoding=encoding)
+
+    def stream(self, method: ProtocolMethod, payload: bytes, args: str = "") -> Transfer:
+        """
+        Streams a payload of any size to the server as a chunked transfer.
+
+        The transfer runs on its own thread, call `wait()` on the returned
+        Transfer to block until the server has received all of it.
+        """
+        transfer = self.transfers.start(method, payload, args)
+        threading.Thread(
+            target=self.transfers.send,
+            args=(transfer, payload, self.__send_data, self.__send_raw),
+            daemon=True,
+        ).start()
+        return transfer
+
+    def request(self, message: Protocol, timeout: float = REQUEST_TIMEOUT) -> Future:
+        """
+        Sends a message and returns a Future for the server's reply.
+
+        The reply is the first message from the server carrying the same `seq`,
+        it resolves the Future instead of reaching the handlers or hooks.
+        """
+        future = self.requests.request(message, timeout)
+        self.__send_data(message)
+        return future
+
+    def send_batch(self, messages: list, sign: bool = True, encoding: str = "ascii"):
+        """Packs several messages, such as one tick of tag values, into one BATCH."""
+        if sign:
+            for message in messages:
+                message.id = self.id
+        self.__send_data(Protocol.batch(messages), sign=sign, encoding=encoding)
+
     # Duel OS Implementation
     def __is_active(self, stream, timeout=1):
         if os.name == "nt":  # for Windows
@@ -247,40 +451,62 @@ class Client:
             return bool(ready)
 
     def __send_data(self, message, sign: bool = True, encoding: str = "ascii"):
-        if type(message) is Protocol:
-            if sign:
+        messages = message if type(message) is list else [message]
+        messages = [message for message in messages if isinstance(message, Protocol)]
+        if not messages:
+            return
+        if sign:
+            for message in messages:
                 message.id = self.id
-            message = message.to_network(encoding=encoding)
+        data = Protocol.pipeline(messages, encoding=encoding, features=self.features)
+        for message in messages:
             self.__log_send(message)
-            self.sock.send(message)
+        self.__send_raw(data)
+
+    def __send_raw(self, data: bytes):
+        # Frames from different threads must not interleave on the socket
+        with self.__send_lock:
+            self.sock.sendall(data)
 
     def __receive_data(self, sock, mask):
-        message = sock.recv(1024).decode("ascii")
-        if not message:
+        error = None
+        try:
+            messages = self.__frames.receive(sock)
+        except ConnectionResetError:
+            self.disconnect(state=ProtocolState.AWK)
             return
+        except ProtocolError as err:
+            # The frames read along with the invalid one are still handled
+            messages, error = err.messages, err
+
+        acks = self.transfers.take_acks()
+        if acks:
+            self.__send_data(acks)
 
-        message: Protocol = Protocol.from_network(message)
+        for message in messages:
+            if message:
+                self.__log_receive(message)
+            try:
+                if self.__process_message(message, is_receiving=True):
+                    return
+            except ProtocolError as err:
+                CLI.message_error(
+                    f"INVALID MESSAGE: {err}", print_func=self.__print_thread
+                )
 
-        if message:
-            formatted_message = r"{}".format(message)
-            self.__log_receive(formatted_message)
-        self.__process_message(message, is_receiving=True)
+        if error is not None:
+            CLI.message_error(f"INVALID FRAME: {error}", print_func=self.__print_thread)
+            if isinstance(error, FrameError):
+                # The stream is out of sync, nothing after it can be read
+                self.disconnect(state=ProtocolState.AWK)
 
     def __log_send(self, message):
         if LOG:
-            output = (
-                f"[LOG - {time.strftime('%X')}] {CLI.color('steelblue', 'SENDING:')}\n"
-            )
-            output += f'{self.__get_socket_address(self.sock)} {"-->"} {str(message):<{LOG_PADDING}}\n'
-            self.__print_thread(output, clr="gray")
+            self.log.send(message, f"{self.host}:{self.port}")
 
     def __log_receive(self, message):
         if LOG:
-            output = (
-                f"[LOG - {time.strftime('%X')}] {CLI.color('tomato', 'RECEIVED:')}\n"
-            )
-            output += f'{self.__get_socket_address(self.sock)} {"<--"} {str(message):<{LOG_PADDING}}\n'
-            self.__print_thread(output, clr="gray")
+            self.log.receive(message, f"{self.host}:{self.port}")
 
     def __get_socket_address(self, socket_obj: socket.socket) -> str:
         peer_name = socket_obj.getpeername()
@@ -291,12 +517,11 @@ class Client:
 
     def disconnect(self, state: ProtocolState = ProtocolState.AWK):
         if state == ProtocolState.REQ_AWK:
-            self.__send_data(
-                Protocol(method=ProtocolMethod.EXIT, state=ProtocolState.AWK)
-            )
+            self.__send_data(self.__exit_awk)
             CLI.message_error(
                 "CONNECTION CLOSED BY SERVER", print_func=self.__print_thread
             )
+            self.requests.cancel()
             self.sock.close()
             self.running = False
             self.__exit_event.set()
@@ -304,6 +529,7 @@ class Client:
 
         if state == ProtocolState.AWK:
             CLI.message_error("CONNECTION CLOSED", print_func=self.__print_thread)
+            self.requests.cancel()
             self.sock.close()
             self.running = False
             self.__exit_event.set()
@@ -313,9 +539,7 @@ class Client:
             CLI.message_caution(
                 "REQUESTING TERMINATION", print_func=self.__print_thread
             )
-            self.__send_data(
-                Protocol(method=ProtocolMethod.EXIT, state=ProtocolState.REQ_AWK)
-            )
+            self.__send_data(self.__exit_request)
             return False
 
         # self.running = False
@@ -338,6 +562,18 @@ class Client:
         self.__print_thread(results[0])
         self.__print_thread(results[1])
 
+    def summarize(self, interval: str = SUMMARY_INTERVAL):
+        """Logs one line of traffic totals every `interval` seconds, `off` to stop."""
+        if str(interval).lower() == "off":
+            self.log.summary = None
+            CLI.message_ok("LOGGING EVERY MESSAGE", print_func=self.__print_thread)
+            return
+        self.log.summary = float(interval)
+        CLI.message_ok(
+            f"LOGGING A SUMMARY EVERY {float(interval):g}s",
+            print_func=self.__print_thread,
+        )
+
     def display_network(self):
         CLI.message_ok(self.__get_socket_address(self.sock))
 
@@ -361,6 +597,11 @@ class Client:
         self.disconnect(state=ProtocolState.AWK)
         self.run_command("reboot")
 
+    def save_script(self, path: str, payload: bytes):
+        with open(path, "wb") as f:
+            f.write(payload)
+        os.chmod(path, 0o755)
+
     def run_script(self, command: str, *args):
         prefix = "./" if command[0] != "/" else ""
         output = API.exe_bash(f"{prefix}{command}", *args)
@@ -385,14 +626,41 @@ def get_args():
         help="An IPv4 address in the format xxx.xxx.xxx.xxx",
     )
     parser.add_argument("-p", "--Port", type=int, default=5000, help="A port number")
+    parser.add_argument(
+        "-l",
+        "--LogFile",
+        type=str,
+        default=None,
+        help="Also log messages to this JSON-lines file, rotated by size",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="No terminal: plain JSON-lines output, commands on the control socket",
+    )
+    parser.add_argument(
+        "-c",
+        "--ControlSocket",
+        type=str,
+        default=None,
+        help=f"Path of the control socket, {CONTROL_PATH.format(name='client')} when headless",
+    )
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = get_args()
-    CLI.clear_terminal()
+    if not args.headless:
+        CLI.clear_terminal()
     client_id = str(randrange(0, 1000))
-    client = Client(client_id, host=args.IPv4Address, port=args.Port)
+    client = Client(
+        client_id,
+        host=args.IPv4Address,
+        port=args.Port,
+        log_file=args.LogFile,
+        headless=args.headless,
+        control=args.ControlSocket,
+    )
     client.run()
     exit(0)
 
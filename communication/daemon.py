@@ -0,0 +1,154 @@
+#!/bin/python3
+
+import argparse
+import io
+import os
+import socket
+import stat
+import sys
+import tempfile
+import threading
+
+# Where a headless process listens for commands unless given a path,
+# `{name}` is `server` or `client`
+CONTROL_PATH = os.path.join(tempfile.gettempdir(), "csugw-{name}.sock")
+
+# Longest command line a control connection may send
+MAX_COMMAND = 4096
+
+
+class ThreadOutput:
+    """
+    Stands in for `sys.stdout`. What a thread prints while it runs a control
+    command is kept for the command's reply, every other thread prints to the
+    real stream as before.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, "buffer", None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ControlSocket:
+    """
+    Runs the commands normally typed at the console of a headless server or
+    client. Each connection to the Unix socket at `path` sends one command
+    line, gets back what the command printed, and is closed.
+
+        echo clients | nc -U /tmp/csugw-server.sock
+        python3 daemon.py clients
+    """
+
+    def __init__(self, path: str, execute):
+        self.path = path
+        self.execute = execute
+        self.sock = None
+        self.output = None
+        self.__thread = None
+
+    def start(self):
+        # A socket left behind by a process that was killed is replaced
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen()
+
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        self.output = sys.stdout
+        self.__thread = threading.Thread(target=self.__accept, daemon=True)
+        self.__thread.start()
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            # Wakes the accepting thread
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def run(self, command: str) -> str:
+        """Runs one command line and returns what it printed."""
+        buffer = io.StringIO()
+        self.output.local.buffer = buffer
+        try:
+            self.execute(command)
+        except Exception as err:
+            buffer.write(f"ERROR: {err}\n")
+        finally:
+            self.output.local.buffer = None
+        return buffer.getvalue()
+
+    def __accept(self):
+        while self.sock is not None:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self.__handle, args=(connection,), daemon=True
+            ).start()
+
+    def __handle(self, connection: socket.socket):
+        with connection:
+            data = b""
+            while b"\n" not in data and len(data) < MAX_COMMAND:
+                chunk = connection.recv(MAX_COMMAND)
+                if not chunk:
+                    break
+                data += chunk
+            command = data.split(b"\n")[0].decode("utf-8", "replace").strip()
+            if not command:
+                return
+            try:
+                connection.sendall(self.run(command).encode("utf-8"))
+            except OSError:
+                pass
+
+
+def send_command(command: str, path: str) -> str:
+    """Sends a command to a ControlSocket and returns its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(command.encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        reply = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return reply.decode("utf-8", "replace")
+            reply += chunk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sends a console command to a headless server or client"
+    )
+    parser.add_argument("Command", nargs="+", help="The command and its arguments")
+    parser.add_argument(
+        "-c",
+        "--ControlSocket",
+        type=str,
+        default=CONTROL_PATH.format(name="server"),
+        help="The control socket of the process",
+    )
+    args = parser.parse_args()
+    print(send_command(" ".join(args.Command), args.ControlSocket), end="")
@@ -1,10 +1,14 @@
 import re
 import os
+import threading
 import time
-from tabulate import tabulate
-from colour import *
+import traceback
+from collections import OrderedDict
 import json
 
+# tabulate and colour are imported by the functions that draw, the first time
+# they do. Processes that never print a box or a color do not pay for them
+
 
 try:
     size = os.get_terminal_size()
@@ -13,6 +17,66 @@ except OSError:
     # Provide some defaults if running without a terminal
     MAX_WIDTH = 100
 
+# Most recently drawn message boxes and tables kept by RENDER_CACHE
+RENDER_CACHE_SIZE = 512
+
+# Cell types whose repr tells apart every value tabulate renders differently
+PLAIN_TYPES = (str, int, float, bool, type(None))
+
+# Color name -> ANSI escape sequence, filled in the first time a color is used
+ANSI_CODES = {}
+
+# Set by `set_plain` in headless processes: colors are dropped, messages print
+# as one JSON object per line and tables without box drawing
+PLAIN = False
+
+
+class RenderCache:
+    """
+    A bounded least-recently-used cache of rendered strings. Status boxes
+    and tables repeat the same text, so most are drawn by `tabulate` once.
+    """
+
+    def __init__(self, size: int = RENDER_CACHE_SIZE):
+        self.size = size
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, render) -> str:
+        """The string cached for `key`, or the result of `render()`, cached."""
+        if not self.enabled:
+            return render()
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = render()
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
+RENDER_CACHE = RenderCache()
+
+
+def set_plain(plain: bool = True):
+    """Switches every message, table and color to plain output, see `PLAIN`."""
+    global PLAIN
+    PLAIN = plain
+
 
 def get_user_input(
     prompt: str = "",
@@ -95,6 +159,8 @@ def create_menu(
                 row[header] = str(command[header]).ljust(p, "⠀")
         data.append(row)
 
+    from tabulate import tabulate
+
     # Create and print the table
     menu = tabulate(
         data, headers="keys" if use_headers else [], tablefmt="rounded_grid"
@@ -215,7 +281,17 @@ def color(color: str, string: str, terminated: bool = True) -> str:
     This function uses the rgb_to_ansi and _get_hex functions,
     which are not included in this snippet.
     """
-    return rgb_to_ansi(string, _get_hex(Color(color)), terminated)
+    if PLAIN:
+        return string
+    code = ANSI_CODES.get(color)
+    if code is None:
+        from colour import Color
+
+        code = ANSI_CODES[color] = rgb_to_ansi("", _get_hex(Color(color)), False)
+    if type(code) is not str:
+        # rgb_to_ansi returns the bare code number of near grey colors
+        return code
+    return f"{code}{string}\033[0m" if terminated else f"{code}{string}"
 
 
 def line(length: int = MAX_WIDTH, verbose: bool = False) -> str:
@@ -253,6 +329,7 @@ def message(
     width_fraction: float = 90.0,
     end="",
     print_func=print,
+    level: str = "INFO",
     **kwargs,
 ):
     """
@@ -265,6 +342,7 @@ def message(
         - `width_fraction` (float, optional): Optional fraction for width out of 100
         - `verbose` (bool, optional): If set to True, the function will print the output.
             Otherwise, it will just return the string without printing. Defaults to True.
+        - `level` (str, optional): The level written with the message in `PLAIN` output.
         - `**kwargs`: Arbitrary keyword arguments for the `tabulate` function.
 
     Returns
@@ -284,16 +362,36 @@ def message(
     -------------
     This function uses the `tabulate` function, which is not included in this snippet.
     `tabulate` should be imported from the `tabulate` module before using this function.
+    Boxes are cached in `RENDER_CACHE` by text, color and width, which follows the
+    terminal width. With `PLAIN` set, the message is one JSON object instead:
+    `{"time": ..., "level": "INFO", "event": "status", "message": "Hello, World!"}`
     """
+    if PLAIN:
+        msg = json.dumps(
+            {"time": time.time(), "level": level, "event": "status", "message": text}
+        )
+        if verbose:
+            print_func(msg)
+        return end + msg
+
     if width_fraction != 50.0:
         width = round((MAX_WIDTH / 100) * width_fraction)
 
-    _width = round((width - len(text)) / 2) - 3
-    msg = tabulate(
-        [[f"<{'':>{_width}}{color(colr, text) if colr else text}{'':<{_width}} >"]],
-        tablefmt="rounded_grid",
-        **kwargs,
-    )
+    def render():
+        from tabulate import tabulate
+
+        _width = round((width - len(text)) / 2) - 3
+        return tabulate(
+            [[f"<{'':>{_width}}{color(colr, text) if colr else text}{'':<{_width}} >"]],
+            tablefmt="rounded_grid",
+            **kwargs,
+        )
+
+    if _is_plain([kwargs.values()]):
+        key = ("message", text, colr, width, repr(sorted(kwargs.items())))
+        msg = RENDER_CACHE.get(key, render)
+    else:
+        msg = render()
     if verbose:
         print_func(msg)
     return end + msg
@@ -309,7 +407,23 @@ def message_error(
     print_func=print,
     **kwargs,
 ):
-    return message(text, colr, width, verbose, width_fraction, end, print_func)
+    return message(
+        text, colr, width, verbose, width_fraction, end, print_func, level="ERROR"
+    )
+
+
+def message_exception(text: str, print_func=print) -> str:
+    """
+    Reports the exception being handled: an error message followed by its
+    traceback. With `PLAIN` set, the traceback is part of the message, so the
+    report stays one JSON object.
+    """
+    trace = traceback.format_exc()
+    if PLAIN:
+        return message_error(f"{text}\n{trace}", print_func=print_func)
+    msg = message_error(text, print_func=print_func)
+    print_func(color("gray", trace))
+    return msg
 
 
 def message_caution(
@@ -322,7 +436,9 @@ def message_caution(
     print_func=print,
     **kwargs,
 ):
-    return message(text, colr, width, verbose, width_fraction, end, print_func)
+    return message(
+        text, colr, width, verbose, width_fraction, end, print_func, level="WARNING"
+    )
 
 
 def message_ok(
@@ -400,6 +516,8 @@ def table(
     Note
     -------------
         This function uses the `tabulate` function, which should be imported from the `tabulate` module before using this function.
+        Tables of plain values are cached in `RENDER_CACHE`. With `PLAIN` set,
+        tables are drawn without borders.
     """
     array = []
     if isinstance(data, dict) or isinstance(data[0], dict):
@@ -423,14 +541,44 @@ def table(
     else:
         headers = ()
 
-    msg = tabulate(array, headers=headers, tablefmt="rounded_grid", **kwargs)
-    msg = "\n".join("\t" * indent_level + line for line in msg.split("\n"))
+    def render():
+        from tabulate import tabulate
+
+        msg = tabulate(
+            array,
+            headers=headers,
+            tablefmt="plain" if PLAIN else "rounded_grid",
+            **kwargs,
+        )
+        return "\n".join("\t" * indent_level + line for line in msg.split("\n"))
+
+    if PLAIN:
+        msg = render()
+    elif _is_plain(array) and _is_plain([headers, kwargs.values()]):
+        key = (
+            "table",
+            repr(array),
+            repr(headers),
+            indent_level,
+            repr(sorted(kwargs.items())),
+        )
+        msg = RENDER_CACHE.get(key, render)
+    else:
+        msg = render()
 
     if verbose:
         print(msg)
     return msg
 
 
+def _is_plain(rows) -> bool:
+    return all(
+        type(row) in (list, tuple, type({}.values()))
+        and all(type(cell) in PLAIN_TYPES for cell in row)
+        for row in rows
+    )
+
+
 def print_array(data: list, indentation_level: int = 0):
     """
     Pretty prints an array with specified indentation.
@@ -485,8 +633,10 @@ def clear_terminal():
     ```python
     clear_terminal()
     ```
-    The terminal screen will be cleared.
+    The terminal screen will be cleared, unless output is `PLAIN`.
     """
+    if PLAIN:
+        return
     os.system("cls" if os.name == "nt" else "clear")
 
 
@@ -569,7 +719,7 @@ def timer(func):
     return wrapper
 
 
-def _get_hex(color: Color):
+def _get_hex(color: "Color"):
     """
     Converts a Color object to a hex color code.
 
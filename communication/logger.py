@@ -0,0 +1,329 @@
+import collections
+import json
+import os
+import threading
+import time
+from enum import IntEnum
+
+import lib_cli as CLI
+from protocol import HEARTBEAT_METHODS
+
+# The writer thread wakes up this often to empty the queue. At most
+# MAX_RECORDS records wait in it, any more are dropped and counted
+FLUSH_INTERVAL = 0.05
+MAX_RECORDS = 100000
+
+# JSON-lines files are rotated once they reach MAX_LOG_BYTES, keeping
+# LOG_BACKUPS older files as `<path>.1` to `<path>.<LOG_BACKUPS>`
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 3
+
+# Summary mode prints one line every SUMMARY_INTERVAL seconds, with the
+# TOP_TALKERS busiest peers and the TOP_METHODS most sent methods of each
+SUMMARY_INTERVAL = 5.0
+TOP_TALKERS = 3
+TOP_METHODS = 2
+
+
+class Level(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+
+class Record:
+    """
+    The fields of one sent or received message, copied when it is logged.
+    Only the writer thread decodes the BODY of a binary frame, in `fields`.
+    """
+
+    __slots__ = (
+        "time",
+        "level",
+        "sending",
+        "peer",
+        "type",
+        "method",
+        "state",
+        "id",
+        "seq",
+        "dest",
+        "content",
+        "body",
+        "compression",
+    )
+
+    def __init__(self, level: Level, sending: bool, peer: str, message):
+        self.time = time.time()
+        self.level = level
+        self.sending = sending
+        self.peer = peer
+        self.type = message.protocol_type.value
+        self.method = message.method.value
+        self.state = message.state.value
+        self.id = message.id
+        self.seq = message.seq
+        self.dest = message.dest
+        # A binary BODY that was not decoded yet is decoded by the writer thread
+        self.body = message.encoded_body()
+        self.content = message.content if self.body is None else None
+        self.compression = message.compression_summary()
+
+    def fields(self) -> dict:
+        """The message as `Protocol.get_data` would return it."""
+        if self.body is not None:
+            body, encoding = self.body
+            self.content = bytes(body).decode(encoding, "replace")
+            self.body = None
+        data = {
+            "TYPE": self.type,
+            "ID": self.id,
+            "METHOD": self.method,
+            "BODY": self.content,
+            "STATE": self.state,
+        }
+        if self.seq:
+            data["SEQ"] = self.seq
+        if self.dest:
+            data["DEST"] = self.dest
+        return data
+
+    def json(self) -> str:
+        """One line of JSON, as the JSON-lines file and plain consoles write it."""
+        return json.dumps(
+            {
+                "time": self.time,
+                "level": self.level.name,
+                "event": "send" if self.sending else "receive",
+                "peer": self.peer,
+                **self.fields(),
+            }
+        )
+
+
+class ConsoleSink:
+    """
+    Prints records in the colored `[LOG - HH:MM:SS]` format of the consoles,
+    or as JSON lines once `lib_cli.PLAIN` is set.
+    """
+
+    def __init__(self, print_func=print):
+        self.print_func = print_func
+
+    def write(self, record: Record):
+        if CLI.PLAIN:
+            self.print_func(record.json())
+            return
+        if record.sending:
+            title, arrow = CLI.color("steelblue", "SENDING:"), "-->"
+        else:
+            title, arrow = CLI.color("tomato", "RECEIVED:"), "<--"
+        output = f"[LOG - {time.strftime('%X', time.localtime(record.time))}] {title}\n"
+        output += (
+            f"{json.dumps(record.fields())} {arrow} "
+            f"{CLI.color('aquamarine', record.peer)}\n"
+        )
+        if record.compression:
+            output += f"{CLI.color('orchid', record.compression)}\n"
+        self.print_func(CLI.color("gray", output))
+
+    def summarize(self, line: str):
+        if CLI.PLAIN:
+            line = json.dumps(
+                {"time": time.time(), "level": "INFO", "event": "summary", "message": line}
+            )
+        self.print_func(CLI.color("gray", line))
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """Appends one JSON object per record to a file, rotated by size in bytes."""
+
+    def __init__(
+        self, path: str, max_bytes: int = MAX_LOG_BYTES, backups: int = LOG_BACKUPS
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # Binary, so that tell() and the line lengths are both counted in bytes
+        self.file = open(path, "ab")
+
+    def write(self, record: Record):
+        line = (record.json() + "\n").encode("utf-8")
+        if self.file.tell() + len(line) > self.max_bytes:
+            self.__rotate()
+        self.file.write(line)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __rotate(self):
+        self.file.close()
+        for index in range(self.backups, 0, -1):
+            source = self.path if index == 1 else f"{self.path}.{index - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+        if self.backups == 0:
+            os.remove(self.path)
+        self.file = open(self.path, "ab")
+
+
+class MessageLog:
+    """
+    Logs sent and received messages off the I/O threads. `send` and `receive`
+    only copy the message's fields into a Record and queue it. A writer thread,
+    started on first use, formats the records and hands them to the sinks.
+
+    Messages are logged at INFO and heartbeats at DEBUG, records below `level`
+    are skipped. `sample` maps a method to N, so only one in every N messages
+    of that method is logged, and 0 turns it off.
+
+    Setting `summary` to a number of seconds switches to summary mode. Messages
+    are then only counted, per peer, and the sinks get one line of totals and
+    top talkers per interval. Clients whose ID or tag is in `follow` are still
+    logged in full.
+    """
+
+    def __init__(self, sinks: list = None, level: Level = Level.INFO, sample=None):
+        self.sinks = [ConsoleSink()] if sinks is None else sinks
+        self.level = level
+        self.sample = {} if sample is None else dict(sample)
+        self.dropped = 0
+        self.summary = None
+        self.follow = set()
+        self.records = collections.deque()
+        # peer -> [received, sent, bytes, Counter of methods] since the last summary
+        self.__traffic = {}
+        self.__summarized = time.monotonic()
+        # Messages of each sampled method so far
+        self.__seen = collections.Counter()
+        # Guards __traffic and __seen, which every I/O thread updates. Never
+        # held while writing to the sinks, unlike __lock
+        self.__count_lock = threading.Lock()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__closed = threading.Event()
+
+    def send(self, message, peer: str, node=None):
+        self.__put(True, peer, message, node)
+
+    def receive(self, message, peer: str, node=None):
+        self.__put(False, peer, message, node)
+
+    def flush(self):
+        """Writes every queued record before returning."""
+        with self.__lock:
+            self.__write()
+
+    def close(self):
+        self.__closed.set()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+    def __put(self, sending: bool, peer: str, message, node):
+        if self.__thread is None:
+            self.__start()
+        if self.summary is not None:
+            self.__count(sending, peer, message, node)
+            if not self.follow or not self.__followed(node):
+                return
+        level = Level.DEBUG if message.method in HEARTBEAT_METHODS else Level.INFO
+        if level < self.level:
+            return
+        every = self.sample.get(message.method)
+        if every is not None:
+            with self.__count_lock:
+                self.__seen[message.method] += 1
+                seen = self.__seen[message.method]
+            if every == 0 or seen % every:
+                return
+        if len(self.records) >= MAX_RECORDS:
+            self.dropped += 1
+            return
+        self.records.append(Record(level, sending, peer, message))
+
+    def __count(self, sending: bool, peer: str, message, node):
+        key = peer if node is None else node.ID
+        with self.__count_lock:
+            counter = self.__traffic.get(key)
+            if counter is None:
+                counter = self.__traffic[key] = [0, 0, 0, collections.Counter()]
+            counter[sending] += 1
+            counter[2] += message.size
+            counter[3][message.method.value] += 1
+
+    def __followed(self, node) -> bool:
+        return node is not None and (
+            node.ID in self.follow or any(tag in self.follow for tag in node.tags)
+        )
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+
+    def __run(self):
+        while not self.__closed.wait(FLUSH_INTERVAL):
+            with self.__lock:
+                self.__write()
+                if (
+                    self.summary is not None
+                    and time.monotonic() - self.__summarized >= self.summary
+                ):
+                    self.__summarize()
+
+    def __summarize(self):
+        with self.__count_lock:
+            traffic, self.__traffic = self.__traffic, {}
+        now = time.monotonic()
+        seconds, self.__summarized = now - self.__summarized, now
+        if not traffic:
+            return
+        received = sum(counter[0] for counter in traffic.values())
+        sent = sum(counter[1] for counter in traffic.values())
+        size = sum(counter[2] for counter in traffic.values())
+        talkers = sorted(
+            traffic.items(), key=lambda item: item[1][0] + item[1][1], reverse=True
+        )
+        line = (
+            f"[SUMMARY - {time.strftime('%X')}] {seconds:.1f}s: "
+            f"{received} received, {sent} sent, {size / 1024:.1f} kB, "
+            f"{len(traffic)} peer(s) | top: "
+        )
+        line += ", ".join(
+            f"{peer} {counter[0] + counter[1]} ({counter[2] / 1024:.1f} kB, "
+            + " ".join(
+                f"{method} {count}"
+                for method, count in counter[3].most_common(TOP_METHODS)
+            )
+            + ")"
+            for peer, counter in talkers[:TOP_TALKERS]
+        )
+        for sink in self.sinks:
+            if hasattr(sink, "summarize"):
+                sink.summarize(line)
+
+    def __write(self):
+        wrote = False
+        while self.records:
+            record = self.records.popleft()
+            for sink in self.sinks:
+                try:
+                    sink.write(record)
+                except Exception:
+                    pass
+            wrote = True
+        if wrote:
+            for sink in self.sinks:
+                if hasattr(sink, "flush"):
+                    sink.flush()
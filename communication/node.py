@@ -1,13 +1,335 @@
 import ipaddress as ip
+import selectors
 import socket
+import threading
+import time
+from collections import deque
 
-import jsonschema
 from lib_cli import print_array, table, message
 
 DEFAULT_IP = "10.1.1.150"
 DEFAULT_PORT = 5000
 DEFAULT_GATEWAY = "10.1.1.1"
 
+# Outbound queues: bytes held per client, and what happens when they are full
+MAX_QUEUE_BYTES = 4 * 1024 * 1024
+QUEUE_TIMEOUT = 10.0
+QUEUE_POLICIES = ("block", "drop_oldest", "disconnect")
+# Non-blocking sends without changing the socket's mode, where supported
+SEND_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class QueueFull(ConnectionError):
+    pass
+
+
+class OutboundQueue:
+    """
+    Frames waiting to be written to one socket. Frames are written with
+    non-blocking sends, and what the socket does not take is kept in order
+    until a `Writer` sees the socket become writable again.
+
+    When a frame does not fit in `max_bytes`, the policy decides:
+    "drop_oldest" drops the oldest unsent frames, "disconnect" raises
+    QueueFull, and "block" holds up the sending thread for up to QUEUE_TIMEOUT
+    while the socket drains. It waits without the queue's lock, so the Writer
+    and other senders carry on, but a broadcast waits for the slowest client.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        max_bytes: int = MAX_QUEUE_BYTES,
+        policy: str = "drop_oldest",
+        writer=None,
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown policy '{policy}', expected one of {QUEUE_POLICIES}")
+        self.sock = sock
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.writer = writer
+        self.frames = deque()
+        # Bytes of the first frame that are already written
+        self.offset = 0
+        self.bytes = 0
+        self.peak = 0
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def put(self, data: bytes):
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        while True:
+            with self.lock:
+                if self.closed:
+                    raise ConnectionResetError("Connection is closed")
+                if self.__full(len(data)):
+                    self.__make_room(len(data))
+                if self.policy != "block" or not self.__full(len(data)):
+                    self.frames.append(data)
+                    self.bytes += len(data)
+                    self.peak = max(self.peak, self.bytes)
+                    pending = self.__flush()
+                    break
+            # Only "block" gets here, it waits with the lock released
+            if not self.__wait_writable(deadline):
+                raise QueueFull(f"Outbound queue did not drain in {QUEUE_TIMEOUT}s")
+        if pending and self.writer is not None:
+            self.writer.watch(self)
+
+    def flush(self) -> bool:
+        """Writes what the socket takes, returns whether frames are still pending."""
+        with self.lock:
+            return self.__flush()
+
+    def drain(self, timeout: float = QUEUE_TIMEOUT) -> bool:
+        """Writes every queued frame, waiting up to `timeout`, such as before a close."""
+        deadline = time.monotonic() + timeout
+        try:
+            while self.flush():
+                if not self.__wait_writable(deadline):
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+            self.bytes = self.offset = 0
+        if self.writer is not None:
+            self.writer.unwatch(self)
+
+    def __full(self, size: int) -> bool:
+        return bool(self.frames) and self.bytes + size > self.max_bytes
+
+    def __make_room(self, size: int):
+        if self.policy == "disconnect":
+            raise QueueFull(f"Outbound queue is full ({self.bytes} bytes)")
+
+        if self.policy == "drop_oldest":
+            # A frame that is partly written must be finished, or the stream breaks
+            keep = 1 if self.offset else 0
+            while len(self.frames) > keep and self.bytes + size > self.max_bytes:
+                frame = self.frames[keep]
+                del self.frames[keep]
+                self.bytes -= len(frame)
+                self.dropped += 1
+            return
+
+        self.__flush()
+
+    def __wait_writable(self, deadline: float) -> bool:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.sock, selectors.EVENT_WRITE)
+                selector.select(remaining)
+        except (OSError, ValueError):
+            raise ConnectionResetError("Connection is closed")
+        return True
+
+    def __flush(self) -> bool:
+        if self.closed:
+            return False
+        while self.frames:
+            frame = self.frames[0]
+            try:
+                if SEND_FLAGS:
+                    size = self.sock.send(memoryview(frame)[self.offset :], SEND_FLAGS)
+                else:
+                    # The socket goes back to its mode once the send returns
+                    timeout = self.sock.gettimeout()
+                    self.sock.setblocking(False)
+                    try:
+                        size = self.sock.send(memoryview(frame)[self.offset :])
+                    finally:
+                        self.sock.settimeout(timeout)
+            except (BlockingIOError, InterruptedError):
+                break
+            self.offset += size
+            if self.offset < len(frame):
+                break
+            self.frames.popleft()
+            self.bytes -= len(frame)
+            self.offset = 0
+            self.sent += 1
+        return len(self.frames) > 0
+
+    def __str__(self):
+        return (
+            f"{len(self.frames)} frame(s), {self.bytes} B, peak {self.peak} B, "
+            f"{self.dropped} dropped"
+        )
+
+
+class Writer:
+    """
+    One thread that flushes the outbound queues of every socket that could
+    not take all of its data, once the socket is writable. Started on first use.
+    `lock` only guards the selector, no queue's lock is taken while holding it,
+    so one stuck queue never holds up `watch` for the others.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = True
+        # Wakes the thread when a queue is watched while it waits in select
+        self.wake_receive, self.wake_send = socket.socketpair()
+        self.wake_receive.setblocking(False)
+        self.selector.register(self.wake_receive, selectors.EVENT_READ)
+
+    def watch(self, queue: OutboundQueue):
+        with self.lock:
+            if not self.running:
+                return
+            try:
+                self.selector.register(queue.sock, selectors.EVENT_WRITE, queue)
+            except KeyError:
+                return
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+        self.wake_send.send(b"\0")
+
+    def unwatch(self, queue: OutboundQueue):
+        with self.lock:
+            try:
+                self.selector.unregister(queue.sock)
+            except (KeyError, ValueError):
+                pass
+
+    def close(self):
+        with self.lock:
+            self.running = False
+        self.wake_send.send(b"\0")
+        if self.thread is not None:
+            self.thread.join()
+        self.selector.close()
+        self.wake_receive.close()
+        self.wake_send.close()
+
+    def __run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=1):
+                if key.data is None:
+                    try:
+                        self.wake_receive.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                queue = key.data
+                try:
+                    pending = queue.flush()
+                except OSError:
+                    pending = False
+                if not pending:
+                    with self.lock:
+                        try:
+                            self.selector.unregister(key.fileobj)
+                        except (KeyError, ValueError):
+                            pass
+                    # A frame queued since the flush found the socket still
+                    # watched, so its watch() was a no-op
+                    if queue.frames and not queue.closed:
+                        self.watch(queue)
+
+
+class ClientRegistry:
+    """
+    The connected clients in connection order, indexed by ID, tag, IP and
+    address. A change replaces the clients and indexes as a whole, so readers
+    take no lock and iterate a snapshot that no connection can change.
+    """
+
+    INDEXES = {
+        "ID": lambda node: [node.ID],
+        "tag": lambda node: node.tags,
+        "IP": lambda node: [str(node.IP)],
+        "address": lambda node: [node.address],
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.__clients = ()
+        self.__indexes = {name: {} for name in ClientRegistry.INDEXES}
+        # Called as listener("add" or "remove", node) after each change
+        self.listeners = []
+
+    def add(self, node: "Node"):
+        with self.lock:
+            indexes = {name: dict(index) for name, index in self.__indexes.items()}
+            for name, keys in ClientRegistry.INDEXES.items():
+                for key in keys(node):
+                    indexes[name][key] = indexes[name].get(key, ()) + (node,)
+            self.__clients, self.__indexes = self.__clients + (node,), indexes
+        self.__notify("add", node)
+
+    def remove(self, node: "Node") -> bool:
+        with self.lock:
+            if node not in self.__clients:
+                return False
+            indexes = {name: dict(index) for name, index in self.__indexes.items()}
+            for name, keys in ClientRegistry.INDEXES.items():
+                for key in keys(node):
+                    nodes = tuple(n for n in indexes[name].get(key, ()) if n is not node)
+                    if nodes:
+                        indexes[name][key] = nodes
+                    else:
+                        indexes[name].pop(key, None)
+            clients = tuple(n for n in self.__clients if n is not node)
+            self.__clients, self.__indexes = clients, indexes
+        self.__notify("remove", node)
+        return True
+
+    def __notify(self, event: str, node: "Node"):
+        for listener in self.listeners:
+            listener(event, node)
+
+    def snapshot(self) -> tuple:
+        return self.__clients
+
+    def find(self, index: str, key) -> tuple:
+        """Every client with `key` in `index`, in connection order."""
+        return self.__indexes[index].get(key, ())
+
+    def get_by_id(self, client_id: str) -> "Node":
+        return self.__first("ID", client_id)
+
+    def get_by_tag(self, tag: str) -> "Node":
+        return self.__first("tag", tag)
+
+    def get_by_ip(self, client_ip) -> "Node":
+        return self.__first("IP", str(client_ip))
+
+    def get_by_address(self, address: tuple) -> "Node":
+        return self.__first("address", (str(address[0]), int(address[1])))
+
+    def __first(self, index: str, key) -> "Node":
+        nodes = self.__indexes[index].get(key)
+        return nodes[0] if nodes else None
+
+    def __contains__(self, node) -> bool:
+        if isinstance(node, tuple):
+            return self.get_by_address(node) is not None
+        return node in self.__clients
+
+    def __len__(self) -> int:
+        return len(self.__clients)
+
+    def __iter__(self):
+        return iter(self.__clients)
+
+    def __getitem__(self, index: int) -> "Node":
+        return self.__clients[index]
+
 
 class Node:
     def __init__(
@@ -20,9 +342,25 @@ class Node:
         net_mask: str or int = 24,
         gateway: str or ip.IPv4Address = DEFAULT_GATEWAY,
         config_data: dict = None,
+        outbound: bool = True,
     ):
+        # protocol.py imports Node, so FrameBuffer is imported on use
+        from protocol import FrameBuffer, Requests, Transfers
+
         self.socket = socket
+        self.transfers = Transfers()
+        self.frames = FrameBuffer(transfers=self.transfers)
+        self.features = set()
+        # None for servers that write to the socket themselves, see AsyncServer
+        self.outbound = OutboundQueue(socket) if outbound else None
+        # the server numbers its requests evenly, clients oddly
+        self.requests = Requests(first=2)
+        # When the client was last heard from, and its next heartbeat check
+        self.last_seen = time.monotonic()
+        self.heartbeat = None
         peerName = socket.getpeername()
+        # Where the connection comes from, PORT may be set by the configuration
+        self.address = (str(peerName[0]), int(peerName[1]))
 
         def default(data, key, default):
             return data[key] if key in data else default
@@ -85,6 +423,11 @@ class Node:
     def show(self, compact: bool = True, basic: bool = False):
         self.help.show(compact=compact, basic=basic)
 
+    @property
+    def idle(self) -> float:
+        """Seconds since the client was last heard from."""
+        return time.monotonic() - self.last_seen
+
     def get_basic(self) -> tuple:
         return (self.ID, self.IP, self.net_mask, self.tags)
 
@@ -96,14 +439,22 @@ class Node:
         return _data
 
     def close(self) -> None:
+        if self.outbound is not None:
+            self.outbound.close()
         self.socket.shutdown(socket.SHUT_RDWR)
         self.socket.close()
 
-    def send(self, data: str, encoding="ascii") -> None:
-        self.socket.send(data.encode(encoding))
-
-    def read(self, buff_size: int = 1024, decoding: str = "ascii") -> str:
-        return self.socket.recv(buff_size).decode(decoding)
+    def send(self, data: bytes) -> None:
+        # Queued, so a slow client never blocks the thread that sends to it
+        self.outbound.put(data)
+
+    def read(self, buff_size: int = 0) -> list:
+        try:
+            messages = self.frames.receive(self.socket, buff_size)
+        except BlockingIOError:
+            return []
+        self.last_seen = time.monotonic()
+        return messages
 
     @staticmethod
     def netmask_to_cidr(network_mask: str) -> str:
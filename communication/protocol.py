@@ -1,9 +1,14 @@
-from enum import Enum
-from string import Template
+from concurrent.futures import Future
+from enum import Enum, IntFlag
 import socket
+import struct
+import threading
+import itertools
+import time
 import json
-import jsonschema
+import zlib
 from node import Node
+from timers import WHEEL
 
 
 # Possibly add  and 'await' msg
@@ -18,6 +23,8 @@ class ProtocolState(Enum):
 class ProtocolType(Enum):
     DIRECT = "DIRECT"
     BROADCAST = "BROADCAST"
+    BATCH = "BATCH"
+    STREAM = "STREAM"
 
 
 class ProtocolMethod(Enum):
@@ -30,6 +37,82 @@ class ProtocolMethod(Enum):
 
     DEMO = "DEMO"
 
+    PING = "PING"
+    PONG = "PONG"
+
+    # Enum hashes members by name in Python code, members are singletons so
+    # the identity hash is equivalent and keeps dispatch table lookups in C
+    __hash__ = object.__hash__
+
+
+# Sent whenever a connection is quiet, they are left out of the message logs
+HEARTBEAT_METHODS = (ProtocolMethod.PING, ProtocolMethod.PONG)
+
+
+# Every frame on the wire is a 4 byte big-endian header followed by the payload.
+# The low 24 bits of the header hold the payload length, the high 8 bits hold FrameFlags
+FRAME_HEADER = struct.Struct("!I")
+FRAME_FLAG_SHIFT = 24
+FRAME_LENGTH_MASK = (1 << FRAME_FLAG_SHIFT) - 1
+MAX_FRAME_SIZE = 1024 * 1024
+RECEIVE_SIZE = 4096
+
+
+class FrameFlag(IntFlag):
+    NONE = 0
+    BINARY = 1
+    ZLIB = 2
+    CHUNK = 4
+
+
+# Seconds a request waits for its reply. Server sequence numbers are even and client
+# ones odd, so a reply can never be mistaken for a new message from the peer
+REQUEST_TIMEOUT = 10.0
+
+# Chunked transfers: a CHUNK frame holds the transfer ID and byte offset, then data.
+# Senders stay at most STREAM_WINDOW bytes ahead of the receiver's last AWK
+CHUNK_HEADER = struct.Struct("!IQ")
+CHUNK_SIZE = 64 * 1024
+STREAM_WINDOW = 1024 * 1024
+STREAM_TIMEOUT = 30.0
+MAX_TRANSFER_SIZE = 256 * 1024 * 1024
+# Limits on what one connection may have preallocated for incoming transfers
+MAX_TRANSFERS = 8
+MAX_TRANSFER_BYTES = 512 * 1024 * 1024
+
+# Payloads at least this large are zlib compressed when the peer supports it
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+
+# Optional wire features, advertised by the server in the INIT SUCCESS body
+# and accepted by the client in an INIT AWK reply. Peers without them use JSON.
+# Features go on the wire by value, and the value of BINARY changes with every
+# change to BINARY_HEADER, so peers with another layout fall back to JSON
+class ProtocolFeature(Enum):
+    # "BINARY" was the layout without SEQ and DEST
+    BINARY = "BINARY2"
+    ZLIB = "ZLIB"
+
+    @staticmethod
+    def encode(features) -> str:
+        return json.dumps({"FEATURES": sorted(feature.value for feature in features)})
+
+    @staticmethod
+    def decode(content: str) -> set:
+        try:
+            names = json.loads(content)["FEATURES"]
+        except (ValueError, TypeError, KeyError):
+            return set()
+        values = {feature.value for feature in ProtocolFeature}
+        try:
+            return {ProtocolFeature(name) for name in names if name in values}
+        except TypeError:
+            return set()
+
+
+SUPPORTED_FEATURES = {ProtocolFeature.BINARY, ProtocolFeature.ZLIB}
+
 
 class Field(Enum):
     ID = "ID"
@@ -37,6 +120,8 @@ class Field(Enum):
     METHOD = "METHOD"
     BODY = "BODY"
     STATE = "STATE"
+    SEQ = "SEQ"
+    DEST = "DEST"
 
 
 DEFAULT_SCHEMA = {
@@ -50,12 +135,109 @@ DEFAULT_SCHEMA = {
             "type": "string",
             "enum": [state.value for state in ProtocolState],
         },
+        Field.SEQ.name: {"type": "integer", "minimum": 0},
+        Field.DEST.name: {"type": "string"},
     },
     "required": [Field.TYPE.name, Field.ID.name, Field.METHOD.name],
 }
 
 
+
+class SchemaValidator:
+    """
+    Validates data against a JSON schema like a jsonschema validator. jsonschema
+    is slow to import, so it is only imported, and the validator built once,
+    when `check(data)` cannot tell by itself that the data is valid.
+    """
+
+    def __init__(self, schema: dict, check=None):
+        self.schema = schema
+        self.check = check
+        self.__validator = None
+
+    def validate(self, data):
+        if self.check is None or not self.check(data):
+            self.validator().validate(data)
+
+    def validator(self):
+        # Building a validator is the expensive part of jsonschema.validate
+        if self.__validator is None:
+            import jsonschema
+
+            self.__validator = jsonschema.validators.validator_for(self.schema)(
+                self.schema
+            )
+        return self.__validator
+
+
+STATE_VALUES = frozenset(state.value for state in ProtocolState)
+
+
+def matches_default_schema(data: dict) -> bool:
+    """True if `data` follows every rule of DEFAULT_SCHEMA."""
+    state = data.get(Field.STATE.name, ProtocolState.DEFAULT.value)
+    seq = data.get(Field.SEQ.name, 0)
+    return (
+        type(data.get(Field.TYPE.name)) is str
+        and type(data.get(Field.ID.name)) is str
+        and type(data.get(Field.METHOD.name)) is str
+        and type(data.get(Field.BODY.name, "")) is str
+        and type(data.get(Field.DEST.name, "")) is str
+        and type(state) is str
+        and state in STATE_VALUES
+        and type(seq) is int
+        and seq >= 0
+    )
+
+
+DEFAULT_VALIDATOR = SchemaValidator(DEFAULT_SCHEMA, matches_default_schema)
+
+# Binary codec: TYPE, METHOD and STATE as one byte codes, the SEQ, then the ID, DEST
+# and BODY lengths. Codes are enum positions, so new enum members must only be appended
+BINARY_HEADER = struct.Struct("!BBBIHHI")
+BINARY_CODES = {
+    member: code
+    for enum in (ProtocolType, ProtocolMethod, ProtocolState)
+    for code, member in enumerate(enum)
+}
+BINARY_TYPES = list(ProtocolType)
+BINARY_METHODS = list(ProtocolMethod)
+BINARY_STATES = list(ProtocolState)
+
+
+class ProtocolError(ValueError):
+    # Messages parsed from the same bytes as the error, still to be handled
+    messages = ()
+
+
 class Protocol:
+    """
+    A single message. Each field is stored once, in a slot, and the encoded
+    frame is cached until one of the fields changes. Bodies of binary frames are
+    kept as raw bytes and only decoded when `content` is first read.
+    """
+
+    __slots__ = (
+        "_protocol_type",
+        "_method",
+        "_state",
+        "_id",
+        "_seq",
+        "_dest",
+        "_content",
+        "_body",
+        "_body_start",
+        "_encoding",
+        "_text",
+        "_frame",
+        "node",
+        "trusted",
+        "compression",
+        "payload",
+        "raw",
+        "size",
+    )
+
     def __init__(
         self,
         protocol_type: ProtocolType or str = ProtocolType.DIRECT,
@@ -64,22 +246,130 @@ class Protocol:
         content: str = "",
         id: str = "...",
         json_data: dict = None,
+        dest: str = "",
     ):
-        self.method = self._validate_enum(method, ProtocolMethod)
-        self.protocol_type = self._validate_enum(protocol_type, ProtocolType)
-        self.state = self._validate_enum(state, ProtocolState)
+        self._method = self._validate_enum(method, ProtocolMethod)
+        self._protocol_type = self._validate_enum(protocol_type, ProtocolType)
+        self._state = self._validate_enum(state, ProtocolState)
 
-        self.id = id
-        self.content = f"{content}"
+        self._id = id
+        self._seq = 0
+        self._dest = dest
+        self._content = f"{content}"
+        self._body = None
+        self._body_start = 0
+        self._encoding = None
+        self._text = None
+        self._frame = None
         self.node = None
-        self.data = {}
+        # (uncompressed bytes, compressed bytes, seconds) of the last zlib pass
+        self.compression = None
+        # Raw bytes of a completed chunked transfer
+        self.payload = None
+        # The frame as it was received, kept for messages routed to another client
+        self.raw = None
+        # Bytes of the frame the message was last received or encoded in
+        self.size = 0
+
+        # Enum typed fields are valid by construction, so the schema check is skipped
+        self.trusted = (
+            type(protocol_type) is ProtocolType
+            and type(method) is ProtocolMethod
+            and type(state) is ProtocolState
+            and type(id) is str
+            and type(dest) is str
+        )
 
-        self._populate_data()
         if json_data is not None:
             self._populate_from_json(json_data)
-            self.data = {Field[key]: value for key, value in json_data.items()}
-            if Field.ID.name not in self.data:
-                self.data[Field.ID.name] = "0"
+
+    def _changed(self):
+        self._text = None
+        self._frame = None
+        self.raw = None
+
+    @property
+    def protocol_type(self) -> ProtocolType:
+        return self._protocol_type
+
+    @protocol_type.setter
+    def protocol_type(self, value: ProtocolType or str):
+        self._protocol_type = self._validate_enum(value, ProtocolType)
+        self._changed()
+
+    @property
+    def method(self) -> ProtocolMethod:
+        return self._method
+
+    @method.setter
+    def method(self, value: ProtocolMethod or str):
+        self._method = self._validate_enum(value, ProtocolMethod)
+        self._changed()
+
+    @property
+    def state(self) -> ProtocolState:
+        return self._state
+
+    @state.setter
+    def state(self, value: ProtocolState or str):
+        self._state = self._validate_enum(value, ProtocolState)
+        self._changed()
+
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @id.setter
+    def id(self, value: str):
+        if value != self._id:
+            self._id = f"{value}"
+            self._changed()
+
+    @property
+    def seq(self) -> int:
+        """Per-connection sequence number, 0 until the message is first sent."""
+        return self._seq
+
+    @seq.setter
+    def seq(self, value: int):
+        self._seq = int(value)
+        self._changed()
+
+    @property
+    def dest(self) -> str:
+        """ID or tag of the client a DIRECT message is routed to, empty if none."""
+        return self._dest
+
+    @dest.setter
+    def dest(self, value: str):
+        self._dest = f"{value}"
+        self._changed()
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            try:
+                self._content = self._body[self._body_start :].decode(self._encoding)
+            except UnicodeDecodeError as err:
+                raise ProtocolError(f"Invalid BODY: {err}")
+            self._body = None
+        return self._content
+
+    def encoded_body(self):
+        """(bytes, encoding) of a BODY that has not been decoded yet, else None."""
+        if self._content is not None:
+            return None
+        return memoryview(self._body)[self._body_start :], self._encoding
+
+    @content.setter
+    def content(self, value: str):
+        self._content = f"{value}"
+        self._body = None
+        self._changed()
+
+    @property
+    def data(self) -> dict:
+        return {field: self[field] for field in Field}
 
     @staticmethod
     def _validate_enum(value, enum):
@@ -93,86 +383,335 @@ class Protocol:
             )
         return enum.DEFAULT
 
-    def _populate_data(self):
-        self.data = {
-            Field.TYPE: self.protocol_type.value,
-            Field.ID: self.id,
-            Field.METHOD: self.method.value,
-            Field.BODY: self.content,
-            Field.STATE: self.state.value,
-        }
-
     def _populate_from_json(self, json_data):
-        self.method = ProtocolMethod[json_data[Field.METHOD.name]]
-        self.protocol_type = ProtocolType[json_data[Field.TYPE.name]]
-        self.state = ProtocolState[json_data[Field.STATE.name]]
-        self.content = json_data[Field.BODY.name]
-        self.id = json_data[Field.ID.name]
+        Protocol._check_fields(json_data)
+        self._method = ProtocolMethod[json_data[Field.METHOD.name]]
+        self._protocol_type = ProtocolType[json_data[Field.TYPE.name]]
+        self._state = ProtocolState[
+            json_data.get(Field.STATE.name, ProtocolState.DEFAULT.value)
+        ]
+        self._content = json_data.get(Field.BODY.name, "")
+        self._id = json_data.get(Field.ID.name, "0")
+        self._seq = json_data.get(Field.SEQ.name, 0)
+        self._dest = json_data.get(Field.DEST.name, "")
+        self.trusted = True
+
+    @staticmethod
+    def _check_fields(json_data):
+        """Hand-written equivalent of DEFAULT_SCHEMA for inbound messages."""
+        if type(json_data) is not dict:
+            raise ProtocolError("Message is not a JSON object")
+        for field in (Field.TYPE, Field.ID, Field.METHOD):
+            if field.name not in json_data:
+                raise ProtocolError(f"Message is missing '{field.name}'")
+        for field in (
+            Field.TYPE,
+            Field.ID,
+            Field.METHOD,
+            Field.BODY,
+            Field.STATE,
+            Field.DEST,
+        ):
+            value = json_data.get(field.name, "")
+            if type(value) is not str:
+                raise ProtocolError(f"'{field.name}' must be a string")
+        seq = json_data.get(Field.SEQ.name, 0)
+        if type(seq) is not int or seq < 0:
+            raise ProtocolError(f"'{Field.SEQ.name}' must be a non-negative integer")
+        if json_data[Field.TYPE.name] not in ProtocolType.__members__:
+            raise ProtocolError(f"Unknown TYPE '{json_data[Field.TYPE.name]}'")
+        if json_data[Field.METHOD.name] not in ProtocolMethod.__members__:
+            raise ProtocolError(f"Unknown METHOD '{json_data[Field.METHOD.name]}'")
+        if json_data.get(Field.STATE.name, "DEFAULT") not in ProtocolState.__members__:
+            raise ProtocolError(f"Unknown STATE '{json_data[Field.STATE.name]}'")
 
     def get_data(self, node=None) -> dict:
         self.node = node
-        self._populate_data()
-
-        data = {key.name: value for key, value in self.data.items()}
-        jsonschema.validate(instance=data, schema=DEFAULT_SCHEMA)
+        data = {
+            Field.TYPE.name: self._protocol_type.value,
+            Field.ID.name: self._id,
+            Field.METHOD.name: self._method.value,
+            Field.BODY.name: self.content,
+            Field.STATE.name: self._state.value,
+        }
+        if self._seq:
+            data[Field.SEQ.name] = self._seq
+        if self._dest:
+            data[Field.DEST.name] = self._dest
+        if not self.trusted:
+            DEFAULT_VALIDATOR.validate(data)
+            self.trusted = True
         return data
 
-    def to_network(self, node=None, encoding="ascii") -> str:
-        return json.dumps(self.get_data(node)).encode(encoding)
+    @staticmethod
+    def _frame_key(encoding, features) -> tuple:
+        return (
+            encoding,
+            ProtocolFeature.BINARY in features,
+            ProtocolFeature.ZLIB in features,
+        )
+
+    def to_network(self, node=None, encoding="ascii", features=()) -> bytes:
+        key = Protocol._frame_key(encoding, features)
+        if self._frame is not None and self._frame[0] == key:
+            return self._frame[1]
+
+        if key[1]:
+            payload, flags = self.to_binary(node, encoding), FrameFlag.BINARY
+        else:
+            payload, flags = self.msg().encode(encoding), FrameFlag.NONE
+
+        self.compression = None
+        if key[2] and len(payload) >= COMPRESSION_THRESHOLD:
+            start = time.perf_counter()
+            compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+            self.compression = (
+                len(payload),
+                len(compressed),
+                time.perf_counter() - start,
+            )
+            if len(compressed) < len(payload):
+                payload, flags = compressed, flags | FrameFlag.ZLIB
+
+        frame = Protocol.frame(payload, flags)
+        self._frame = (key, frame)
+        self.size = len(frame)
+        return frame
+
+    def to_binary(self, node=None, encoding="ascii") -> bytes:
+        if not self.trusted:
+            self.get_data(node)
+        id = self._id.encode(encoding)
+        dest = self._dest.encode(encoding)
+        body = self.content.encode(encoding)
+        header = BINARY_HEADER.pack(
+            BINARY_CODES[self._protocol_type],
+            BINARY_CODES[self._method],
+            BINARY_CODES[self._state],
+            self._seq,
+            len(id),
+            len(dest),
+            len(body),
+        )
+        return header + id + dest + body
 
     @staticmethod
-    def from_network(message):
-        data = json.loads(message)
-        return Protocol(json_data=data)
+    def from_network(message, flags: FrameFlag = FrameFlag.NONE, encoding="ascii"):
+        compression = None
+        if flags & FrameFlag.ZLIB:
+            start = time.perf_counter()
+            compressed_size = len(message)
+            message = Protocol.decompress(message)
+            compression = (
+                len(message),
+                compressed_size,
+                time.perf_counter() - start,
+            )
 
-    def msg(self) -> str:
-        return json.dumps(self.get_data(self.node))
+        if flags & FrameFlag.BINARY:
+            protocol = Protocol.from_binary(message, encoding)
+        else:
+            try:
+                json_data = json.loads(message)
+            except ValueError as err:
+                # JSONDecodeError and UnicodeDecodeError are both ValueErrors
+                raise ProtocolError(f"Invalid JSON message: {err}")
+            protocol = Protocol(json_data=json_data)
+        protocol.compression = compression
+        return protocol
 
-    def __str__(self):
-        return self.msg()
+    @staticmethod
+    def decompress(payload: bytes) -> bytes:
+        # Bounded, so a small frame can not expand past MAX_FRAME_SIZE
+        decompressor = zlib.decompressobj()
+        try:
+            message = decompressor.decompress(payload, MAX_FRAME_SIZE)
+        except zlib.error as err:
+            raise ProtocolError(f"Invalid ZLIB payload: {err}")
+        if decompressor.unconsumed_tail:
+            raise FrameError(f"ZLIB payload expands past {MAX_FRAME_SIZE} bytes")
+        return message
 
-    def __bool__(self):
+    def compression_summary(self) -> str:
+        if self.compression is None:
+            return ""
+        size, compressed_size, seconds = self.compression
+        return (
+            f"ZLIB {size} -> {compressed_size} bytes "
+            f"({compressed_size / size:.0%}) in {seconds * 1000:.3f} ms"
+        )
+
+    @staticmethod
+    def from_binary(message: bytes, encoding="ascii"):
+        if len(message) < BINARY_HEADER.size:
+            raise ProtocolError("Binary message is shorter than its header")
+        type_code, method_code, state_code, seq, id_size, dest_size, body_size = (
+            BINARY_HEADER.unpack_from(message)
+        )
+        if BINARY_HEADER.size + id_size + dest_size + body_size != len(message):
+            raise ProtocolError("Binary message length does not match its header")
         try:
-            # self.get_data()
-            self._populate_data()
-        except:
-            print("Failed to get data")
-            return False
+            protocol = Protocol(
+                protocol_type=BINARY_TYPES[type_code],
+                method=BINARY_METHODS[method_code],
+                state=BINARY_STATES[state_code],
+            )
+        except IndexError:
+            raise ProtocolError("Binary message has an unknown TYPE, METHOD or STATE")
+        id_end = BINARY_HEADER.size + id_size
+        body_start = id_end + dest_size
+        try:
+            protocol._id = message[BINARY_HEADER.size : id_end].decode(encoding)
+            protocol._dest = message[id_end:body_start].decode(encoding)
+        except UnicodeDecodeError as err:
+            raise ProtocolError(f"Invalid binary ID or DEST: {err}")
+        protocol._seq = seq
+        # The body is decoded on first access, a relay never needs to decode it
+        protocol._content = None
+        protocol._body = message
+        protocol._body_start = body_start
+        protocol._encoding = encoding
+        return protocol
 
-        content_size = len(self[Field.BODY])
-        method_size = len(self[Field.METHOD])
+    def sign(self, id: str, encoding="ascii"):
+        """
+        Sets the ID. A received binary frame is kept for `forward` with the new
+        ID patched in, so BODY is still neither decoded nor encoded.
+        """
+        raw = self.raw
+        self.id = id
+        if raw is None or self.raw is not None:
+            return
+        flags = FrameFlag(FRAME_HEADER.unpack_from(raw)[0] >> FRAME_FLAG_SHIFT)
+        if flags != FrameFlag.BINARY:
+            return
+        payload = memoryview(raw)[FRAME_HEADER.size :]
+        fields = list(BINARY_HEADER.unpack_from(payload))
+        id_end = BINARY_HEADER.size + fields[4]
+        encoded = self._id.encode(encoding)
+        fields[4] = len(encoded)
+        self.raw = Protocol.frame(
+            BINARY_HEADER.pack(*fields) + encoded + payload[id_end:], flags
+        )
+
+    def forward(self, features=()) -> bytes:
+        """
+        The frame to route the message to a peer with `features`. That is the
+        frame it was received in, as long as the peer can read it, so a routed
+        message is neither decoded nor encoded again.
+        """
+        if self.raw is not None:
+            flags = FRAME_HEADER.unpack_from(self.raw)[0] >> FRAME_FLAG_SHIFT
+            if (not flags & FrameFlag.BINARY or ProtocolFeature.BINARY in features) and (
+                not flags & FrameFlag.ZLIB or ProtocolFeature.ZLIB in features
+            ):
+                return self.raw
+        return self.to_network(features=features)
+
+    @staticmethod
+    def frame(payload: bytes, flags: FrameFlag = FrameFlag.NONE) -> bytes:
+        if len(payload) > MAX_FRAME_SIZE:
+            raise FrameError(
+                f"Frame of {len(payload)} bytes exceeds {MAX_FRAME_SIZE} bytes"
+            )
+        return FRAME_HEADER.pack(flags << FRAME_FLAG_SHIFT | len(payload)) + payload
 
+    @staticmethod
+    def chunk(transfer_id: int, offset: int, data: bytes) -> bytes:
+        return Protocol.frame(
+            CHUNK_HEADER.pack(transfer_id, offset) + data, FrameFlag.CHUNK
+        )
 
-        b1 = self._validate_enum(self.method, ProtocolMethod) == self.method
-        b2 = self._validate_enum(self.protocol_type, ProtocolType) == self.protocol_type
-        b3 = self._validate_enum(self.state, ProtocolState) == self.state
+    @staticmethod
+    def pipeline(messages: list, node=None, encoding="ascii", features=()) -> bytes:
+        """Encodes several messages back to back so they can go out in one write."""
+        return b"".join(
+            message.to_network(node=node, encoding=encoding, features=features)
+            for message in messages
+        )
 
-        broadcast_requires_body = (
-            self[Field.TYPE] == ProtocolType.BROADCAST.value
-            and len(self[Field.BODY]) > 0
+    @staticmethod
+    def batch(messages: list, id: str = "..."):
+        """Packs several messages into one BATCH message, sent as a single frame."""
+        return Protocol(
+            protocol_type=ProtocolType.BATCH,
+            content=json.dumps([message.get_data() for message in messages]),
+            id=id,
+        )
+
+    def unbatch(self) -> list:
+        """Unpacks the messages carried by a BATCH message."""
+        try:
+            entries = json.loads(self.content)
+        except ValueError:
+            raise ProtocolError("BATCH body is not valid JSON")
+        if type(entries) is not list:
+            raise ProtocolError("BATCH body is not a list of messages")
+        return [Protocol(json_data=entry) for entry in entries]
+
+    def msg(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.get_data(self.node))
+        return self._text
+
+    def __str__(self):
+        return self.msg()
+
+    def __bool__(self):
+        return (
+            type(self._method) is ProtocolMethod
+            and type(self._protocol_type) is ProtocolType
+            and type(self._state) is ProtocolState
         )
-        return b1 and b2 and b3
 
     # Returns True if some string command matches the command for this object
     def __eq__(self, __value: object) -> bool:
-        if type(__value) is Protocol:
-            return self[Field.METHOD] == __value[Field.METHOD]
-        if type(__value) is str:
-            return self[Field.METHOD] == __value
         if type(__value) is ProtocolMethod:
-            return self[Field.METHOD] == __value.value
+            return self._method is __value
+        if isinstance(__value, Protocol):
+            return self._method is __value._method
+        if type(__value) is str:
+            return self._method.value == __value
         return False
 
     def __getitem__(self, key: Field or str):
-        if type(key) is Field:
-            return self.data[key]
-        elif type(key) is str:
-            for key, value in self.data.items():
-                if key.name == key:
-                    return value
+        if type(key) is str:
+            if key not in Field.__members__:
+                return None
+            key = Field[key]
+        if key is Field.TYPE:
+            return self._protocol_type.value
+        if key is Field.ID:
+            return self._id
+        if key is Field.METHOD:
+            return self._method.value
+        if key is Field.BODY:
+            return self.content
+        if key is Field.STATE:
+            return self._state.value
+        if key is Field.SEQ:
+            return self._seq
+        if key is Field.DEST:
+            return self._dest
+        return None
 
-    def __setitem__(self, key: Field, value):
-        self.data[key] = value
+    def __setitem__(self, key: Field or str, value):
+        if type(key) is str:
+            key = Field[key]
+        if key is Field.TYPE:
+            self.protocol_type = value
+        elif key is Field.ID:
+            self.id = value
+        elif key is Field.METHOD:
+            self.method = value
+        elif key is Field.BODY:
+            self.content = value
+        elif key is Field.STATE:
+            self.state = value
+        elif key is Field.SEQ:
+            self.seq = value
+        elif key is Field.DEST:
+            self.dest = value
 
     @staticmethod
     def has_key(key: str, obj: Enum):
@@ -182,25 +721,576 @@ class Protocol:
         except:
             return False
 
+
+class FrameError(ProtocolError):
+    pass
+
+
+class FrameBuffer:
+    """
+    Reassembles length-prefixed frames from a TCP byte stream.
+
+    A single recv may hold several frames, or only part of one, so bytes are
+    received with recv_into a preallocated buffer until a whole frame is
+    available. The buffer only grows while a frame larger than it is pending and
+    shrinks back afterwards. The data of CHUNK frames is received straight into
+    the buffer of its transfer.
+    """
+
+    def __init__(
+        self,
+        max_frame_size: int = MAX_FRAME_SIZE,
+        receive_size: int = RECEIVE_SIZE,
+        transfers=None,
+    ):
+        self.max_frame_size = max_frame_size
+        self.receive_size = receive_size
+        self.transfers = transfers
+        self.buffer = bytearray(receive_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # (transfer, target, filled) of a chunk still being received
+        self.chunk = None
+
+    def receive(self, sock: socket.socket, buff_size: int = 0) -> list:
+        """Reads at most `buff_size` bytes, or as many as fit when it is 0."""
+        if self.chunk is not None:
+            transfer, target, filled = self.chunk
+            size = sock.recv_into(target[filled:], min(buff_size, len(target) - filled))
+            if size == 0:
+                raise ConnectionResetError("Connection closed by peer")
+            filled += size
+            if filled < len(target):
+                self.chunk = (transfer, target, filled)
+                return []
+            self.chunk = None
+            return self.transfers.chunk_received(transfer, len(target))
+
+        self.__reserve()
+        size = sock.recv_into(
+            self.view[self.end :], min(buff_size, len(self.buffer) - self.end)
+        )
+        if size == 0:
+            raise ConnectionResetError("Connection closed by peer")
+        self.end += size
+        messages = []
+        return FrameBuffer.__checked(messages, self.__parse(messages))
+
+    def feed(self, data: bytes) -> list:
+        """Parses bytes that were read elsewhere, such as from an asyncio stream."""
+        messages = []
+        error = None
+        data = memoryview(data)
+        while data:
+            if self.chunk is not None:
+                transfer, target, filled = self.chunk
+                size = min(len(data), len(target) - filled)
+                target[filled : filled + size] = data[:size]
+                data = data[size:]
+                filled += size
+                if filled < len(target):
+                    self.chunk = (transfer, target, filled)
+                    continue
+                self.chunk = None
+                messages.extend(self.transfers.chunk_received(transfer, len(target)))
+                continue
+
+            self.__reserve()
+            size = min(len(data), len(self.buffer) - self.end)
+            self.view[self.end : self.end + size] = data[:size]
+            self.end += size
+            data = data[size:]
+            found = self.__parse(messages)
+            error = error or found
+        return FrameBuffer.__checked(messages, error)
+
+    @staticmethod
+    def __checked(messages: list, error) -> list:
+        if error is not None:
+            error.messages = messages
+            raise error
+        return messages
+
+    def __reserve(self):
+        if self.end < len(self.buffer):
+            return
+        pending = self.end - self.start
+        if self.start > 0:
+            self.buffer[:pending] = self.buffer[self.start : self.end]
+        else:
+            self.__resize(min(len(self.buffer) * 2, self.max_frame_size + FRAME_HEADER.size))
+        self.start, self.end = 0, pending
+
+    def __resize(self, size: int):
+        buffer = bytearray(size)
+        buffer[: self.end - self.start] = self.view[self.start : self.end]
+        self.view.release()
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+    def __parse(self, messages: list) -> ProtocolError:
+        """
+        Appends the messages of every whole frame to `messages`. A frame that
+        does not decode is skipped and the first such error returned, so the
+        frames around it are still handled.
+        """
+        error = None
+        while self.end - self.start >= FRAME_HEADER.size:
+            (header,) = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            flags = FrameFlag(header >> FRAME_FLAG_SHIFT)
+            size = header & FRAME_LENGTH_MASK
+            if size > self.max_frame_size:
+                raise self.__lost(
+                    messages, f"Frame of {size} bytes exceeds {self.max_frame_size} bytes"
+                )
+            payload_start = self.start + FRAME_HEADER.size
+
+            if flags & FrameFlag.CHUNK:
+                if size < CHUNK_HEADER.size:
+                    raise self.__lost(
+                        messages, f"CHUNK frame of {size} bytes is shorter than its header"
+                    )
+                if self.end - payload_start < CHUNK_HEADER.size:
+                    break
+                if self.transfers is None:
+                    raise self.__lost(messages, "Got a CHUNK frame without a transfer table")
+                transfer_id, offset = CHUNK_HEADER.unpack_from(self.buffer, payload_start)
+                data_start = payload_start + CHUNK_HEADER.size
+                try:
+                    transfer, target = self.transfers.target(
+                        transfer_id, offset, size - CHUNK_HEADER.size
+                    )
+                except ProtocolError as err:
+                    raise self.__lost(messages, str(err))
+                copied = min(len(target), self.end - data_start)
+                target[:copied] = self.view[data_start : data_start + copied]
+                self.start = data_start + copied
+                if copied < len(target):
+                    self.chunk = (transfer, target, copied)
+                    break
+                messages.extend(self.transfers.chunk_received(transfer, len(target)))
+                continue
+
+            if self.end - payload_start < size:
+                break
+            frame_start, self.start = self.start, payload_start + size
+            payload = bytes(self.view[payload_start : self.start])
+            try:
+                message = Protocol.from_network(payload, flags)
+            except ProtocolError as err:
+                error = error or err
+                continue
+            message.size = FRAME_HEADER.size + size
+            if message._dest:
+                message.raw = bytes(self.view[frame_start : self.start])
+            messages.append(message)
+
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > self.receive_size:
+                self.__resize(self.receive_size)
+        return error
+
+    def __lost(self, messages: list, reason: str) -> FrameError:
+        # The stream can not be followed past such a frame, so all of it is dropped
+        self.start = self.end = 0
+        error = FrameError(reason)
+        error.messages = messages
+        return error
+
+    def __str__(self):
+        return f"{self.end - self.start} byte(s) buffered"
+
+
+class Transfer:
+    """State of one chunked payload, sent or received over a connection."""
+
+    def __init__(self, transfer_id: int, method: ProtocolMethod, args: str, size: int):
+        self.id = transfer_id
+        self.method = method
+        self.args = args
+        self.size = size
+        self.sender = "..."
+        self.window = STREAM_WINDOW
+        # Bytes received so far, or acknowledged by the receiver when sending
+        self.received = 0
+        self.acknowledged = 0
+        self.buffer = None
+        self.view = None
+        self.failed = False
+        self.started = time.perf_counter()
+        self.done = threading.Event()
+        self.condition = threading.Condition()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.done.wait(timeout) and not self.failed
+
+    def header(self, state: ProtocolState, content: dict) -> Protocol:
+        return Protocol(
+            protocol_type=ProtocolType.STREAM,
+            method=self.method,
+            state=state,
+            content=json.dumps({"TRANSFER": self.id, **content}),
+        )
+
+    def __str__(self):
+        return f"[{self.id}] {self.method.value} {self.received}/{self.size} byte(s)"
+
+
+class Transfers:
+    """
+    Chunked transfers of one connection, built on STREAM messages.
+
+    The sender announces a payload with a STREAM REQ_AWK message. The receiver
+    preallocates the whole payload and answers with a STREAM AWK. The sender
+    then streams CHUNK frames, never more than `window` bytes ahead of the last
+    AWK, and the receiver acknowledges every half window. Once complete the
+    receiver handles the payload as a regular message of the announced method
+    with `payload` set.
+
+    A request for a transfer ID already in progress raises ProtocolError. One
+    past `max_size`, `max_transfers` or `max_bytes` in flight is refused FAIL.
+    """
+
+    def __init__(
+        self,
+        window: int = STREAM_WINDOW,
+        max_size: int = MAX_TRANSFER_SIZE,
+        max_transfers: int = MAX_TRANSFERS,
+        max_bytes: int = MAX_TRANSFER_BYTES,
+    ):
+        self.window = window
+        self.max_size = max_size
+        self.max_transfers = max_transfers
+        self.max_bytes = max_bytes
+        self.incoming = {}
+        self.outgoing = {}
+        self.acks = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def accept(self, message: Protocol) -> Protocol:
+        try:
+            request = json.loads(message.content)
+            transfer = Transfer(
+                int(request["TRANSFER"]),
+                message.method,
+                str(request.get("ARGS", "")),
+                int(request["SIZE"]),
+            )
+        except (ValueError, TypeError, KeyError):
+            raise ProtocolError("Invalid STREAM request")
+
+        try:
+            window = int(request.get("WINDOW", self.window))
+        except (ValueError, TypeError):
+            window = 0
+        if transfer.size > self.max_size or transfer.size < 0 or window <= 0:
+            return transfer.header(ProtocolState.FAIL, {"RECEIVED": 0})
+
+        transfer.sender = message.id
+        transfer.window = min(window, self.window)
+        with self.lock:
+            if transfer.id in self.incoming:
+                raise ProtocolError(f"Transfer {transfer.id} is already in progress")
+            # Nothing is allocated for a transfer past the connection's limits
+            reserved = sum(incoming.size for incoming in self.incoming.values())
+            if (
+                len(self.incoming) >= self.max_transfers
+                or reserved + transfer.size > self.max_bytes
+            ):
+                return transfer.header(ProtocolState.FAIL, {"RECEIVED": 0})
+            transfer.buffer = bytearray(transfer.size)
+            transfer.view = memoryview(transfer.buffer)
+            self.incoming[transfer.id] = transfer
+        if transfer.size == 0:
+            return self.__complete(transfer)
+        return transfer.header(ProtocolState.AWK, {"RECEIVED": 0})
+
+    def target(self, transfer_id: int, offset: int, size: int) -> tuple:
+        transfer = self.incoming.get(transfer_id)
+        if transfer is None:
+            raise ProtocolError(f"CHUNK for unknown transfer {transfer_id}")
+        if offset != transfer.received or offset + size > transfer.size:
+            raise ProtocolError(f"CHUNK out of sequence for transfer {transfer_id}")
+        return transfer, transfer.view[offset : offset + size]
+
+    def chunk_received(self, transfer: Transfer, size: int) -> list:
+        transfer.received += size
+        if transfer.received == transfer.size:
+            return [self.__complete(transfer)]
+        if transfer.received - transfer.acknowledged >= transfer.window // 2:
+            transfer.acknowledged = transfer.received
+            self.acks.append(
+                transfer.header(ProtocolState.AWK, {"RECEIVED": transfer.received})
+            )
+        return []
+
+    def __complete(self, transfer: Transfer) -> Protocol:
+        with self.lock:
+            self.incoming.pop(transfer.id, None)
+        self.acks.append(transfer.header(ProtocolState.AWK, {"RECEIVED": transfer.size}))
+        transfer.done.set()
+        message = Protocol(method=transfer.method, content=transfer.args, id=transfer.sender)
+        message.payload = transfer.buffer
+        return message
+
+    def take_acks(self) -> list:
+        acks, self.acks = self.acks, []
+        return acks
+
+    def acknowledge(self, message: Protocol):
+        try:
+            reply = json.loads(message.content)
+            transfer = self.outgoing.get(int(reply["TRANSFER"]))
+            received = int(reply["RECEIVED"])
+        except (ValueError, TypeError, KeyError):
+            raise ProtocolError("Invalid STREAM reply")
+        if transfer is None:
+            return
+        with transfer.condition:
+            transfer.acknowledged = max(transfer.acknowledged, received)
+            # A FAIL is final, an AWK sent before it may still arrive after
+            transfer.failed = transfer.failed or message.state == ProtocolState.FAIL
+            transfer.condition.notify_all()
+
+    def start(self, method: ProtocolMethod, payload: bytes, args: str = "") -> Transfer:
+        transfer = Transfer(next(self.ids), method, args, len(payload))
+        transfer.acknowledged = -1
+        transfer.window = self.window
+        with self.lock:
+            self.outgoing[transfer.id] = transfer
+        return transfer
+
+    def send(
+        self,
+        transfer: Transfer,
+        payload: bytes,
+        send_message,
+        send_raw,
+        chunk_size: int = CHUNK_SIZE,
+        timeout: float = STREAM_TIMEOUT,
+    ):
+        """Streams `payload` for `transfer`, blocking until it is acknowledged."""
+
+        def wait_for(condition) -> bool:
+            with transfer.condition:
+                return transfer.condition.wait_for(
+                    lambda: transfer.failed or condition(), timeout
+                ) and not transfer.failed
+
+        try:
+            send_message(
+                transfer.header(
+                    ProtocolState.REQ_AWK,
+                    {"SIZE": transfer.size, "ARGS": transfer.args, "WINDOW": transfer.window},
+                )
+            )
+            if not wait_for(lambda: transfer.acknowledged >= 0):
+                transfer.failed = True
+                return transfer
+
+            view = memoryview(payload)
+            while transfer.received < transfer.size:
+                if not wait_for(
+                    lambda: transfer.received - transfer.acknowledged < transfer.window
+                ):
+                    transfer.failed = True
+                    return transfer
+                size = min(chunk_size, transfer.size - transfer.received)
+                send_raw(
+                    Protocol.chunk(
+                        transfer.id,
+                        transfer.received,
+                        view[transfer.received : transfer.received + size],
+                    )
+                )
+                transfer.received += size
+
+            if not wait_for(lambda: transfer.acknowledged >= transfer.size):
+                transfer.failed = True
+        except OSError:
+            transfer.failed = True
+        finally:
+            with self.lock:
+                self.outgoing.pop(transfer.id, None)
+            transfer.done.set()
+        return transfer
+
+    def __str__(self):
+        return f"{len(self.incoming)} in, {len(self.outgoing)} out"
+
+
+class Requests:
+    """
+    Outstanding requests of one connection, keyed by sequence number.
+
+    `request` gives a message a fresh sequence number and returns a Future. A
+    received message carrying that number is its reply and resolves the Future,
+    whose `rtt` attribute then holds the round trip time in seconds.
+    """
+
+    def __init__(self, first: int):
+        self.sequence = itertools.count(first, 2)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def next(self) -> int:
+        return next(self.sequence)
+
+    def request(self, message: Protocol, timeout: float = REQUEST_TIMEOUT) -> Future:
+        future = Future()
+        future.rtt = None
+        message.seq = self.next()
+        with self.lock:
+            timer = WHEEL.schedule(timeout, self.expire, message.seq)
+            self.pending[message.seq] = (future, time.perf_counter(), timer)
+        return future
+
+    def resolve(self, message: Protocol) -> bool:
+        with self.lock:
+            entry = self.pending.pop(message.seq, None)
+        if entry is None:
+            return False
+        future, started, timer = entry
+        timer.cancel()
+        future.rtt = time.perf_counter() - started
+        future.set_result(message)
+        return True
+
+    def expire(self, seq: int):
+        with self.lock:
+            entry = self.pending.pop(seq, None)
+        if entry is not None:
+            entry[0].set_exception(TimeoutError(f"No reply to request {seq}"))
+
+    def cancel(self):
+        with self.lock:
+            entries, self.pending = list(self.pending.values()), {}
+        for future, _, timer in entries:
+            timer.cancel()
+            future.set_exception(ConnectionError("Connection closed"))
+
+    def __contains__(self, seq: int) -> bool:
+        return seq in self.pending
+
+    def __str__(self):
+        return f"{len(self.pending)} pending"
+
+
+class FrozenProtocol(Protocol):
+    """
+    An immutable message for fixed control messages. Its JSON text and its frame
+    for each codec are encoded once, when it is built, so sending it only writes
+    bytes that already exist and any number of threads can share it.
+
+    Assigning a field a new value raises `ProtocolError`, use `thaw` for a
+    mutable copy. Assigning the value a field already has is allowed, so
+    signing a template with its own ID still works.
+    """
+
+    __slots__ = ("_frames",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        frames = {}
+        for features in (
+            (),
+            (ProtocolFeature.BINARY,),
+            (ProtocolFeature.ZLIB,),
+            (ProtocolFeature.BINARY, ProtocolFeature.ZLIB),
+        ):
+            frames[Protocol._frame_key("ascii", features)] = Protocol.to_network(
+                self, features=features
+            )
+        self.msg()
+        self._frames = frames
+
+    def __setattr__(self, name, value):
+        try:
+            self._frames
+        except AttributeError:
+            return super().__setattr__(name, value)
+        if getattr(self, name) != value:
+            raise ProtocolError(f"Can not set '{name}' of a frozen message")
+
+    def get_data(self, node=None) -> dict:
+        # Shared between threads, so the node is not stored on the message
+        return super().get_data()
+
+    def to_network(self, node=None, encoding="ascii", features=()) -> bytes:
+        frame = self._frames.get(Protocol._frame_key(encoding, features))
+        if frame is None:
+            return self.thaw().to_network(node, encoding, features)
+        return frame
+
+    def thaw(self) -> Protocol:
+        protocol = Protocol(
+            protocol_type=self._protocol_type,
+            method=self._method,
+            state=self._state,
+            content=self._content,
+            id=self._id,
+            dest=self._dest,
+        )
+        protocol._seq = self._seq
+        return protocol
+
+
 class Protocols:
-    INITIALIZE = Protocol(
+    INITIALIZE = FrozenProtocol(
         method=ProtocolMethod.INIT,
         state=ProtocolState.DEFAULT,
         content="INIT",
     )
 
-    DISCONNECT = Protocol(
+    DISCONNECT = FrozenProtocol(
         method=ProtocolMethod.EXIT,
         state=ProtocolState.DEFAULT,
         content="Disconnect",
     )
 
-    SHOW = Protocol(
+    SHOW = FrozenProtocol(
         method=ProtocolMethod.SHOW,
         state=ProtocolState.DEFAULT,
         content="Show",
     )
 
+    # Replies the server sends during every handshake and disconnect
+    INIT_SUCCESS = FrozenProtocol(
+        id="Server",
+        method=ProtocolMethod.INIT,
+        state=ProtocolState.SUCCESS,
+        content=ProtocolFeature.encode(SUPPORTED_FEATURES),
+    )
+
+    INIT_FAIL = FrozenProtocol(
+        id="Server", method=ProtocolMethod.INIT, state=ProtocolState.FAIL
+    )
+
+    EXIT_AWK = FrozenProtocol(
+        id="Server", method=ProtocolMethod.EXIT, state=ProtocolState.AWK
+    )
+
+    SHUTDOWN = FrozenProtocol(
+        id="Server",
+        protocol_type=ProtocolType.BROADCAST,
+        method=ProtocolMethod.EXIT,
+        state=ProtocolState.REQ_AWK,
+    )
+
+    # Heartbeats, sent to a peer that has been quiet for a while
+    PING = FrozenProtocol(id="Server", method=ProtocolMethod.PING)
+    PONG = FrozenProtocol(id="Server", method=ProtocolMethod.PONG)
+
+    @staticmethod
+    def init_success(client_id: str) -> Protocol:
+        """INIT SUCCESS, its DEST is the registry ID the client signs messages with."""
+        message = Protocols.INIT_SUCCESS.thaw()
+        message.dest = client_id
+        return message
+
 
 class Validator:
     @staticmethod
@@ -1,5 +1,7 @@
 #!/bin/python3
 
+import asyncio
+import inspect
 import json
 import os
 import threading
@@ -8,6 +10,7 @@ import socket
 import time
 import traceback
 import jsonschema
+from enum import Enum
 from protocol import (
     Protocols,
     Protocol,
@@ -15,11 +18,32 @@ from protocol import (
     ProtocolMethod,
     ProtocolType,
     Field,
+    FrameBuffer,
+    ProtocolFeature,
+    SUPPORTED_FEATURES,
+    ProtocolError,
+    RECEIVE_SIZE,
+    REQUEST_TIMEOUT,
+    Transfer,
+)
+from concurrent.futures import Future
+from timers import WHEEL
+
+from node import (
+    Node,
+    HelpMenu,
+    ClientRegistry,
+    MAX_QUEUE_BYTES,
+    QUEUE_POLICIES,
+    OutboundQueue,
+    QueueFull,
+    Writer,
 )
-
-from node import Node, HelpMenu
 import lib_cli as CLI
+from daemon import CONTROL_PATH, ControlSocket
+from logger import SUMMARY_INTERVAL, ConsoleSink, JsonLinesSink, MessageLog
 import select
+import selectors
 import sys
 import time
 
@@ -30,10 +54,293 @@ LOG = True
 
 DEFAULT_GATEWAY = "10.1.1.1"
 
+# "threads" runs one thread per client, "selector" serves every client from
+# a single thread with selectors.DefaultSelector (epoll on Linux)
+ENGINES = ("threads", "selector")
+
+# Seconds a client has to answer its INIT REQ_AWK, and to reconnect from its
+# new IP once it has acknowledged the config entry
+HANDSHAKE_TIMEOUT = 10.0
+PROVISION_TIMEOUT = 300.0
+
+# A client quiet for HEARTBEAT_INTERVAL seconds is sent a PING, and one that
+# stays quiet for HEARTBEAT_MISSES intervals is disconnected
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_MISSES = 3
+
+# Seconds shutdown waits for clients to acknowledge EXIT before closing them
+SHUTDOWN_DEADLINE = 5.0
+
+# Seconds a leaving client's queue has to drain before its socket is closed
+EXIT_DRAIN_TIMEOUT = 1.0
+
 # TODO: initialize clients based on config
 #       discuss whether the program should block until all clients are initialized?
 
 
+class ConfigStore:
+    """
+    Node entries of the config file, handed to connecting clients in order.
+
+    A client whose IP already matches a free entry is connected right away.
+    Any other client is offered the next free entry in an INIT REQ_AWK. Once
+    it acknowledges, the entry is `pending` on the entry's IP until the client
+    reconnects from there, so any number of clients can be configured at once.
+    """
+
+    FREE = 0
+    TAKEN = 1
+    PENDING = 2
+
+    def __init__(self):
+        self.content = []
+        # State of each entry, and when a PENDING entry is freed again
+        self.states = []
+        self.deadlines = []
+        self.lock = threading.Lock()
+
+    @property
+    def max_clients(self) -> int:
+        return len(self.content)
+
+    @property
+    def queue(self) -> list:
+        """The free entries, in config file order."""
+        return [
+            entry
+            for entry, state in zip(self.content, self.states)
+            if state == ConfigStore.FREE
+        ]
+
+    @property
+    def pending(self) -> dict:
+        """IP -> (entry, deadline) of clients rebooting into their config."""
+        return {
+            str(entry["IP"]): (entry, deadline)
+            for entry, state, deadline in zip(self.content, self.states, self.deadlines)
+            if state == ConfigStore.PENDING
+        }
+
+    def load(self, file_path, schema_path):
+        schema = self.__load_json_file(schema_path)
+        if not schema:
+            CLI.message_error(f"Schema file '{schema_path}' not found.")
+            return
+
+        data = self.__load_json_file(file_path)
+        if not data or not self.__validate_schema(data, schema):
+            CLI.message_error(f"Config file '{file_path}' not found or invalid.")
+            return
+
+        with self.lock:
+            self.content = list(data["Nodes"])
+            self.states = [ConfigStore.FREE] * len(self.content)
+            self.deadlines = [0.0] * len(self.content)
+        return True
+
+    def share(self, states, deadlines, lock):
+        """
+        Keeps the entry states in `states` and `deadlines`, guarded by `lock`,
+        such as multiprocessing arrays, so processes serving the same config
+        hand out each entry once.
+        """
+        self.states, self.deadlines, self.lock = states, deadlines, lock
+
+    def match(self, client_ip: str) -> dict:
+        """Takes the entry of a client that is already configured, or returns None."""
+        with self.lock:
+            self.__expire()
+            # Client is returning from configuration reboot
+            # Or client is already optimally configured
+            for index, entry in enumerate(self.content):
+                if (
+                    str(entry["IP"]) == client_ip
+                    and self.states[index] != ConfigStore.TAKEN
+                ):
+                    self.states[index] = ConfigStore.TAKEN
+                    return entry
+        return None
+
+    def pop(self) -> dict:
+        """Takes the next free entry, to offer to a client that is not configured."""
+        with self.lock:
+            self.__expire()
+            for index, entry in enumerate(self.content):
+                if self.states[index] == ConfigStore.FREE:
+                    self.states[index] = ConfigStore.TAKEN
+                    return entry
+        CLI.message_error("Config is empty")
+        return None
+
+    def provision(self, entry: dict, timeout: float = PROVISION_TIMEOUT):
+        """Holds an acknowledged entry until the client reconnects from its IP."""
+        index = self.content.index(entry)
+        with self.lock:
+            self.states[index] = ConfigStore.PENDING
+            self.deadlines[index] = time.monotonic() + timeout
+
+    def restore(self, entry: dict):
+        """Puts back an entry that was never acknowledged."""
+        index = self.content.index(entry)
+        with self.lock:
+            self.states[index] = ConfigStore.FREE
+
+    def release(self, client_ip: str):
+        """Frees the entry of a client that disconnected, for when it comes back."""
+        with self.lock:
+            for index, entry in enumerate(self.content):
+                if (
+                    str(entry["IP"]) == client_ip
+                    and self.states[index] == ConfigStore.TAKEN
+                ):
+                    self.states[index] = ConfigStore.FREE
+                    return
+
+    def __expire(self):
+        now = time.monotonic()
+        for index, entry in enumerate(self.content):
+            if (
+                self.states[index] == ConfigStore.PENDING
+                and self.deadlines[index] <= now
+            ):
+                self.states[index] = ConfigStore.FREE
+                CLI.message_caution(f"CONFIG EXPIRED: {entry['IP']} never reconnected")
+
+    def __load_json_file(self, file_path):
+        try:
+            with open(file_path, "r") as file:
+                data = json.load(file)
+            return data
+        except FileNotFoundError:
+            CLI.message_error(f"File '{file_path}' not found.")
+            return {}
+        except json.JSONDecodeError:
+            CLI.message_error(f"File '{file_path}' could not be parsed as JSON.")
+            return {}
+
+    def __validate_schema(self, data, schema):
+        try:
+            jsonschema.validate(instance=data, schema=schema)
+        except jsonschema.exceptions.ValidationError:
+            CLI.message_error(f"Data does not adhere to the configuration schema.")
+            return False
+        return True
+
+
+
+class HandshakeState(Enum):
+    OFFERED = "OFFERED"
+    CONFIGURING = "CONFIGURING"
+    CONFIGURED = "CONFIGURED"
+    REJECTED = "REJECTED"
+
+
+class Handshake:
+    """
+    A connection being offered a config entry. `feed` moves the handshake on
+    with the client's messages and never waits on the socket, so an engine can
+    run any number of handshakes next to its connected clients.
+
+    OFFERED: The entry was sent in an INIT REQ_AWK.
+    CONFIGURING: The client acknowledged, it was sent INIT FAIL and the entry
+    is pending on its new IP. CONFIGURED once the client hangs up.
+    REJECTED: The client declined, left or timed out while OFFERED, the entry
+    goes back in the queue.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        config: ConfigStore,
+        entry: dict,
+        timeout: float = HANDSHAKE_TIMEOUT,
+    ):
+        self.sock = sock
+        self.config = config
+        self.entry = entry
+        self.timeout = timeout
+        self.state = HandshakeState.OFFERED
+        self.frames = FrameBuffer()
+        self.deadline = time.monotonic() + timeout
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (HandshakeState.CONFIGURED, HandshakeState.REJECTED)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def offer(self) -> Protocol:
+        return Protocol(
+            id="Server",
+            method=ProtocolMethod.INIT,
+            state=ProtocolState.REQ_AWK,
+            content=json.dumps(self.entry),
+        )
+
+    def feed(self, messages: list) -> list:
+        """Returns the messages to send the client in reply."""
+        for message in messages:
+            if self.state is not HandshakeState.OFFERED:
+                break
+            if message == ProtocolMethod.EXIT or (
+                message == ProtocolMethod.INIT and message.state != ProtocolState.AWK
+            ):
+                self.close()
+            else:
+                self.state = HandshakeState.CONFIGURING
+                self.deadline = time.monotonic() + self.timeout
+                self.config.provision(self.entry)
+                return [Protocols.INIT_FAIL]
+        return []
+
+    def close(self):
+        """The connection closed or the handshake timed out."""
+        if self.state is HandshakeState.OFFERED:
+            self.state = HandshakeState.REJECTED
+            self.config.restore(self.entry)
+        elif self.state is HandshakeState.CONFIGURING:
+            self.state = HandshakeState.CONFIGURED
+
+
+class RouteCounters:
+    """
+    Messages and bytes routed between clients, per (source ID, DEST) route.
+    A route is counted by the server that writes to the target, and as
+    dropped by the server that found no client for it.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def count(self, source: str, dest: str, size: int):
+        with self.lock:
+            counter = self.counters.setdefault((source, dest), [0, 0, 0])
+            counter[0] += 1
+            counter[1] += size
+
+    def drop(self, source: str, dest: str):
+        with self.lock:
+            self.counters.setdefault((source, dest), [0, 0, 0])[2] += 1
+
+    def snapshot(self) -> list:
+        """[source, dest, messages, bytes, dropped] of every route."""
+        with self.lock:
+            return [
+                [source, dest] + counter
+                for (source, dest), counter in sorted(self.counters.items())
+            ]
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+
+    def __len__(self) -> int:
+        return len(self.counters)
+
+
 class Server:
     def __init__(
         self,
@@ -42,13 +349,50 @@ class Server:
         send_hook=None,
         receive_hook=None,
         custom_commands=None,
+        batch_hook=None,
+        engine="threads",
+        queue_policy="drop_oldest",
+        queue_size=MAX_QUEUE_BYTES,
+        reuse_port=False,
+        heartbeat=HEARTBEAT_INTERVAL,
+        log_file=None,
+        headless=False,
+        control=None,
     ):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        if queue_policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f"Unknown queue policy '{queue_policy}', expected one of {QUEUE_POLICIES}"
+            )
         self.host = host
         self.port = port
-        self.__config_content = []
-        self.__config_content_queue = []
-        self.__config_last_entry = None
-        self.__clients = []
+        self.engine = engine
+        self.queue_policy = queue_policy
+        self.queue_size = queue_size
+        self.reuse_port = reuse_port
+        # Seconds between heartbeat checks of each client, None to turn them off
+        self.heartbeat = heartbeat
+        # The Shard of this server when it runs under a ShardedServer
+        self.shard = None
+        # Headless servers print plain output and take commands on a control
+        # socket instead of the terminal
+        self.headless = headless
+        if headless:
+            CLI.set_plain()
+        self.control = (
+            ControlSocket(control or CONTROL_PATH.format(name="server"), self.execute)
+            if headless or control
+            else None
+        )
+        self.__selector = None
+        self.__writer = Writer()
+        self.config = ConfigStore()
+        self.__clients = ClientRegistry()
+        self.__clients.listeners.append(self.__on_registry)
+        # socket -> Handshake of connections that are being configured
+        self.__handshakes = {}
+        self.routes = RouteCounters()
         self.__threads = []
         # self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # self.sock.bind((self.host, self.port))
@@ -59,28 +403,55 @@ class Server:
         self.custom_commands = [] if custom_commands is None else custom_commands
         self.send_hook = send_hook
         self.receive_hook = receive_hook
+        self.batch_hook = batch_hook
+        self.__initialize_handlers()
 
         self.__exit_event = threading.Event()
+        # Set once shutdown starts, and once the last client has left
+        self.__draining = threading.Event()
+        self.__drained = threading.Event()
+        # A byte written on shutdown makes every waiting select return at once
+        self.__wake_receive, self.__wake_send = socket.socketpair()
         self.__locks = {
             "clients": threading.Lock(),
             "print": threading.Lock(),
             "thread": threading.Lock(),
         }
+        # Messages are logged by a writer thread, see logger.MessageLog
+        sinks = [ConsoleSink(self.__print_thread)]
+        if log_file is not None:
+            sinks.append(JsonLinesSink(log_file))
+        self.log = MessageLog(sinks)
 
         # self.dir_path = os.path.dirname(os.path.realpath(__file__))
         # self.config_path = os.path.join(self.dir_path, "config.json")
         # self.config_schema_path = os.path.join(self.dir_path, "config_schema.json")
 
         self.__initialize_config_paths()
-        self.max_clients = 0
-        self.awaiting_connection = None
 
     def __initialize_socket(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.reuse_port:
+            # Several processes accept on the same port, the kernel spreads
+            # the connections between them
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind((self.host, self.port))
         self.sock.settimeout(1)
         self.sock.listen()
 
+    @property
+    def max_clients(self) -> int:
+        return self.config.max_clients
+
+    @property
+    def registry(self) -> ClientRegistry:
+        return self.__clients
+
+    @property
+    def awaiting_connections(self) -> list:
+        """IPs that acknowledged a config entry and have yet to reconnect."""
+        return list(self.config.pending)
+
     def __initialize_config_paths(self):
         self.dir_path = os.path.dirname(os.path.realpath(__file__))
         self.config_path = os.path.join(self.dir_path, "config.json")
@@ -91,17 +462,39 @@ class Server:
             CLI.message_caution("GOT EMPTY MESSAGE", print_func=self.__print_thread)
             return False
 
-        if message == ProtocolMethod.EXIT:
-            return self.disconnect_client(client, state=message.state)
+        if is_receiving and message.seq and client.requests.resolve(message):
+            return False
 
-        if message == Protocols.SHOW:
-            self.show_clients()
+        # Routed before the handlers and hooks, without decoding the body
+        if (
+            is_receiving
+            and message.dest
+            and message.protocol_type is ProtocolType.DIRECT
+        ):
+            self.route(message, client)
             return False
 
-        if message == ProtocolMethod.COMMAND:
-            self.__send_data(client, message)
+        if message.protocol_type is ProtocolType.BATCH:
+            messages = message.unbatch()
+            if self.batch_hook is not None:
+                if self.batch_hook(self, client, message, messages):
+                    return True
+            for sub_message in messages:
+                if self.__process_message(client, sub_message, is_receiving):
+                    return True
             return False
 
+        if message.protocol_type is ProtocolType.STREAM and is_receiving:
+            if message.state == ProtocolState.REQ_AWK:
+                self.__send_data(client, client.transfers.accept(message))
+            else:
+                client.transfers.acknowledge(message)
+            return False
+
+        handler = self.__handlers[is_receiving].get(message.method)
+        if handler is not None:
+            return handler(client, message)
+
         if self.receive_hook is not None and is_receiving:
             return self.receive_hook(self, client, message)
 
@@ -110,35 +503,111 @@ class Server:
 
         # If no other cases have been hit, send the message to the client
         if not is_receiving:
-            if message[ProtocolType] == ProtocolType.BROADCAST:
-                self.broadcast(f"{message}", exclude=client)
+            if message.protocol_type is ProtocolType.BROADCAST:
+                self.broadcast(message, exclude=client)
             else:
                 self.__send_data(client, message)
 
         return False
 
-    def __command_line(self):
-        from cli_commands import CLI_SERVER_COMMANDS
+    def __initialize_handlers(self):
+        # Built-in handlers, keyed by whether the message is being received
+        self.__handlers = {
+            True: {
+                ProtocolMethod.EXIT: self.__handle_exit,
+                ProtocolMethod.INIT: self.__handle_init,
+                ProtocolMethod.SHOW: self.__handle_show,
+                ProtocolMethod.COMMAND: self.__handle_command,
+                ProtocolMethod.PING: self.__handle_ping,
+                ProtocolMethod.PONG: self.__handle_pong,
+            },
+            False: {
+                ProtocolMethod.EXIT: self.__handle_exit,
+                ProtocolMethod.SHOW: self.__handle_show,
+                ProtocolMethod.COMMAND: self.__handle_command,
+            },
+        }
 
-        self.custom_commands = self.custom_commands + CLI_SERVER_COMMANDS
+    def register_handler(
+        self, method: ProtocolMethod or str, function, is_receiving: bool = True
+    ):
+        """
+        Routes every message of `method` to `function(server, client, message)`
+        instead of the send or receive hook. Returning True stops handling the
+        client, like a hook. Registering a built-in method replaces its handler.
+        """
+        if type(method) is not ProtocolMethod:
+            if str(method).upper() not in ProtocolMethod.__members__:
+                raise ValueError(f"Unknown METHOD '{method}'")
+            method = ProtocolMethod[str(method).upper()]
+        self.__handlers[is_receiving][method] = lambda client, message: function(
+            self, client, message
+        )
+
+    def __handle_exit(self, client, message: Protocol):
+        return self.disconnect_client(client, state=message.state)
+
+    def __handle_init(self, client, message: Protocol):
+        # Client accepted some of the features offered in INIT SUCCESS
+        if message.state == ProtocolState.AWK:
+            client.features = (
+                ProtocolFeature.decode(message.content) & SUPPORTED_FEATURES
+            )
+        return False
 
+    def __handle_show(self, client, message: Protocol):
+        self.show_clients()
+        return False
+
+    def __handle_command(self, client, message: Protocol):
+        self.__send_data(client, message)
+        return False
+
+    def __handle_ping(self, client, message: Protocol):
+        self.__send_frame(client, Protocols.PONG.to_network(features=client.features))
+        return False
+
+    def __handle_pong(self, client, message: Protocol):
+        # Receiving it already updated client.last_seen
+        return False
+
+    def __on_registry(self, event: str, client: Node):
+        if event == "add":
+            if self.heartbeat:
+                client.heartbeat = WHEEL.schedule(
+                    self.heartbeat, self.__check_heartbeat, client
+                )
+            return
+        if client.heartbeat is not None:
+            client.heartbeat.cancel()
+        self.config.release(str(client.IP))
+        if self.__draining.is_set() and len(self.__clients) == 0:
+            self.__drained.set()
+
+    def __check_heartbeat(self, client: Node):
+        # Runs on the timer wheel's thread, so it never waits on a socket
+        if client not in self.__clients:
+            return
+        quiet = time.monotonic() - client.last_seen
+        if quiet >= self.heartbeat * HEARTBEAT_MISSES:
+            CLI.message_error(
+                f"CLIENT TIMED OUT: {client.network_string} ({quiet:.0f}s)",
+                print_func=self.__print_thread,
+            )
+            client.requests.cancel()
+            self.__clients.remove(client)
+            self.close_connection(client)
+            return
+        # A client with frames still queued is not reading, a PING would only wait
+        if quiet >= self.heartbeat and not client.outbound.frames:
+            self.__send_frame(client, Protocols.PING.to_network(features=client.features))
+        client.heartbeat = WHEEL.schedule(self.heartbeat, self.__check_heartbeat, client)
+
+    def __command_line(self):
         while not self.__exit_event.is_set():
             try:
                 if self.__is_active(sys.stdin):
-                    message = input()
-                    result = self.__commands(message)
-                    message_parts = message.split(" ")
-                    # if result is False:
-                    #     continue
-                    if result == "VOID":
-                        print("Invalid METHOD:\t", f'"{message}"\n')
-                        continue
-                    if Protocol.has_key(message_parts[0], ProtocolMethod):
-                        message = Protocol(
-                            method=message_parts[0], content=" ".join(message_parts[1:])
-                        )
-                        for client in self.__clients:
-                            self.__process_message(client, message, is_receiving=False)
+                    self.execute(input())
 
             except KeyboardInterrupt:
                 break
@@ -153,6 +622,27 @@ class Server:
                 self.__exit_event.set()
                 break
 
+    def execute(self, command: str):
+        """Runs one line as if it were typed at the console."""
+        result = self.__commands(command)
+        message_parts = command.split(" ")
+        # if result is False:
+        #     return
+        if result == "VOID":
+            print("Invalid METHOD:\t", f'"{command}"\n')
+            return
+        if Protocol.has_key(message_parts[0], ProtocolMethod):
+            message = Protocol(
+                method=message_parts[0], content=" ".join(message_parts[1:])
+            )
+            for client in self.__clients.snapshot():
+                self.__process_message(client, message, is_receiving=False)
+
+    def __load_commands(self):
+        from cli_commands import CLI_SERVER_COMMANDS
+
+        self.custom_commands = self.custom_commands + CLI_SERVER_COMMANDS
+
     def __parse_command(self, user_input: str):
         input_segments = user_input.split(" ")
         command_name = input_segments[0]
@@ -193,9 +683,9 @@ class Server:
         while not self.__exit_event.is_set():
             try:
                 if self.__is_active(client.socket):
-                    message = self.__receive_data(client.socket)
-                    if self.__process_message(client, message, is_receiving=True):
-                        break
+                    for message in self.__receive_data(client):
+                        if self.__process_message(client, message, is_receiving=True):
+                            return
             except Exception as e:
                 # TODO: Exception thrown on DC
                 # Perhaps handle it more gracefully
@@ -207,53 +697,104 @@ class Server:
         while not self.__exit_event.is_set():
             if self.__is_active(self.sock):
                 client, address = self.sock.accept()
+                client_node = None
                 with self.__locks["clients"]:
-                    if address not in self.__clients:
+                    if self.__draining.is_set():
+                        client.close()
+                    elif address not in self.__clients:
                         client_node = self.__initialize_client(client)
+                    else:
+                        client.close()
 
-                # Handle client thread
+                # Handle client thread, a handshake waits on its own thread
                 if client_node is not None:
+                    target = (
+                        self.__handle_client
+                        if type(client_node) is Node
+                        else self.__run_handshake
+                    )
                     with self.__locks["thread"]:
                         self.__threads.append(
-                            threading.Thread(
-                                target=self.__handle_client, args=(client_node,)
-                            )
+                            threading.Thread(target=target, args=(client_node,))
                         )
                         self.__threads[-1].start()
 
-    def __initialize_client(self, client: socket.socket):
-        init = Protocol(
-            id="Server", method=ProtocolMethod.INIT, state=ProtocolState.REQ_AWK
-        )
+    def __run_handshake(self, handshake: Handshake):
+        while not handshake.finished and not self.__exit_event.is_set():
+            if handshake.expired:
+                self.__step_handshake(handshake, expired=True)
+            elif self.__is_active(handshake.sock, timeout=0.1):
+                self.__step_handshake(handshake)
+
+    def __receive_selector(self):
+        self.sock.setblocking(False)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.sock, selectors.EVENT_READ)
+        self.__selector.register(self.__wake_receive, selectors.EVENT_READ, self)
+        while not self.__exit_event.is_set():
+            for key, _ in self.__selector.select(timeout=1):
+                if key.data is self:
+                    continue
+                if key.data is None:
+                    self.__accept_selector()
+                elif type(key.data) is Handshake:
+                    self.__step_handshake(key.data)
+                else:
+                    self.__read_selector(key.data)
+            for handshake in list(self.__handshakes.values()):
+                if handshake.expired:
+                    self.__step_handshake(handshake, expired=True)
+        self.__selector.close()
 
+    def __accept_selector(self):
+        try:
+            client, address = self.sock.accept()
+        except BlockingIOError:
+            return
+        if self.__draining.is_set():
+            client.close()
+            return
+        with self.__locks["clients"]:
+            client_node = self.__initialize_client(client)
+        if client_node is not None:
+            self.__selector.register(client, selectors.EVENT_READ, client_node)
+
+    def __read_selector(self, client: Node):
+        try:
+            for message in self.__receive_data(client):
+                if self.__process_message(client, message, is_receiving=True):
+                    self.__unwatch(client.socket)
+                    return
+        except Exception:
+            self.__unwatch(client.socket)
+            self.disconnect_client(client)
+
+    def __unwatch(self, sock: socket.socket):
+        if self.__selector is None:
+            return
+        try:
+            self.__selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def __initialize_client(self, client: socket.socket):
+        """
+        Connects a configured client and returns its Node. Any other client is
+        offered a config entry and its Handshake is returned, the engine feeds
+        it the client's replies.
+        """
         # get ip address from socket named client
         client_ip = str(client.getpeername()[0])
-        # Check if client is returning from configuration reboot
-        # Or client is already optimally configured
-        already_configured = (
-            client_ip == self.__config_content[len(self.__clients)]["IP"]
-        )
-        being_configured = self.awaiting_connection is not None and client_ip == str(
-            self.awaiting_connection.IP
-        )
-
-        if already_configured or being_configured:
-            if being_configured:
-                self.awaiting_connection = None
-            else:
-                self.__config_last_entry = self.__config_content_queue.pop(0)
+        config_data = self.config.match(client_ip)
 
-            client_node = Node(
-                client,
-                config_data=self.__config_content[len(self.__clients)]
-                if already_configured
-                else self.__config_last_entry,
+        if config_data is not None:
+            client_node = Node(client, config_data=config_data, outbound=False)
+            client_node.outbound = OutboundQueue(
+                client, self.queue_size, self.queue_policy, self.__writer
             )
-            self.__clients.append(client_node)
+            self.__clients.add(client_node)
 
-            init.state = ProtocolState.SUCCESS
-            init.content = ""
-            self.__send_data(client, init)
+            self.__send_data(client, Protocols.init_success(client_node.ID))
 
             CLI.message_ok(
                 f"CLIENT CONNECTED: {str(client_node.network_string)}",
@@ -262,7 +803,6 @@ class Server:
             self.show_clients()
             return client_node
 
-
         if len(self.__clients) == self.max_clients:
             CLI.message_error("MAX CLIENTS CONNECTED", print_func=self.__print_thread)
             # client.close()
@@ -270,133 +810,195 @@ class Server:
 
             return None
 
-        client_node = self.pop_config(client)
-        init.content = json.dumps(self.__config_last_entry)
-        self.__send_data(client, init)
-        self.awaiting_connection = client_node
-
-        while not self.__is_active(client):
-            pass
-
-        response = self.__receive_data(client)
-
-        if response == ProtocolMethod.EXIT:
-            # client.shutdown(0)
-            # client.close()
+        config_data = self.config.pop()
+        if config_data is None:
             self.close_connection(client)
-
-            CLI.message_error("CLIENT DISCONNECTED", print_func=self.__print_thread)
             return None
-        elif response == ProtocolMethod.INIT:
-            if response.state != ProtocolState.AWK:
-                CLI.message_error("NEVER GOT AWK", print_func=self.__print_thread)
-                self.__config_content_queue.insert(0, self.__config_last_entry)
-                return None
+        handshake = Handshake(client, self.config, config_data)
+        self.__handshakes[client] = handshake
+        self.__send_data(client, handshake.offer())
+        return handshake
+
+    def __step_handshake(self, handshake: Handshake, expired: bool = False):
+        if expired:
+            handshake.close()
+        else:
+            try:
+                messages = self.__receive_data(handshake.sock, frames=handshake.frames)
+                replies = handshake.feed(messages)
+                if replies:
+                    self.__send_data(handshake.sock, replies)
+                    CLI.line()
+                    CLI.message_caution(
+                        f"CLIENT CONFIGURING: {handshake.entry['IP']}",
+                        print_func=self.__print_thread,
+                    )
+            except Exception:
+                # Whatever the peer sent, its entry is released and the
+                # engine's thread keeps running
+                handshake.close()
+
+        if handshake.finished:
+            self.__handshakes.pop(handshake.sock, None)
+            # Closed whatever state the peer left it in
+            self.__unwatch(handshake.sock)
+            handshake.sock.close()
+            if handshake.state is HandshakeState.REJECTED:
+                CLI.message_error(
+                    "CLIENT NOT CONFIGURED", print_func=self.__print_thread
+                )
 
-        init.state = ProtocolState.FAIL
-        init.content = ""
-        self.__send_data(client, init)
+    def send(self, client, message: Protocol):
+        self.__send_data(client, message)
 
-        CLI.line()
+    def send_many(self, client, messages: list):
+        """Pipelines several messages to one client in a single write."""
+        self.__send_data(client, messages)
+
+    def stream(
+        self, client: Node, method: ProtocolMethod, payload: bytes, args: str = ""
+    ) -> Transfer:
+        """
+        Streams a payload of any size to a client as a chunked transfer.
+
+        The transfer runs on its own thread, call `wait()` on the returned
+        Transfer to block until the client has received all of it.
+        """
+        transfer = client.transfers.start(method, payload, args)
+        threading.Thread(
+            target=client.transfers.send,
+            args=(
+                transfer,
+                payload,
+                lambda message: self.__send_data(client, message),
+                client.send,
+            ),
+            daemon=True,
+        ).start()
+        return transfer
+
+    def request(
+        self, client: Node, message: Protocol, timeout: float = REQUEST_TIMEOUT
+    ) -> Future:
+        """
+        Sends a message and returns a Future for the client's reply.
+
+        The reply is the first message from the client carrying the same `seq`,
+        it resolves the Future instead of reaching the handlers or hooks.
+        """
+        future = client.requests.request(message, timeout)
+        self.__send_data(client, message)
+        return future
+
+    def send_batch(self, client, messages: list):
+        """Packs several messages into one BATCH message for one client."""
+        for message in messages:
+            message.id = "Server"
+        self.__send_data(client, Protocol.batch(messages))
+
+    def route(self, message: Protocol, source: Node = None, relay: bool = True) -> bool:
+        """
+        Forwards a message to the client its DEST names, by ID or else by tag.
+        It is sent, and counted, with the registry ID of `source`, the client
+        it came from. Under a ShardedServer, a DEST on another worker is
+        relayed there unless `relay` is False.
+        """
+        Server.stamp(message, source)
+        target = self.__clients.get_by_id(message.dest) or self.__clients.get_by_tag(
+            message.dest
+        )
+        if target is not None:
+            frame = message.forward(target.features)
+            self.__log_send(message, target.network_string, target)
+            self.__send_frame(target, frame)
+            self.routes.count(message.id, message.dest, len(frame))
+            return True
+        if relay and self.shard is not None and self.shard.route(message):
+            return True
+        self.routes.drop(message.id, message.dest)
         CLI.message_caution(
-            f"CLIENT CONFIGURING",
-            print_func=self.__print_thread,
+            f"NO CLIENT FOR DEST '{message.dest}'", print_func=self.__print_thread
         )
-        return None
+        return False
 
-    def send(self, client, message: Protocol):
-        self.__send_data(client, message)
+    @staticmethod
+    def stamp(message: Protocol, source: Node):
+        # Clients adopt their registry ID on INIT SUCCESS, any other ID is
+        # replaced without decoding the body
+        if source is not None and message.id != source.ID:
+            message.sign(source.ID)
 
     def __send_data(
-        self, client, message: Protocol, sign: bool = True, encoding="ascii"
+        self, client, message: Protocol or list, sign: bool = True, encoding="ascii"
     ):
+        messages = message if type(message) is list else [message]
         if sign and type(client) is Node:
-            message["ID"] = "Server"
+            for message in messages:
+                message["ID"] = "Server"
         addr = (
-            CLI.color("aquamarine", client.network_string)
+            client.network_string
             if type(client) is Node
             else self.__get_socket_address(client)
         )
-        self.__log_send(message, addr)
-        message = message.to_network(
-            encoding=encoding, node=client if type(client) is Node else None
+        node = client if type(client) is Node else None
+        data = Protocol.pipeline(
+            messages,
+            encoding=encoding,
+            node=node,
+            features=client.features if node is not None else (),
         )
+        for message in messages:
+            self.__log_send(message, addr, node)
 
         if type(client) is Node:
-            client.socket.sendall(message)
+            self.__send_frame(client, data)
         else:
-            client.sendall(message)
+            client.sendall(data)
+
+    def __send_frame(self, client: Node, data: bytes):
+        try:
+            client.send(data)
+        except QueueFull as err:
+            CLI.message_error(
+                f"OUTBOUND QUEUE FULL: {client.network_string} ({err})",
+                print_func=self.__print_thread,
+            )
+            self.disconnect_client(client)
 
-    def __receive_data(self, client, buff_size=1024, decoding="ascii") -> Protocol:
-        message = client.recv(buff_size).decode(decoding)
-        message: Protocol = Protocol.from_network(message)
+    def __receive_data(self, client, frames: FrameBuffer = None) -> list:
+        if type(client) is Node:
+            messages = client.read()
+            acks = client.transfers.take_acks()
+            if acks:
+                self.__send_data(client, acks)
+        else:
+            messages = frames.receive(client)
         addr = (
             client.network_string
             if type(client) is Node
             else self.__get_socket_address(client)
         )
-        self.__log_receive(message, addr)
-        return message
+        node = client if type(client) is Node else None
+        for message in messages:
+            self.__log_receive(message, addr, node)
+        return messages
 
     def __init_config(self, file_path=None, schema_path=None):
-        schema_path = schema_path or self.config_schema_path
-        file_path = file_path or self.config_path
-
-        schema = self.__load_json_file(schema_path)
-        if not schema:
-            CLI.message_error(f"Schema file '{schema_path}' not found.")
-            return
-
-        data = self.__load_json_file(file_path)
-        if not data or not self.__validate_schema(data, schema):
-            CLI.message_error(f"Config file '{file_path}' not found or invalid.")
-            return
-
-        self.__config_content = list(data["Nodes"])
-        self.__config_content_queue = list(data["Nodes"])
-        self.max_clients = len(self.__config_content)
-        return True
-
-    def __load_json_file(self, file_path):
-        try:
-            with open(file_path, "r") as file:
-                data = json.load(file)
-            return data
-        except FileNotFoundError:
-            CLI.message_error(f"File '{file_path}' not found.")
-            return {}
-        except json.JSONDecodeError:
-            CLI.message_error(f"File '{file_path}' could not be parsed as JSON.")
-            return {}
-
-    def __validate_schema(self, data, schema):
-        try:
-            jsonschema.validate(instance=data, schema=schema)
-        except jsonschema.exceptions.ValidationError:
-            CLI.message_error(f"Data does not adhere to the configuration schema.")
-            return False
-        return True
-
-    def pop_config(self, socket: socket) -> Node:
-        if len(self.__config_content_queue) > 0:
-            data = self.__config_content_queue.pop(0)
-            self.__config_last_entry = data
-            return Node(socket, config_data=data)
-        else:
-            CLI.message_error("Config is empty")
-            return None
+        return self.config.load(
+            file_path or self.config_path, schema_path or self.config_schema_path
+        )
 
     def get_client_by_tag(self, tag: str) -> Node:
-        for client in self.__clients:
-            if tag in client.tags:
-                return client
-        return None
+        return self.__clients.get_by_tag(tag)
+
+    def get_clients_by_tag(self, tag: str) -> tuple:
+        return self.__clients.find("tag", tag)
 
     def get_client_by_id(self, client_id: str) -> Node:
-        for client in self.__clients:
-            if client.ID == client_id:
-                return client
-        return None
+        return self.__clients.get_by_id(client_id)
+
+    def get_client_by_ip(self, client_ip: str) -> Node:
+        return self.__clients.get_by_ip(client_ip)
 
     @staticmethod
     def is_socket_connected(sock: socket.socket) -> bool:
@@ -415,18 +1017,21 @@ class Server:
             return False
         except OSError:
             return False
-        return False
+        return True
 
     def close_connection(self, connection: socket.socket or Node):
         sock: socket.socket = (
             connection.socket if type(connection) is Node else connection
         )
+        self.__unwatch(sock)
+        if type(connection) is Node:
+            connection.outbound.close()
         if Server.is_socket_connected(sock):
             try:
                 # sock.shutdown(socket.SHUT_RDWR)
                 sock.close()
 
-                if type(connection) is Node and connection in self.__clients:
+                if type(connection) is Node:
                     self.__clients.remove(connection)
             except:
                 pass
@@ -445,15 +1050,16 @@ class Server:
             if state == ProtocolState.REQ_AWK:
                 # Logic before disconnecting the client goes here!
                 # Based on a CLIENT'S REQUEST to disconnect
+                client.requests.cancel()
                 with self.__locks["clients"]:
                     self.__clients.remove(client)
-                    self.__send_data(
-                        client.socket,
-                        Protocol(method=ProtocolMethod.EXIT, state=ProtocolState.AWK),
-                    )
-                    show_message()
-                    # client.close()
-                    self.close_connection(client)
+                # Queued behind any half-written frame, and written out
+                # before the socket is closed
+                self.__send_data(client, Protocols.EXIT_AWK)
+                client.outbound.drain(EXIT_DRAIN_TIMEOUT)
+                show_message()
+                # client.close()
+                self.close_connection(client)
 
             elif state == ProtocolState.DEFAULT:
                 # Logic before disconnecting the client goes here!
@@ -464,6 +1070,7 @@ class Server:
             elif state == ProtocolState.AWK:
                 # Logic for when a client confirms it will disconnect
                 # due to the SERVER'S REQUEST
+                client.requests.cancel()
                 with self.__locks["clients"]:
                     self.__clients.remove(client)
                     show_message()
@@ -473,79 +1080,144 @@ class Server:
         except:
             pass
 
-    def broadcast(self, message, exclude=None):
+    def broadcast(self, message: Protocol, exclude=None):
+        """
+        Sends one message to every client but `exclude`. The message is signed,
+        encoded and logged once, and every client with the same codec is sent the
+        same frame.
+        """
         if message == ProtocolMethod.INIT:
             return
 
-        with self.__locks["clients"]:
-            for client in self.__clients:
-                if exclude != client:
-                    self.__send_data(client, message)
-
-    def shutdown(self):
-        message = Protocol(
-            protocol_type=ProtocolType.BROADCAST,
-            method=ProtocolMethod.EXIT,
-            state=ProtocolState.REQ_AWK,
-        )
-
+        message.id = "Server"
+        # Sends are queued, so a slow client does not hold up the others
+        clients = [client for client in self.__clients.snapshot() if client != exclude]
+        frames = {}
+        for client in clients:
+            key = Protocol._frame_key("ascii", client.features)
+            if key not in frames:
+                frames[key] = message.to_network(features=client.features)
+            self.__send_frame(client, frames[key])
+        self.__log_send(message, f"{len(clients)} client(s)")
+
+    def shutdown(self, deadline: float = SHUTDOWN_DEADLINE):
+        """
+        Stops accepting clients and asks every client to disconnect. Clients
+        that acknowledge within `deadline` seconds leave on their own, the rest
+        are closed once it passes.
+        """
+        began = time.perf_counter()
         CLI.message_caution("STOPPING SERVER...", print_func=self.__print_thread)
-        self.broadcast(message)
-        time.sleep(1)
+        self.__draining.set()
+        connected = len(self.__clients)
+        if connected == 0:
+            self.__drained.set()
+        self.broadcast(Protocols.SHUTDOWN)
+        self.__drained.wait(float(deadline))
 
         with self.__locks["clients"]:
-            for client in self.__clients:
+            remaining = self.__clients.snapshot()
+            for client in remaining:
                 # client.close()
                 self.close_connection(client)
+                self.__clients.remove(client)
 
         self.__exit_event.set()
+        self.__wake_send.send(b"\0")
+        self.__writer.close()
 
         with self.__locks["thread"]:
             for thread in self.__threads:
                 if thread.is_alive() and thread != threading.current_thread():
                     thread.join()
+        for handshake in list(self.__handshakes.values()):
+            self.__step_handshake(handshake, expired=True)
 
         # self.sock.shutdown(socket.SHUT_RDWR)
         # self.sock.close()
         self.close_connection(self.sock)
-        CLI.message_error("SERVER SHUTDOWN", print_func=self.__print_thread)
+        self.log.close()
+        CLI.message_error(
+            f"SERVER SHUTDOWN in {time.perf_counter() - began:.2f}s, "
+            f"{connected - len(remaining)}/{connected} clients acknowledged",
+            print_func=self.__print_thread,
+        )
 
     def show_clients(self):
         if len(self.__clients) == 0:
             CLI.message_error("NO CLIENTS CONNECTED", print_func=self.__print_thread)
             return
 
+        clients = self.__clients.snapshot()
         client_info = []
-        for node in self.__clients:
+        for node in clients:
             client_info.append(node.get_data())
-        data = [list(entry.values()) for entry in client_info]
-        headers = ["Index"] + list(client_info[0].keys())
+        data = [
+            list(entry.values()) + [str(node.outbound), f"{node.idle:.1f}s ago"]
+            for entry, node in zip(client_info, clients)
+        ]
+        headers = ["Index"] + list(client_info[0].keys()) + ["Outbound", "Last seen"]
         self.__print_("Connected Clients")
         CLI.table(data, headers=headers, showindex=True)
 
     def show_client(self, client: int or str):
         if type(client) is str:
-            for node in self.__clients:
-                if node.ID == client:
-                    node.show()
+            for node in self.__clients.find("ID", client):
+                node.show()
 
         if str(client).isdigit():
             client = int(client)
-            if client >= 0 and client < len(self.__clients):
-                self.__clients[client].show()
+            clients = self.__clients.snapshot()
+            if client >= 0 and client < len(clients):
+                clients[client].show()
             else:
                 CLI.message_error(
                     "INVALID CLIENT INDEX", print_func=self.__print_thread
                 )
 
+    def summarize(self, interval: str = SUMMARY_INTERVAL):
+        """
+        Logs one line of traffic totals every `interval` seconds instead of
+        every message, `off` logs every message again.
+        """
+        if str(interval).lower() == "off":
+            self.log.summary = None
+            CLI.message_ok("LOGGING EVERY MESSAGE", print_func=self.__print_thread)
+            return
+        self.log.summary = float(interval)
+        CLI.message_ok(
+            f"LOGGING A SUMMARY EVERY {float(interval):g}s",
+            print_func=self.__print_thread,
+        )
+
+    def follow(self, key: str):
+        """Keeps logging every message of the client with this ID or tag."""
+        self.log.follow.add(key)
+        CLI.message_ok(f"FOLLOWING {key}", print_func=self.__print_thread)
+
+    def unfollow(self, key: str):
+        self.log.follow.discard(key)
+        CLI.message_ok(f"STOPPED FOLLOWING {key}", print_func=self.__print_thread)
+
+    def show_routes(self):
+        routes = self.routes.snapshot()
+        if not routes:
+            CLI.message_error("NO MESSAGES ROUTED", print_func=self.__print_thread)
+            return
+        self.__print_("Routes")
+        CLI.table(routes, headers=["Source", "DEST", "Messages", "Bytes", "Dropped"])
+
     def __start_threads(self):
-        """Starts the threads for receiving and command line handling."""
-        self.__threads.extend(
-            [
-                threading.Thread(target=self.__receive),
-                threading.Thread(target=self.__command_line),
-            ]
+        """Starts the threads for receiving and, unless headless, the command line."""
+        self.__threads.append(
+            threading.Thread(
+                target=self.__receive_selector
+                if self.engine == "selector"
+                else self.__receive
+            )
         )
+        if not self.headless:
+            self.__threads.append(threading.Thread(target=self.__command_line))
         for thread in self.__threads:
             try:
                 thread.start()
@@ -565,7 +1237,8 @@ class Server:
                 )
 
     def run(self):
-        CLI.clear_terminal()
+        if not self.headless:
+            CLI.clear_terminal()
 
         if not self.__init_config():
             CLI.message_error("Failed to initialize config.")
@@ -580,8 +1253,24 @@ class Server:
             print_func=self.__print_thread,
         )
         self.sock.listen()
+        self.__load_commands()
+        if self.control is not None:
+            self.control.start()
+            CLI.message_ok(
+                f"CONTROL SOCKET {self.control.path}", print_func=self.__print_thread
+            )
         self.__start_threads()
         self.__join_threads()
+        if self.control is not None:
+            self.control.close()
+
+    def serve(self):
+        """Serves clients on the calling thread, without the command line."""
+        self.sock.listen()
+        if self.engine == "selector":
+            self.__receive_selector()
+        else:
+            self.__receive()
 
     def show_help_menu(self):
         from cli_commands import CLI_DEFAULT_COMMANDS
@@ -593,25 +1282,17 @@ class Server:
         self.__print_thread(results[0])
         self.__print_thread(results[1])
 
-    def __log_send(self, message, addr):
+    def __log_send(self, message, addr, node=None):
         if LOG:
-            output = (
-                f"[LOG - {time.strftime('%X')}] {CLI.color('steelblue', 'SENDING:')}\n"
-            )
-            output += f'{str(message):<{LOG_PADDING}} {"-->":<{LOG_PADDING}} {addr}\n'
-            self.__print_thread(output, clr="gray")
+            self.log.send(message, addr, node)
 
-    def __log_receive(self, message, addr):
+    def __log_receive(self, message, addr, node=None):
         if LOG:
-            output = (
-                f"[LOG - {time.strftime('%X')}] {CLI.color('tomato', 'RECEIVED:')}\n"
-            )
-            output += f'{str(message):<{LOG_PADDING}} {"<--":<{LOG_PADDING}} {addr}\n'
-            self.__print_thread(output, clr="gray")
+            self.log.receive(message, addr, node)
 
     def __get_socket_address(self, socket_obj: socket.socket) -> str:
         peer_name = socket_obj.getpeername()
-        return CLI.color("aquamarine", f"{str(peer_name[0])} : {str(peer_name[1])}")
+        return f"{peer_name[0]}:{peer_name[1]}"
 
     def __print_thread(self, *args, **kwargs):
         kwargs = {**{"sep": " ", "end": "\n"}, **kwargs}
@@ -627,9 +1308,10 @@ class Server:
         )
 
     def __is_active(self, stream, timeout=1):
+        # Also returns as soon as shutdown writes to the wake socket
         if type(stream) is socket.socket:
-            ready, _, _ = select.select([stream], [], [], timeout)
-            return ready
+            ready, _, _ = select.select([stream, self.__wake_receive], [], [], timeout)
+            return stream in ready
         else:
             if os.name == "nt":  # for Windows
                 import msvcrt
@@ -642,8 +1324,516 @@ class Server:
                     if time.time() - start_time > timeout:
                         return False
             else:  # for Unix/Linux/MacOS/BSD/etc
-                ready, _, _ = select.select([stream], [], [], timeout)
-                return bool(ready)
+                ready, _, _ = select.select(
+                    [stream, self.__wake_receive], [], [], timeout
+                )
+                return stream in ready
+
+
+class AsyncServer:
+    """
+    Server built on `asyncio.start_server`, with one coroutine per client
+    instead of one thread. Hooks and handlers may be plain functions or
+    `async def` coroutines. A hook that awaits I/O only pauses its own client.
+    Uses the same config file, INIT flow and `Protocol` messages as `Server`.
+    """
+
+    def __init__(
+        self,
+        host=DEFAULT_GATEWAY,
+        port=5000,
+        send_hook=None,
+        receive_hook=None,
+        batch_hook=None,
+        heartbeat=HEARTBEAT_INTERVAL,
+        log_file=None,
+    ):
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        sinks = [ConsoleSink()]
+        if log_file is not None:
+            sinks.append(JsonLinesSink(log_file))
+        self.log = MessageLog(sinks)
+        self.config = ConfigStore()
+        self.server = None
+        self.__clients = ClientRegistry()
+        self.__clients.listeners.append(self.__on_registry)
+        self.__writers = {}
+        self.routes = RouteCounters()
+        self.__loop = None
+        # Set by shutdown, the event is set once the last client has left
+        self.__drained = None
+
+        self.send_hook = send_hook
+        self.receive_hook = receive_hook
+        self.batch_hook = batch_hook
+        self.__initialize_handlers()
+
+        self.dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.config_path = os.path.join(self.dir_path, "config.json")
+        self.config_schema_path = os.path.join(self.dir_path, "config_schema.json")
+
+    @property
+    def max_clients(self) -> int:
+        return self.config.max_clients
+
+    @property
+    def clients(self) -> list:
+        return list(self.__clients.snapshot())
+
+    def run(self):
+        if not self.config.load(self.config_path, self.config_schema_path):
+            CLI.message_error("Failed to initialize config.")
+            return
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self):
+        self.__loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(
+            self.__handle_client, self.host, self.port, backlog=socket.SOMAXCONN
+        )
+        CLI.message_ok(f"SERVER STARTED {self.host}:{self.port}")
+        CLI.message_caution(f"Configured For MAX {self.max_clients} clients.")
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def shutdown(self, deadline: float = SHUTDOWN_DEADLINE):
+        """Drains clients like `Server.shutdown`."""
+        began = time.perf_counter()
+        CLI.message_caution("STOPPING SERVER...")
+        self.__drained = asyncio.Event()
+        connected = len(self.__clients)
+        if connected == 0:
+            self.__drained.set()
+        await self.broadcast(Protocols.SHUTDOWN)
+        try:
+            await asyncio.wait_for(self.__drained.wait(), deadline)
+        except asyncio.TimeoutError:
+            pass
+        remaining = self.__clients.snapshot()
+        for client in remaining:
+            self.__close(client)
+        self.server.close()
+        self.log.close()
+        CLI.message_error(
+            f"SERVER SHUTDOWN in {time.perf_counter() - began:.2f}s, "
+            f"{connected - len(remaining)}/{connected} clients acknowledged"
+        )
+
+    async def __handle_client(self, reader, writer):
+        if self.__drained is not None:
+            writer.close()
+            return
+        client = None
+        try:
+            client = await self.__initialize_client(reader, writer)
+            if client is None:
+                return
+            while True:
+                data = await reader.read(RECEIVE_SIZE)
+                if not data:
+                    break
+                client.last_seen = time.monotonic()
+                messages = client.frames.feed(data)
+                acks = client.transfers.take_acks()
+                if acks:
+                    await self.__send_data(client, acks)
+                for message in messages:
+                    self.__log_receive(message, client.network_string, client)
+                    if await self.__process_message(client, message, is_receiving=True):
+                        return
+        except (ConnectionError, ProtocolError):
+            pass
+        except Exception:
+            # Any other failure ends this client only, never the server
+            CLI.message_exception(f"CLIENT ERROR: {writer.get_extra_info('peername')}")
+        finally:
+            if client is None:
+                writer.close()
+            else:
+                self.__close(client)
+
+    async def __initialize_client(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        client_ip = str(sock.getpeername()[0])
+        config_data = self.config.match(client_ip)
+
+        if config_data is not None:
+            # Sends go through the StreamWriter, the Node needs no OutboundQueue
+            client = Node(sock, config_data=config_data, outbound=False)
+            self.__clients.add(client)
+            self.__writers[client] = writer
+            try:
+                await self.__send_data(client, Protocols.init_success(client.ID))
+            except BaseException:
+                self.__close(client)
+                raise
+            CLI.message_ok(f"CLIENT CONNECTED: {str(client.network_string)}")
+            return client
+
+        if len(self.__clients) == self.max_clients:
+            CLI.message_error("MAX CLIENTS CONNECTED")
+            writer.close()
+            return None
+
+        config_data = self.config.pop()
+        if config_data is None:
+            writer.close()
+            return None
+        handshake = Handshake(sock, self.config, config_data)
+        await self.__write(writer, [handshake.offer()])
+
+        # The client drops this connection once it has changed its IP
+        while not handshake.finished:
+            try:
+                data = await asyncio.wait_for(
+                    reader.read(RECEIVE_SIZE),
+                    max(0, handshake.deadline - time.monotonic()),
+                )
+                if not data:
+                    raise ConnectionResetError("Connection closed by peer")
+                replies = handshake.feed(handshake.frames.feed(data))
+                if replies:
+                    await self.__write(writer, replies)
+                    CLI.line()
+                    CLI.message_caution(f"CLIENT CONFIGURING: {config_data['IP']}")
+            except Exception:
+                # Whatever the peer sent, its entry is released
+                handshake.close()
+        writer.close()
+        if handshake.state is HandshakeState.REJECTED:
+            CLI.message_error("CLIENT NOT CONFIGURED")
+        return None
+
+    async def __process_message(self, client, message: Protocol, is_receiving=False):
+        if not message:
+            CLI.message_caution("GOT EMPTY MESSAGE")
+            return False
+
+        if is_receiving and message.seq and client.requests.resolve(message):
+            return False
+
+        # Routed before the handlers and hooks, without decoding the body
+        if (
+            is_receiving
+            and message.dest
+            and message.protocol_type is ProtocolType.DIRECT
+        ):
+            await self.route(message, client)
+            return False
+
+        if message.protocol_type is ProtocolType.BATCH:
+            messages = message.unbatch()
+            if self.batch_hook is not None:
+                if await AsyncServer.__call(
+                    self.batch_hook, self, client, message, messages
+                ):
+                    return True
+            for sub_message in messages:
+                if await self.__process_message(client, sub_message, is_receiving):
+                    return True
+            return False
+
+        if message.protocol_type is ProtocolType.STREAM and is_receiving:
+            if message.state == ProtocolState.REQ_AWK:
+                await self.__send_data(client, client.transfers.accept(message))
+            else:
+                client.transfers.acknowledge(message)
+            return False
+
+        handler = self.__handlers[is_receiving].get(message.method)
+        if handler is not None:
+            return await AsyncServer.__call(handler, client, message)
+
+        if self.receive_hook is not None and is_receiving:
+            return await AsyncServer.__call(self.receive_hook, self, client, message)
+
+        if self.send_hook is not None and not is_receiving:
+            return await AsyncServer.__call(self.send_hook, self, client, message)
+
+        # If no other cases have been hit, send the message to the client
+        if not is_receiving:
+            if message.protocol_type is ProtocolType.BROADCAST:
+                await self.broadcast(message, exclude=client)
+            else:
+                await self.__send_data(client, message)
+
+        return False
+
+    @staticmethod
+    async def __call(function, *args):
+        result = function(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def __initialize_handlers(self):
+        # Built-in handlers, keyed by whether the message is being received
+        self.__handlers = {
+            True: {
+                ProtocolMethod.EXIT: self.__handle_exit,
+                ProtocolMethod.INIT: self.__handle_init,
+                ProtocolMethod.SHOW: self.__handle_show,
+                ProtocolMethod.COMMAND: self.__handle_command,
+                ProtocolMethod.PING: self.__handle_ping,
+                ProtocolMethod.PONG: self.__handle_pong,
+            },
+            False: {
+                ProtocolMethod.EXIT: self.__handle_exit,
+                ProtocolMethod.SHOW: self.__handle_show,
+                ProtocolMethod.COMMAND: self.__handle_command,
+            },
+        }
+
+    def register_handler(
+        self, method: ProtocolMethod or str, function, is_receiving: bool = True
+    ):
+        """
+        Routes every message of `method` to `function(server, client, message)`,
+        which may be a coroutine function. Works like `Server.register_handler`.
+        """
+        if type(method) is not ProtocolMethod:
+            if str(method).upper() not in ProtocolMethod.__members__:
+                raise ValueError(f"Unknown METHOD '{method}'")
+            method = ProtocolMethod[str(method).upper()]
+        self.__handlers[is_receiving][method] = lambda client, message: function(
+            self, client, message
+        )
+
+    async def __handle_exit(self, client, message: Protocol):
+        if message.state == ProtocolState.REQ_AWK:
+            await self.__send_data(client, Protocols.EXIT_AWK)
+            self.__close(client)
+            return True
+        if message.state == ProtocolState.AWK:
+            self.__close(client)
+            return True
+        return False
+
+    def __handle_init(self, client, message: Protocol):
+        # Client accepted some of the features offered in INIT SUCCESS
+        if message.state == ProtocolState.AWK:
+            client.features = (
+                ProtocolFeature.decode(message.content) & SUPPORTED_FEATURES
+            )
+        return False
+
+    def __handle_show(self, client, message: Protocol):
+        self.show_clients()
+        return False
+
+    async def __handle_command(self, client, message: Protocol):
+        await self.__send_data(client, message)
+        return False
+
+    async def __handle_ping(self, client, message: Protocol):
+        await self.__drain(client, Protocols.PONG.to_network(features=client.features))
+        return False
+
+    def __handle_pong(self, client, message: Protocol):
+        return False
+
+    def __on_registry(self, event: str, client: Node):
+        if event == "add":
+            if self.heartbeat:
+                client.heartbeat = WHEEL.schedule(
+                    self.heartbeat, self.__wake_heartbeat, client
+                )
+            return
+        if client.heartbeat is not None:
+            client.heartbeat.cancel()
+        self.config.release(str(client.IP))
+        if self.__drained is not None and len(self.__clients) == 0:
+            self.__drained.set()
+
+    def __wake_heartbeat(self, client: Node):
+        # The wheel's thread hands the check to the event loop
+        try:
+            self.__loop.call_soon_threadsafe(self.__check_heartbeat, client)
+        except RuntimeError:
+            pass
+
+    def __check_heartbeat(self, client: Node):
+        writer = self.__writers.get(client)
+        if writer is None:
+            return
+        quiet = time.monotonic() - client.last_seen
+        if quiet >= self.heartbeat * HEARTBEAT_MISSES:
+            CLI.message_error(f"CLIENT TIMED OUT: {client.network_string} ({quiet:.0f}s)")
+            self.__close(client)
+            return
+        if quiet >= self.heartbeat and not writer.transport.get_write_buffer_size():
+            writer.write(Protocols.PING.to_network(features=client.features))
+        client.heartbeat = WHEEL.schedule(self.heartbeat, self.__wake_heartbeat, client)
+
+    async def send(self, client: Node, message: Protocol):
+        await self.__send_data(client, message)
+
+    async def send_many(self, client: Node, messages: list):
+        """Pipelines several messages to one client in a single write."""
+        await self.__send_data(client, messages)
+
+    async def request(
+        self, client: Node, message: Protocol, timeout: float = REQUEST_TIMEOUT
+    ) -> Protocol:
+        """Sends a message and returns the client's reply, see `Server.request`."""
+        future = client.requests.request(message, timeout)
+        await self.__send_data(client, message)
+        return await asyncio.wrap_future(future)
+
+    def stream(
+        self, client: Node, method: ProtocolMethod, payload: bytes, args: str = ""
+    ) -> Transfer:
+        """
+        Streams a payload to a client as a chunked transfer, see `Server.stream`.
+        The transfer waits for acknowledgements on a worker thread, use
+        `await asyncio.to_thread(transfer.wait)` to wait for it.
+        """
+        transfer = client.transfers.start(method, payload, args)
+
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(
+                self.__send_data(client, message), self.__loop
+            ).result()
+
+        def send_raw(data):
+            asyncio.run_coroutine_threadsafe(
+                self.__drain(client, data), self.__loop
+            ).result()
+
+        self.__loop.run_in_executor(
+            None, client.transfers.send, transfer, payload, send_message, send_raw
+        )
+        return transfer
+
+    async def broadcast(self, message: Protocol, exclude=None):
+        """
+        Encodes the message once per codec, like `Server.broadcast`, and drains
+        every client at the same time, so a slow client does not delay the rest.
+        """
+        if message == ProtocolMethod.INIT:
+            return
+
+        message.id = "Server"
+        clients = [client for client in self.__clients.snapshot() if client != exclude]
+        frames = {}
+        drains = []
+        for client in clients:
+            key = Protocol._frame_key("ascii", client.features)
+            if key not in frames:
+                frames[key] = message.to_network(features=client.features)
+            drains.append(self.__drain(client, frames[key]))
+        self.__log_send(message, f"{len(clients)} client(s)")
+        results = await asyncio.gather(*drains, return_exceptions=True)
+        for client, result in zip(clients, results):
+            if isinstance(result, ConnectionError):
+                self.__close(client)
+
+    async def disconnect_client(self, client: Node):
+        """Asks a client to disconnect, it is removed once it acknowledges."""
+        await self.__send_data(
+            client, Protocol(method=ProtocolMethod.EXIT, state=ProtocolState.REQ_AWK)
+        )
+
+    def __close(self, client: Node):
+        writer = self.__writers.pop(client, None)
+        if writer is None:
+            return
+        self.__clients.remove(client)
+        client.requests.cancel()
+        writer.close()
+        CLI.message_caution(f"CLIENT DISCONNECTED: {str(client.network_string)}")
+
+    async def __send_data(self, client: Node, message: Protocol or list):
+        messages = message if type(message) is list else [message]
+        for message in messages:
+            message["ID"] = "Server"
+        data = Protocol.pipeline(messages, node=client, features=client.features)
+        for message in messages:
+            self.__log_send(message, client.network_string, client)
+        await self.__drain(client, data)
+
+    async def route(self, message: Protocol, source: Node = None) -> bool:
+        """Forwards a message to the client its DEST names, see `Server.route`."""
+        Server.stamp(message, source)
+        target = self.__clients.get_by_id(message.dest) or self.__clients.get_by_tag(
+            message.dest
+        )
+        if target is None:
+            self.routes.drop(message.id, message.dest)
+            CLI.message_caution(f"NO CLIENT FOR DEST '{message.dest}'")
+            return False
+        frame = message.forward(target.features)
+        self.__log_send(message, target.network_string, target)
+        try:
+            await self.__drain(target, frame)
+        except ConnectionResetError:
+            self.routes.drop(message.id, message.dest)
+            return False
+        self.routes.count(message.id, message.dest, len(frame))
+        return True
+
+    def show_routes(self):
+        routes = self.routes.snapshot()
+        if not routes:
+            CLI.message_error("NO MESSAGES ROUTED")
+            return
+        CLI.message("Routes", "lime", width_fraction=LOG_MESSAGE_SIZE)
+        CLI.table(routes, headers=["Source", "DEST", "Messages", "Bytes", "Dropped"])
+
+    async def __drain(self, client: Node, data: bytes):
+        writer = self.__writers.get(client)
+        if writer is None:
+            raise ConnectionResetError("Client is disconnected")
+        writer.write(data)
+        await writer.drain()
+
+    async def __write(self, writer, messages: list):
+        # Handshake messages, sent before the connection has a Node
+        writer.write(Protocol.pipeline(messages))
+        for message in messages:
+            self.__log_send(message, "%s:%s" % writer.get_extra_info("peername")[:2])
+        await writer.drain()
+
+    def get_client_by_tag(self, tag: str) -> Node:
+        return self.__clients.get_by_tag(tag)
+
+    def get_clients_by_tag(self, tag: str) -> tuple:
+        return self.__clients.find("tag", tag)
+
+    def get_client_by_id(self, client_id: str) -> Node:
+        return self.__clients.get_by_id(client_id)
+
+    def get_client_by_ip(self, client_ip: str) -> Node:
+        return self.__clients.get_by_ip(client_ip)
+
+    def show_clients(self):
+        if len(self.__clients) == 0:
+            CLI.message_error("NO CLIENTS CONNECTED")
+            return
+        clients = self.__clients.snapshot()
+        data = [
+            list(node.get_data().values()) + [f"{node.idle:.1f}s ago"]
+            for node in clients
+        ]
+        headers = ["Index"] + list(clients[0].get_data().keys()) + ["Last seen"]
+        CLI.message("Connected Clients", "lime", width_fraction=LOG_MESSAGE_SIZE)
+        CLI.table(data, headers=headers, showindex=True)
+
+    def __log_send(self, message, addr, node=None):
+        if LOG:
+            self.log.send(message, addr, node)
+
+    def __log_receive(self, message, addr, node=None):
+        if LOG:
+            self.log.receive(message, addr, node)
 
 
 if __name__ == "__main__":
@@ -658,7 +1848,48 @@ if __name__ == "__main__":
         help="An IPv4 address in the format xxx.xxx.xxx.xxx",
     )
     parser.add_argument("-p", "--Port", type=int, default=5000, help="A port number")
+    parser.add_argument(
+        "-e",
+        "--Engine",
+        choices=ENGINES,
+        default="threads",
+        help="One thread per client, or one selector thread for all clients",
+    )
+    parser.add_argument(
+        "-q",
+        "--QueuePolicy",
+        choices=QUEUE_POLICIES,
+        default="drop_oldest",
+        help="What to do when a client's outbound queue is full",
+    )
+    parser.add_argument(
+        "-l",
+        "--LogFile",
+        type=str,
+        default=None,
+        help="Also log messages to this JSON-lines file, rotated by size",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="No terminal: plain JSON-lines output, commands on the control socket",
+    )
+    parser.add_argument(
+        "-c",
+        "--ControlSocket",
+        type=str,
+        default=None,
+        help=f"Path of the control socket, {CONTROL_PATH.format(name='server')} when headless",
+    )
     args = parser.parse_args()
 
-    server = Server(host=args.IPv4Address, port=args.Port)
+    server = Server(
+        host=args.IPv4Address,
+        port=args.Port,
+        engine=args.Engine,
+        queue_policy=args.QueuePolicy,
+        log_file=args.LogFile,
+        headless=args.headless,
+        control=args.ControlSocket,
+    )
     server.run()
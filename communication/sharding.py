@@ -0,0 +1,412 @@
+#!/bin/python3
+
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+from multiprocessing.connection import wait
+
+import lib_cli as CLI
+from protocol import FrameBuffer, Protocol
+from server import DEFAULT_GATEWAY, ENGINES, SHUTDOWN_DEADLINE, ConfigStore, Server
+
+# Seconds to wait for every worker to answer a `clients` query
+QUERY_TIMEOUT = 5.0
+
+
+class RoutingTable:
+    """
+    Which shard each client ID and tag is connected to. Every worker keeps a
+    copy, updated as clients connect to and disconnect from any shard.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.tags = {}
+
+    def add(self, shard: int, client_id: str, tags: list):
+        self.ids.setdefault(client_id, []).append(shard)
+        for tag in tags:
+            self.tags.setdefault(tag, []).append(shard)
+
+    def remove(self, shard: int, client_id: str, tags: list):
+        self.__discard(self.ids, client_id, shard)
+        for tag in tags:
+            self.__discard(self.tags, tag, shard)
+
+    def drop(self, shard: int):
+        """Forgets every client of a shard that stopped."""
+        for index in (self.ids, self.tags):
+            for key in list(index):
+                self.__discard(index, key, shard, every=True)
+
+    def find(self, kind: str, key: str) -> int:
+        shards = (self.ids if kind == "ID" else self.tags).get(key)
+        return shards[0] if shards else None
+
+    @staticmethod
+    def __discard(index: dict, key: str, shard: int, every: bool = False):
+        shards = index.get(key, [])
+        while shard in shards:
+            shards.remove(shard)
+            if not every:
+                break
+        if not shards:
+            index.pop(key, None)
+
+
+class Channel:
+    """
+    One end of the pipe between a worker and the parent. Connection.send is
+    not thread-safe and both ends send from more than one thread, so sends
+    take a lock, or two pickles could interleave on the pipe.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def send(self, request: tuple):
+        with self.lock:
+            try:
+                self.connection.send(request)
+            except (BrokenPipeError, OSError):
+                pass
+
+
+class Shard:
+    """
+    The worker side of a ShardedServer: one Server, and the pipe to the parent
+    process that relays routes and messages between the workers.
+    """
+
+    def __init__(self, index: int, pipe, server: Server):
+        self.index = index
+        self.pipe = pipe
+        self.channel = Channel(pipe)
+        self.server = server
+        self.routes = RoutingTable()
+        server.shard = self
+        server.registry.listeners.append(self.__announce)
+
+    def send_to_id(self, client_id: str, message: Protocol) -> bool:
+        """Sends to a client on any shard, returns False if no shard has it."""
+        return self.__route("ID", client_id, message)
+
+    def send_to_tag(self, tag: str, message: Protocol) -> bool:
+        """Sends to the first client with `tag` on any shard."""
+        return self.__route("tag", tag, message)
+
+    def route(self, message: Protocol) -> bool:
+        """Relays a routed message, as received, to the shard its DEST is on."""
+        for by in ("ID", "tag"):
+            shard = self.routes.find(by, message.dest)
+            if shard is not None:
+                frame = message.raw or message.to_network()
+                self.__post(("forward", shard, "DEST", message.dest, frame))
+                return True
+        return False
+
+    def broadcast(self, message: Protocol):
+        """Broadcasts to the clients of every shard."""
+        self.server.broadcast(message)
+        self.__post(("broadcast", self.index, message.to_network()))
+
+    def listen(self):
+        """Handles what the parent sends, until it asks the worker to stop."""
+        while True:
+            try:
+                request = self.pipe.recv()
+            except (EOFError, OSError):
+                request = ("stop", SHUTDOWN_DEADLINE)
+            kind = request[0]
+            if kind == "route":
+                _, event, shard, client_id, tags = request
+                if event == "add":
+                    self.routes.add(shard, client_id, tags)
+                else:
+                    self.routes.remove(shard, client_id, tags)
+            elif kind == "deliver":
+                _, by, key, frame = request
+                if by == "DEST":
+                    self.server.route(Shard.decode(frame), relay=False)
+                elif not self.__deliver(by, key, Shard.decode(frame)):
+                    CLI.message_caution(f"NO CLIENT FOR {by} '{key}'")
+            elif kind == "broadcast":
+                self.server.broadcast(Shard.decode(request[1]))
+            elif kind == "clients":
+                rows = [
+                    dict(
+                        Shard=self.index,
+                        **node.get_data(),
+                        Outbound=str(node.outbound),
+                        **{"Last seen": f"{node.idle:.1f}s ago"},
+                    )
+                    for node in self.server.registry.snapshot()
+                ]
+                self.__post(("clients", self.index, rows))
+            elif kind == "client":
+                self.server.show_client(request[1])
+            elif kind == "stop":
+                self.server.shutdown(request[1])
+                return
+
+    def __route(self, by: str, key: str, message: Protocol) -> bool:
+        if self.__deliver(by, key, message):
+            return True
+        shard = self.routes.find(by, key)
+        if shard is None:
+            return False
+        self.__post(("forward", shard, by, key, message.to_network()))
+        return True
+
+    def __deliver(self, by: str, key: str, message: Protocol) -> bool:
+        registry = self.server.registry
+        client = registry.get_by_id(key) if by == "ID" else registry.get_by_tag(key)
+        if client is None:
+            return False
+        self.server.send(client, message)
+        return True
+
+    def __announce(self, event: str, node):
+        self.__post(("route", event, self.index, node.ID, list(node.tags)))
+
+    def __post(self, request: tuple):
+        self.channel.send(request)
+
+    @staticmethod
+    def decode(frame: bytes) -> Protocol:
+        return FrameBuffer().feed(frame)[0]
+
+
+def run_worker(index: int, pipe, config: ConfigStore, server_args: dict):
+    server = Server(reuse_port=True, **server_args)
+    server.config = config
+    shard = Shard(index, pipe, server)
+    listener = threading.Thread(target=shard.listen, daemon=True)
+    listener.start()
+    pipe.send(("ready", index))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    listener.join()
+
+
+class ShardedServer:
+    """
+    Runs `workers` Server processes on the same port with SO_REUSEPORT, so the
+    kernel spreads connections, and the work of serving them, across cores.
+
+    This process relays between the workers and runs the command line. The
+    entries of the config file are handed out through shared memory, so each
+    one still goes to one client whichever worker accepts it.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        host=DEFAULT_GATEWAY,
+        port=5000,
+        **server_args,
+    ):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        self.workers = workers or os.cpu_count()
+        self.server_args = dict(server_args, host=host, port=port)
+        self.host = host
+        self.port = port
+        self.config = ConfigStore()
+        self.routes = RoutingTable()
+        self.replies = queue.Queue()
+        self.__pipes = []
+        # Sends to each pipe, from the router and the command line threads
+        self.__channels = []
+        self.__processes = []
+        self.__router = None
+        self.__ready = threading.Semaphore(0)
+
+        self.dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.config_path = os.path.join(self.dir_path, "config.json")
+        self.config_schema_path = os.path.join(self.dir_path, "config_schema.json")
+
+    def start(self) -> bool:
+        """Starts the workers and returns once they all accept connections."""
+        if not self.config.load(self.config_path, self.config_schema_path):
+            CLI.message_error("Failed to initialize config.")
+            return False
+        # Workers are forked, they inherit the hooks and the shared entry states
+        context = multiprocessing.get_context("fork")
+        size = len(self.config.content)
+        self.config.share(
+            context.RawArray("b", size), context.RawArray("d", size), context.Lock()
+        )
+
+        for index in range(self.workers):
+            pipe, child_pipe = context.Pipe()
+            process = context.Process(
+                target=run_worker,
+                args=(index, child_pipe, self.config, self.server_args),
+                daemon=True,
+            )
+            process.start()
+            child_pipe.close()
+            self.__pipes.append(pipe)
+            self.__channels.append(Channel(pipe))
+            self.__processes.append(process)
+
+        self.__router = threading.Thread(target=self.__route, daemon=True)
+        self.__router.start()
+        for _ in range(self.workers):
+            self.__ready.acquire()
+        return True
+
+    def run(self):
+        CLI.clear_terminal()
+        if not self.start():
+            return
+        CLI.message_ok(f"SERVER STARTED {self.host}:{self.port}")
+        CLI.message_caution(
+            f"{self.workers} workers, configured for MAX {self.config.max_clients} clients."
+        )
+        try:
+            self.__command_line()
+        except (KeyboardInterrupt, EOFError):
+            pass
+        self.shutdown()
+
+    def shutdown(self, deadline: float = SHUTDOWN_DEADLINE):
+        """Drains every worker at once, see `Server.shutdown`."""
+        CLI.message_caution("STOPPING SERVER...")
+        self.__post_all(("stop", deadline))
+        for process in self.__processes:
+            process.join()
+        CLI.message_error("SERVER SHUTDOWN")
+
+    def show_clients(self):
+        rows = self.clients()
+        if not rows:
+            CLI.message_error("NO CLIENTS CONNECTED")
+            return
+        headers = ["Index"] + list(rows[0].keys())
+        CLI.message("Connected Clients", "lime", width_fraction=75)
+        CLI.table([list(row.values()) for row in rows], headers=headers, showindex=True)
+
+    def show_client(self, client: int or str):
+        if str(client).isdigit():
+            rows = self.clients()
+            if int(client) >= len(rows):
+                CLI.message_error("INVALID CLIENT INDEX")
+                return
+            shard, client = rows[int(client)]["Shard"], rows[int(client)]["ID"]
+        else:
+            shard = self.routes.find("ID", client)
+            if shard is None:
+                CLI.message_error("INVALID CLIENT ID")
+                return
+        self.__post(shard, ("client", client))
+
+    def clients(self) -> list:
+        """The data of the clients of every worker, with the shard of each."""
+        while not self.replies.empty():
+            self.replies.get_nowait()
+        self.__post_all(("clients",))
+        rows = {}
+        try:
+            for _ in range(self.workers):
+                _, shard, shard_rows = self.replies.get(timeout=QUERY_TIMEOUT)
+                rows[shard] = shard_rows
+        except queue.Empty:
+            CLI.message_caution("A WORKER DID NOT ANSWER")
+        return [row for shard in sorted(rows) for row in rows[shard]]
+
+    def __route(self):
+        pipes = list(self.__pipes)
+        while pipes:
+            for pipe in wait(pipes):
+                shard = self.__pipes.index(pipe)
+                try:
+                    request = pipe.recv()
+                except (EOFError, OSError):
+                    pipes.remove(pipe)
+                    self.routes.drop(shard)
+                    continue
+                kind = request[0]
+                if kind == "ready":
+                    self.__ready.release()
+                elif kind == "route":
+                    _, event, _, client_id, tags = request
+                    if event == "add":
+                        self.routes.add(shard, client_id, tags)
+                    else:
+                        self.routes.remove(shard, client_id, tags)
+                    self.__post_all(request, exclude=shard)
+                elif kind == "forward":
+                    _, target, by, key, frame = request
+                    self.__post(target, ("deliver", by, key, frame))
+                elif kind == "broadcast":
+                    self.__post_all(("broadcast", request[2]), exclude=shard)
+                elif kind == "clients":
+                    self.replies.put(request)
+
+    def __post(self, shard: int, request: tuple):
+        self.__channels[shard].send(request)
+
+    def __post_all(self, request: tuple, exclude: int = None):
+        for shard in range(len(self.__pipes)):
+            if shard != exclude:
+                self.__post(shard, request)
+
+    def __command_line(self):
+        while True:
+            parts = input().split(" ")
+            command, args = parts[0].lower(), parts[1:]
+            if command in ("clients", "show_clients"):
+                self.show_clients()
+            elif command in ("client", "show_client") and args:
+                self.show_client(args[0])
+            elif command in ("exit", "quit", "kill"):
+                return
+            elif command in ("help", "h", "?"):
+                CLI.message("clients, client <index or ID>, exit", width_fraction=60)
+            elif command:
+                print("Invalid METHOD:\t", f'"{" ".join(parts)}"\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs one server process per core on the same port"
+    )
+    parser.add_argument(
+        "-ip",
+        "--IPv4Address",
+        type=str,
+        default=DEFAULT_GATEWAY,
+        help="An IPv4 address in the format xxx.xxx.xxx.xxx",
+    )
+    parser.add_argument("-p", "--Port", type=int, default=5000, help="A port number")
+    parser.add_argument(
+        "-w",
+        "--Workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of server processes",
+    )
+    parser.add_argument(
+        "-e",
+        "--Engine",
+        choices=ENGINES,
+        default="selector",
+        help="Engine of each server process",
+    )
+    args = parser.parse_args()
+
+    server = ShardedServer(
+        workers=args.Workers,
+        host=args.IPv4Address,
+        port=args.Port,
+        engine=args.Engine,
+    )
+    server.run()
@@ -0,0 +1,35 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# The modules live next to each other in communication/, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def tcp_pair():
+    """Makes connected (server side, client side) pairs of loopback TCP sockets."""
+    sockets = []
+
+    def connect() -> tuple:
+        listener = socket.create_server(("127.0.0.1", 0))
+        with listener:
+            client = socket.create_connection(listener.getsockname())
+            server, _ = listener.accept()
+        sockets.extend((server, client))
+        return server, client
+
+    yield connect
+    for sock in sockets:
+        sock.close()
+
+
+def node_entry(ID: str, tags: list = ()) -> dict:
+    return {
+        "ID": ID,
+        "IP": "127.0.0.1",
+        "SUBNET_MASK": "255.255.255.0",
+        "TAGS": list(tags),
+    }
@@ -0,0 +1,32 @@
+import json
+
+import lib_cli as CLI
+
+
+def report(plain: bool) -> list:
+    lines = []
+    CLI.set_plain(plain)
+    try:
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            CLI.message_exception("CLIENT ERROR", print_func=lines.append)
+    finally:
+        CLI.set_plain(False)
+    return lines
+
+
+def test_exception_is_one_json_line_when_plain():
+    lines = report(plain=True)
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["level"] == "ERROR"
+    assert record["message"].startswith("CLIENT ERROR\n")
+    assert "RuntimeError: boom" in record["message"]
+
+
+def test_exception_prints_the_traceback_under_the_message():
+    lines = report(plain=False)
+    assert len(lines) == 2
+    assert "CLIENT ERROR" in lines[0]
+    assert "RuntimeError: boom" in lines[1]
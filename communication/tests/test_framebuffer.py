@@ -0,0 +1,116 @@
+import socket
+
+import pytest
+
+from protocol import (
+    CHUNK_HEADER,
+    FRAME_HEADER,
+    FrameBuffer,
+    FrameError,
+    FrameFlag,
+    Protocol,
+    ProtocolError,
+    ProtocolFeature,
+    ProtocolMethod,
+    Transfers,
+)
+
+
+def messages(count: int) -> list:
+    return [
+        Protocol(method=ProtocolMethod.DEMO, content=f"message {i}", id="Node0")
+        for i in range(count)
+    ]
+
+
+def contents(parsed: list) -> list:
+    return [message.content for message in parsed]
+
+
+def test_merged_frames_are_all_parsed():
+    sent = messages(5)
+    parsed = FrameBuffer().feed(Protocol.pipeline(sent))
+    assert contents(parsed) == contents(sent)
+
+
+def test_split_frames_are_reassembled():
+    sent = messages(3)
+    frames = FrameBuffer()
+    parsed = []
+    for byte in Protocol.pipeline(sent):
+        parsed.extend(frames.feed(bytes([byte])))
+    assert contents(parsed) == contents(sent)
+
+
+def test_frame_larger_than_the_buffer_is_received():
+    sent = Protocol(method=ProtocolMethod.DEMO, content="x" * 10000, id="Node0")
+    frames = FrameBuffer(receive_size=64)
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(sent.to_network())
+        parsed = []
+        while not parsed:
+            parsed = frames.receive(b)
+    assert contents(parsed) == [sent.content]
+    assert len(frames.buffer) == 64
+
+
+def test_binary_frames_round_trip():
+    features = {ProtocolFeature.BINARY}
+    sent = Protocol(method=ProtocolMethod.DEMO, content="hi", id="Node0", dest="Node1")
+    frame = sent.to_network(features=features)
+    (header,) = FRAME_HEADER.unpack_from(frame)
+    assert FrameFlag(header >> 24) & FrameFlag.BINARY
+
+    (message,) = FrameBuffer().feed(frame)
+    assert (message.id, message.dest, message.content) == ("Node0", "Node1", "hi")
+    assert message.raw == frame
+
+
+def test_oversized_frame_raises():
+    frames = FrameBuffer(max_frame_size=16)
+    with pytest.raises(FrameError):
+        frames.feed(Protocol.frame(b"x" * 17))
+
+
+def test_invalid_frame_keeps_the_messages_around_it():
+    frames = FrameBuffer()
+    first, second = messages(2)
+    with pytest.raises(ProtocolError) as error:
+        frames.feed(first.to_network() + Protocol.frame(b"not json") + second.to_network())
+    assert not isinstance(error.value, FrameError)
+    assert contents(error.value.messages) == contents([first, second])
+    # Nothing is left over to be parsed or raised again
+    assert frames.feed(first.to_network())[0].content == first.content
+
+
+def test_invalid_frame_keeps_the_messages_of_the_same_receive():
+    frames = FrameBuffer()
+    first, second = messages(2)
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(first.to_network() + Protocol.frame(b"{") + second.to_network())
+        with pytest.raises(ProtocolError) as error:
+            frames.receive(b)
+    assert contents(error.value.messages) == contents([first, second])
+
+
+def test_invalid_binary_frame_raises():
+    with pytest.raises(ProtocolError):
+        FrameBuffer().feed(Protocol.frame(b"\xff" * 8, FrameFlag.BINARY))
+
+
+def test_chunk_without_transfers_raises_once():
+    frames = FrameBuffer()
+    (message,) = messages(1)
+    with pytest.raises(FrameError) as error:
+        frames.feed(message.to_network() + Protocol.chunk(1, 0, b"data"))
+    assert contents(error.value.messages) == [message.content]
+    # The stream is dropped, the next frame is read as a frame
+    assert contents(frames.feed(message.to_network())) == [message.content]
+
+
+def test_chunk_shorter_than_its_header_raises():
+    frame = Protocol.frame(b"x" * (CHUNK_HEADER.size - 1), FrameFlag.CHUNK)
+    with pytest.raises(FrameError):
+        FrameBuffer(transfers=Transfers()).feed(frame)
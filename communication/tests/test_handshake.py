@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from conftest import node_entry
+from protocol import FrameError, Protocol, ProtocolMethod, ProtocolState, Protocols
+from server import ConfigStore, Handshake, HandshakeState
+
+
+@pytest.fixture
+def config():
+    config = ConfigStore()
+    config.content = [node_entry("Node0"), node_entry("Node1")]
+    config.states = [ConfigStore.FREE] * 2
+    config.deadlines = [0.0] * 2
+    return config
+
+
+def offered(config) -> Handshake:
+    return Handshake(None, config, config.pop())
+
+
+def reply(method: ProtocolMethod, state: ProtocolState) -> Protocol:
+    return Protocol(method=method, state=state, id="Node0")
+
+
+def test_acknowledged_entry_is_pending_until_the_client_leaves(config):
+    handshake = offered(config)
+    assert config.queue == [node_entry("Node1")]
+
+    replies = handshake.feed([reply(ProtocolMethod.INIT, ProtocolState.AWK)])
+    assert replies == [Protocols.INIT_FAIL]
+    assert handshake.state is HandshakeState.CONFIGURING
+    assert list(config.pending) == ["127.0.0.1"]
+
+    handshake.close()
+    assert handshake.state is HandshakeState.CONFIGURED
+    assert handshake.finished
+    assert list(config.pending) == ["127.0.0.1"]
+
+
+def test_messages_after_the_reply_are_ignored(config):
+    handshake = offered(config)
+    replies = handshake.feed(
+        [
+            reply(ProtocolMethod.INIT, ProtocolState.AWK),
+            reply(ProtocolMethod.EXIT, ProtocolState.REQ_AWK),
+        ]
+    )
+    assert replies == [Protocols.INIT_FAIL]
+    assert handshake.state is HandshakeState.CONFIGURING
+
+
+@pytest.mark.parametrize(
+    "method, state",
+    [
+        (ProtocolMethod.INIT, ProtocolState.FAIL),
+        (ProtocolMethod.EXIT, ProtocolState.REQ_AWK),
+    ],
+)
+def test_declined_entry_goes_back(config, method, state):
+    handshake = offered(config)
+    assert handshake.feed([reply(method, state)]) == []
+    assert handshake.state is HandshakeState.REJECTED
+    assert config.queue == [node_entry("Node0"), node_entry("Node1")]
+
+
+def test_closed_while_offered_puts_the_entry_back(config):
+    handshake = offered(config)
+    handshake.close()
+    assert handshake.state is HandshakeState.REJECTED
+    assert config.pop() == node_entry("Node0")
+
+
+def test_garbage_from_the_client_releases_the_entry(config):
+    handshake = offered(config)
+    # What an engine does with whatever a step raises
+    with pytest.raises(FrameError):
+        handshake.frames.feed(b"\xff\xff\xff\xff")
+    handshake.close()
+    assert handshake.finished
+    assert config.queue == [node_entry("Node0"), node_entry("Node1")]
+
+
+def test_deadline():
+    config = ConfigStore()
+    config.content, config.states, config.deadlines = [node_entry("Node0")], [0], [0.0]
+    handshake = Handshake(None, config, config.pop(), timeout=0.01)
+    assert not handshake.expired
+    time.sleep(0.02)
+    assert handshake.expired
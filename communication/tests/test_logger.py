@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+
+from logger import JsonLinesSink, Level, MessageLog, Record
+from protocol import Protocol, ProtocolMethod
+
+THREADS = 8
+MESSAGES = 5000
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record: Record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+def record(content: str = "hi") -> Record:
+    record = Record(Level.INFO, True, "127.0.0.1:5000", Protocol(content=content))
+    # Every line the same length
+    record.time = 1.5
+    return record
+
+
+def test_one_in_every_n_messages_across_threads():
+    # Switching threads as often as possible, so unlocked counts would be lost
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    sink = ListSink()
+    log = MessageLog([sink], sample={ProtocolMethod.DEMO: 10})
+    message = Protocol(method=ProtocolMethod.DEMO, content="hi")
+
+    def send():
+        for _ in range(MESSAGES):
+            log.send(message, "peer")
+
+    try:
+        threads = [threading.Thread(target=send) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+        log.close()
+    assert len(sink.records) == THREADS * MESSAGES // 10
+
+
+def test_rotated_by_size_in_bytes(tmp_path):
+    path = str(tmp_path / "messages.jsonl")
+    line = len(record("é" * 50).json().encode("utf-8")) + 1
+    sink = JsonLinesSink(path, max_bytes=line * 3, backups=1)
+    try:
+        for _ in range(4):
+            sink.write(record("é" * 50))
+    finally:
+        sink.close()
+    assert os.path.getsize(path + ".1") == line * 3
+    assert os.path.getsize(path) == line
@@ -0,0 +1,141 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import node
+from conftest import node_entry
+from node import Node, OutboundQueue, QueueFull, Writer
+
+FRAME = b"x" * 1024
+MAX_BYTES = 64 * 1024
+
+
+@pytest.fixture
+def stalled():
+    """A socket whose peer never reads, with a small send buffer."""
+    sock, peer = socket.socketpair()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    yield sock, peer
+    sock.close()
+    peer.close()
+
+
+def fill(queue: OutboundQueue, frames: int = 1000):
+    for _ in range(frames):
+        queue.put(FRAME)
+
+
+def read_all(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    sock.settimeout(5)
+    while len(data) < size:
+        data += sock.recv(size - len(data))
+    return data
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        OutboundQueue(None, policy="wait")
+
+
+def test_default_policy_drops_the_oldest(stalled):
+    sock, _ = stalled
+    queue = OutboundQueue(sock, max_bytes=MAX_BYTES)
+    assert queue.policy == "drop_oldest"
+    fill(queue)
+    assert queue.dropped > 0
+    assert queue.bytes <= MAX_BYTES
+    assert queue.peak <= MAX_BYTES
+
+
+def test_drop_oldest_finishes_a_partly_written_frame():
+    sock, peer = socket.socketpair()
+    with sock, peer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        queue = OutboundQueue(sock, max_bytes=MAX_BYTES)
+        frames = [bytes([i % 256]) * 1000 for i in range(200)]
+        for frame in frames:
+            queue.put(frame)
+        assert queue.dropped > 0
+
+        # Whatever arrives is whole frames, in order
+        writer = threading.Thread(target=queue.drain)
+        writer.start()
+        data = read_all(peer, queue.sent * 1000 + queue.bytes)
+        writer.join()
+        received = [data[i : i + 1000] for i in range(0, len(data), 1000)]
+        assert all(len(set(frame)) == 1 for frame in received)
+        assert received == [frame for frame in frames if frame in received]
+
+
+def test_disconnect_raises_when_full(stalled):
+    sock, _ = stalled
+    queue = OutboundQueue(sock, max_bytes=MAX_BYTES, policy="disconnect")
+    with pytest.raises(QueueFull):
+        fill(queue)
+    assert queue.dropped == 0
+
+
+def test_block_times_out_without_holding_the_lock(stalled, monkeypatch):
+    monkeypatch.setattr(node, "QUEUE_TIMEOUT", 0.3)
+    sock, _ = stalled
+    queue = OutboundQueue(sock, max_bytes=MAX_BYTES, policy="block")
+    errors = []
+
+    def put():
+        try:
+            fill(queue)
+        except QueueFull as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=put)
+    thread.start()
+    time.sleep(0.1)
+    # Other senders and the Writer can take the lock while the sender waits
+    assert queue.lock.acquire(timeout=0.1)
+    queue.lock.release()
+    thread.join()
+    assert len(errors) == 1
+    assert queue.dropped == 0
+
+
+def test_block_waits_for_the_peer(stalled):
+    sock, peer = stalled
+    queue = OutboundQueue(sock, max_bytes=MAX_BYTES, policy="block")
+    size = 200 * len(FRAME)
+    reader = threading.Thread(target=lambda: received.append(read_all(peer, size)))
+    received = []
+    reader.start()
+    fill(queue, 200)
+    assert queue.drain(5)
+    reader.join()
+    assert received == [FRAME * 200]
+
+
+def test_writer_flushes_what_the_socket_did_not_take(stalled):
+    sock, peer = stalled
+    writer = Writer()
+    queue = OutboundQueue(sock, max_bytes=1024 * 1024, writer=writer)
+    try:
+        fill(queue, 200)
+        assert queue.frames
+        assert read_all(peer, 200 * len(FRAME)) == FRAME * 200
+    finally:
+        writer.close()
+
+
+def test_closed_queue_refuses_frames(stalled):
+    sock, _ = stalled
+    queue = OutboundQueue(sock)
+    queue.close()
+    with pytest.raises(ConnectionResetError):
+        queue.put(FRAME)
+
+
+def test_node_without_outbound_queue(tcp_pair):
+    server, _ = tcp_pair()
+    client = Node(server, config_data=node_entry("Node0"), outbound=False)
+    assert client.outbound is None
+    client.close()
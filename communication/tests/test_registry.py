@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+from node import ClientRegistry
+
+
+def client(ID: str, tags: list, port: int):
+    return SimpleNamespace(ID=ID, tags=tags, IP="127.0.0.1", address=("127.0.0.1", port))
+
+
+def test_lookups():
+    registry = ClientRegistry()
+    a, b = client("Node0", ["T0", "all"], 1000), client("Node1", ["T1", "all"], 1001)
+    registry.add(a)
+    registry.add(b)
+
+    assert registry.get_by_id("Node1") is b
+    assert registry.get_by_tag("all") is a
+    assert registry.find("tag", "all") == (a, b)
+    assert registry.get_by_ip("127.0.0.1") is a
+    assert registry.get_by_address(("127.0.0.1", "1001")) is b
+    assert ("127.0.0.1", 1000) in registry
+    assert registry.get_by_id("Node2") is None
+    assert list(registry) == [a, b]
+    assert registry[1] is b
+    assert len(registry) == 2
+
+
+def test_remove_updates_every_index():
+    registry = ClientRegistry()
+    a, b = client("Node0", ["all"], 1000), client("Node1", ["all"], 1001)
+    registry.add(a)
+    registry.add(b)
+
+    assert registry.remove(a)
+    assert not registry.remove(a)
+    assert registry.get_by_id("Node0") is None
+    assert registry.get_by_tag("all") is b
+    assert ("127.0.0.1", 1000) not in registry
+    registry.remove(b)
+    assert registry.find("tag", "all") == ()
+    assert len(registry) == 0
+
+
+def test_snapshot_is_not_changed_by_later_changes():
+    registry = ClientRegistry()
+    a = client("Node0", [], 1000)
+    registry.add(a)
+    snapshot = registry.snapshot()
+    registry.remove(a)
+    registry.add(client("Node1", [], 1001))
+    assert snapshot == (a,)
+
+
+def test_listeners_are_told_of_each_change():
+    registry = ClientRegistry()
+    events = []
+    registry.listeners.append(lambda event, node: events.append((event, node.ID)))
+    a = client("Node0", [], 1000)
+    registry.add(a)
+    registry.remove(a)
+    registry.remove(a)
+    assert events == [("add", "Node0"), ("remove", "Node0")]
@@ -0,0 +1,112 @@
+import pytest
+
+from conftest import node_entry
+from node import Node
+from protocol import FrameBuffer, Protocol, ProtocolFeature, ProtocolMethod, Protocols
+from server import Server
+
+
+@pytest.fixture
+def server():
+    server = Server(host="127.0.0.1", port=0, heartbeat=None)
+    yield server
+    server.sock.close()
+    server.log.close()
+
+
+@pytest.fixture
+def clients(server, tcp_pair):
+    """Two registered clients, and the sockets their peers read from."""
+
+    def connect(ID: str, tags: list) -> tuple:
+        sock, peer = tcp_pair()
+        client = Node(sock, config_data=node_entry(ID, tags))
+        server.registry.add(client)
+        return client, peer
+
+    return connect("Node0", ["T0"]), connect("Node1", ["T1"])
+
+
+def receive(sock) -> list:
+    sock.settimeout(5)
+    frames = FrameBuffer()
+    messages = []
+    while not messages:
+        messages = frames.receive(sock)
+    return messages
+
+
+def test_routed_with_the_registry_id_of_the_sender(server, clients):
+    (source, _), (_, peer) = clients
+    # The ID a client puts in its messages is its own choice
+    message = Protocol(method=ProtocolMethod.DEMO, content="hi", id="spoofed", dest="T1")
+
+    assert server.route(message, source)
+    (received,) = receive(peer)
+    assert (received.id, received.dest, received.content) == ("Node0", "T1", "hi")
+    assert server.routes.snapshot()[0][:3] == ["Node0", "T1", 1]
+
+
+def test_binary_frame_is_restamped_without_decoding_the_body(server, clients):
+    (source, _), (target, peer) = clients
+    features = {ProtocolFeature.BINARY}
+    target.features = features
+    frame = Protocol(
+        method=ProtocolMethod.DEMO, content="hi", id="spoofed", dest="Node1"
+    ).to_network(features=features)
+    (message,) = FrameBuffer().feed(frame)
+
+    assert server.route(message, source)
+    assert message.encoded_body() is not None
+    assert message.forward(features) is message.raw
+    (received,) = receive(peer)
+    assert (received.id, received.dest, received.content) == ("Node0", "Node1", "hi")
+    assert message.encoded_body() is not None
+
+
+def test_sign_keeps_the_frame_when_the_id_is_unchanged():
+    features = {ProtocolFeature.BINARY}
+    frame = Protocol(
+        method=ProtocolMethod.DEMO, content="hi", id="Node0", dest="Node1"
+    ).to_network(features=features)
+    (message,) = FrameBuffer().feed(frame)
+    message.sign("Node0")
+    assert message.raw == frame
+
+
+def test_json_frame_is_encoded_again(server, clients):
+    (source, _), (_, peer) = clients
+    frame = Protocol(
+        method=ProtocolMethod.DEMO, content="hi", id="spoofed", dest="Node1"
+    ).to_network()
+    (message,) = FrameBuffer().feed(frame)
+
+    assert server.route(message, source)
+    (received,) = receive(peer)
+    assert (received.id, received.content) == ("Node0", "hi")
+
+
+def test_init_success_tells_the_client_its_id():
+    message = Protocols.init_success("Node3")
+    assert message == ProtocolMethod.INIT
+    assert message.dest == "Node3"
+    assert Protocols.INIT_SUCCESS.dest == ""
+
+
+def test_unknown_dest_is_counted_as_dropped(server, clients):
+    (source, _), _ = clients
+    message = Protocol(method=ProtocolMethod.DEMO, content="hi", dest="Node9")
+    assert not server.route(message, source)
+    assert server.routes.snapshot() == [["Node0", "Node9", 0, 0, 1]]
+
+
+def test_registered_handler_gets_parsed_messages(server, clients):
+    (source, _), _ = clients
+    handled = []
+    server.register_handler("demo", lambda server, client, message: handled.append(message))
+    frame = Protocol(method=ProtocolMethod.DEMO, content="hi").to_network()
+    (message,) = FrameBuffer().feed(frame)
+
+    server._Server__process_message(source, message, is_receiving=True)
+    assert [message.content for message in handled] == ["hi"]
+    assert ProtocolMethod.DEMO in {ProtocolMethod["DEMO"]: None}
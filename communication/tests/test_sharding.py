@@ -0,0 +1,57 @@
+import multiprocessing
+import threading
+
+from sharding import Channel, RoutingTable
+
+THREADS = 8
+REQUESTS = 100
+# Larger than a pipe's buffer, so each send takes several writes
+PAYLOAD = 256 * 1024
+
+
+def test_concurrent_posts_arrive_whole():
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    channel = Channel(sender)
+
+    def post(index: int):
+        for count in range(REQUESTS):
+            channel.send(("deliver", index, count, bytes([index]) * PAYLOAD))
+
+    threads = [
+        threading.Thread(target=post, args=(index,), daemon=True)
+        for index in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    received = {index: [] for index in range(THREADS)}
+    try:
+        for _ in range(THREADS * REQUESTS):
+            assert receiver.poll(10)
+            _, index, count, payload = receiver.recv()
+            assert payload == bytes([index]) * PAYLOAD
+            received[index].append(count)
+    finally:
+        # Senders still blocked on a failed run get a broken pipe
+        receiver.close()
+    for thread in threads:
+        thread.join()
+    assert all(counts == list(range(REQUESTS)) for counts in received.values())
+
+
+def test_send_to_a_closed_pipe_is_dropped():
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    receiver.close()
+    Channel(sender).send(("clients",))
+
+
+def test_routing_table():
+    routes = RoutingTable()
+    routes.add(0, "Node0", ["T"])
+    routes.add(1, "Node1", ["T"])
+    assert routes.find("ID", "Node1") == 1
+    assert routes.find("tag", "T") == 0
+    routes.remove(0, "Node0", ["T"])
+    assert routes.find("ID", "Node0") is None
+    assert routes.find("tag", "T") == 1
+    routes.drop(1)
+    assert routes.find("tag", "T") is None
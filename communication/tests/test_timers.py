@@ -0,0 +1,64 @@
+import threading
+import time
+
+from timers import TimerWheel
+
+TICK = 0.01
+
+
+def fired_after(wheel: TimerWheel, delay: float) -> float:
+    fired = threading.Event()
+    began = time.monotonic()
+    wheel.schedule(delay, fired.set)
+    assert fired.wait(delay + 1)
+    return time.monotonic() - began
+
+
+def test_timer_never_fires_early():
+    wheel = TimerWheel(tick=TICK, slots=8)
+    assert fired_after(wheel, 0.05) >= 0.05
+
+
+def test_delay_longer_than_a_turn():
+    # 0.25 s is three turns of an 8 slot wheel
+    wheel = TimerWheel(tick=TICK, slots=8)
+    elapsed = fired_after(wheel, 0.25)
+    assert 0.25 <= elapsed < 0.25 + 0.5
+
+
+def test_arguments_are_passed():
+    wheel = TimerWheel(tick=TICK, slots=8)
+    got = []
+    done = threading.Event()
+    wheel.schedule(0.01, lambda *args: (got.extend(args), done.set()), "a", 1)
+    assert done.wait(1)
+    assert got == ["a", 1]
+
+
+def test_cancelled_timer_does_not_fire():
+    wheel = TimerWheel(tick=TICK, slots=8)
+    fired = []
+    wheel.schedule(0.02, fired.append, "cancelled").cancel()
+    after = threading.Event()
+    wheel.schedule(0.05, after.set)
+    assert after.wait(1)
+    assert fired == []
+    assert len(wheel) == 0
+
+
+def test_failing_callback_does_not_stop_the_wheel():
+    wheel = TimerWheel(tick=TICK, slots=8)
+
+    def fail():
+        raise RuntimeError("callback failed")
+
+    wheel.schedule(0.01, fail)
+    assert fired_after(wheel, 0.03) >= 0.03
+
+
+def test_reset_drops_every_timer():
+    wheel = TimerWheel(tick=TICK, slots=8)
+    wheel.schedule(10, print)
+    wheel.reset()
+    assert len(wheel) == 0
+    assert wheel.thread is None
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from protocol import (
+    FrameBuffer,
+    FrameError,
+    Protocol,
+    ProtocolError,
+    ProtocolMethod,
+    ProtocolState,
+    ProtocolType,
+    Transfers,
+)
+
+
+def stream_request(transfer_id: int, size: int, **fields) -> Protocol:
+    return Protocol(
+        protocol_type=ProtocolType.STREAM,
+        method=ProtocolMethod.DEMO,
+        state=ProtocolState.REQ_AWK,
+        content=json.dumps({"TRANSFER": transfer_id, "SIZE": size, **fields}),
+        id="Node0",
+    )
+
+
+def stream_reply(transfer_id: int, state: ProtocolState, received: int) -> Protocol:
+    return Protocol(
+        protocol_type=ProtocolType.STREAM,
+        method=ProtocolMethod.DEMO,
+        state=state,
+        content=json.dumps({"TRANSFER": transfer_id, "RECEIVED": received}),
+    )
+
+
+def test_chunks_fill_their_transfer():
+    transfers = Transfers()
+    frames = FrameBuffer(transfers=transfers)
+    assert transfers.accept(stream_request(1, 6)).state is ProtocolState.AWK
+
+    assert frames.feed(Protocol.chunk(1, 0, b"abc")[:-1]) == []
+    (message,) = frames.feed(b"c" + Protocol.chunk(1, 3, b"def"))
+    assert bytes(message.payload) == b"abcdef"
+    assert message == ProtocolMethod.DEMO
+
+
+def test_chunk_out_of_sequence_raises():
+    transfers = Transfers()
+    transfers.accept(stream_request(1, 6))
+    frames = FrameBuffer(transfers=transfers)
+    with pytest.raises(FrameError):
+        frames.feed(Protocol.chunk(1, 3, b"def"))
+    assert frames.feed(Protocol.chunk(1, 0, b"abcdef"))[0].payload == b"abcdef"
+
+
+def test_transfer_limits():
+    transfers = Transfers(max_transfers=2, max_bytes=100)
+    assert transfers.accept(stream_request(1, 60)).state is ProtocolState.AWK
+    with pytest.raises(ProtocolError):
+        transfers.accept(stream_request(1, 10))
+    assert transfers.accept(stream_request(2, 60)).state is ProtocolState.FAIL
+    assert transfers.accept(stream_request(2, 40)).state is ProtocolState.AWK
+    assert transfers.accept(stream_request(3, 0)).state is ProtocolState.FAIL
+
+
+@pytest.mark.parametrize("window", ["x", None, [1], 0, -4])
+def test_invalid_window_is_refused(window):
+    reply = Transfers().accept(stream_request(1, 6, WINDOW=window))
+    assert reply.state is ProtocolState.FAIL
+
+
+def test_window_is_capped():
+    transfers = Transfers(window=1024)
+    transfers.accept(stream_request(1, 6, WINDOW=10**9))
+    assert transfers.incoming[1].window == 1024
+
+
+def test_invalid_request_raises():
+    request = stream_request(1, 6)
+    request.content = "[]"
+    with pytest.raises(ProtocolError):
+        Transfers().accept(request)
+
+
+def test_failure_is_final():
+    transfers = Transfers()
+    transfer = transfers.start(ProtocolMethod.DEMO, b"payload")
+    transfers.acknowledge(stream_reply(transfer.id, ProtocolState.FAIL, 0))
+    transfers.acknowledge(stream_reply(transfer.id, ProtocolState.AWK, 7))
+    assert transfer.failed
+    assert transfer.acknowledged == 7
@@ -0,0 +1,100 @@
+import math
+import os
+import threading
+import time
+
+# Timers fire up to one TICK late. A full turn of the wheel is SLOTS ticks,
+# longer delays wait in their slot for more than one turn
+TICK = 0.1
+SLOTS = 512
+
+
+class Timer:
+    """A callback scheduled on a TimerWheel."""
+
+    __slots__ = ("callback", "args", "rounds", "cancelled")
+
+    def __init__(self, callback, args: tuple, rounds: int):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self):
+        # Left in its slot and skipped when the slot comes up
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel. A timer goes in the slot its deadline falls in, with
+    the number of turns left until it is due, so scheduling and cancelling are
+    O(1) and each tick only visits one slot, however many timers are pending.
+
+    Callbacks run on the wheel's thread, started on first use, and must not
+    block it.
+    """
+
+    def __init__(self, tick: float = TICK, slots: int = SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.started = None
+
+    def schedule(self, delay: float, callback, *args) -> Timer:
+        """Calls `callback(*args)` after `delay` seconds."""
+        with self.lock:
+            if self.thread is None:
+                self.started = time.monotonic()
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+            # The tick at or after the deadline, so a timer never fires early
+            due = math.ceil((time.monotonic() + delay - self.started) / self.tick)
+            ticks = max(1, due - self.position)
+            timer = Timer(callback, args, (ticks - 1) // len(self.slots))
+            self.slots[(self.position + ticks) % len(self.slots)].append(timer)
+        return timer
+
+    def reset(self):
+        """Drops every timer, for a forked process that has no wheel thread."""
+        self.slots = [[] for _ in range(len(self.slots))]
+        self.position = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def __len__(self) -> int:
+        return sum(len(slot) for slot in self.slots)
+
+    def __run(self):
+        while True:
+            # Ticks are counted from the start, so a late tick does not add drift
+            delay = self.started + (self.position + 1) * self.tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.lock:
+                self.position += 1
+                index = self.position % len(self.slots)
+                due, waiting = [], []
+                for timer in self.slots[index]:
+                    if timer.cancelled:
+                        continue
+                    if timer.rounds > 0:
+                        timer.rounds -= 1
+                        waiting.append(timer)
+                    else:
+                        due.append(timer)
+                self.slots[index] = waiting
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    pass
+
+
+# Shared by every connection of the process
+WHEEL = TimerWheel()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=WHEEL.reset)